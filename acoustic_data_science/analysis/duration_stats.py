@@ -0,0 +1,264 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from acoustic_data_science import config, instrumentation
+
+# Duration classes, lower bound exclusive and upper inclusive (seconds).
+duration_class_edges = {
+    "short": (0, 0.5),
+    "med_short": (0.5, 5),
+    "med": (5, 3 * 60),
+    "long": (3 * 60, 20 * 60),
+}
+
+# Fixed-bin histograms of the durations between min_duration and
+# max_duration (inclusive, seconds), binned in units: name -> (bins,
+# min_duration, max_duration, units).
+histogram_binnings = {
+    "all_transients": (20, None, None, "minutes"),
+    "longer_than_3_minutes": (20, 3 * 60, None, "minutes"),
+    "shorter_than_3_minutes": (20, None, 3 * 60, "seconds"),
+    "shorter_than_15_seconds": (15, None, 15, "seconds"),
+}
+
+
+def get_duration_stats_paths(duration_stats_path=None):
+    if duration_stats_path is None:
+        duration_stats_path = config.duration_stats_path
+
+    return (
+        os.path.join(duration_stats_path, "bins.feather"),
+        os.path.join(duration_stats_path, "summary.feather"),
+    )
+
+
+def get_month_codes(months):
+    """
+    Returns the sorted unique months and the position of each row's month
+    in them.
+    """
+    return np.unique(np.asarray(months).astype("str"), return_inverse=True)
+
+
+def count_bins(month_codes, bin_indices, n_months, n_bins):
+    """
+    Counts the rows in each month and bin in a single bincount. Rows with a
+    bin index outside [0, n_bins) are not counted.
+    Returns an (n_months, n_bins) array.
+    """
+    valid = (bin_indices >= 0) & (bin_indices < n_bins)
+    return np.bincount(
+        month_codes[valid] * n_bins + bin_indices[valid],
+        minlength=n_months * n_bins,
+    ).reshape(n_months, n_bins)
+
+
+def get_duration_class_bins(durations):
+    """
+    Returns the duration class index of each duration, -1 or the number of
+    classes if it is in none of them.
+    """
+    edges = np.array(
+        [lower for lower, _ in duration_class_edges.values()]
+        + [list(duration_class_edges.values())[-1][1]]
+    )
+    return np.searchsorted(edges, durations, side="left") - 1, edges
+
+
+def get_histogram_bins(durations, bins, min_duration, max_duration, units):
+    """
+    Returns the histogram bin index of each duration (-1 if it is filtered
+    out) and the bin edges, in units. The edges are those np.histogram would
+    use for the filtered durations of every month together, so all months
+    share them, and the last bin includes its upper edge.
+    """
+    in_range = np.ones(len(durations), dtype="bool")
+    if min_duration is not None:
+        in_range &= durations >= min_duration
+    if max_duration is not None:
+        in_range &= durations <= max_duration
+
+    if units == "minutes":
+        durations = durations / 60
+
+    edges = np.histogram_bin_edges(durations[in_range], bins=bins)
+    bin_indices = np.searchsorted(edges, durations, side="right") - 1
+    bin_indices[durations == edges[-1]] = bins - 1
+    bin_indices[~in_range] = -1
+
+    return bin_indices, edges
+
+
+def bins_to_df(months, binning, counts, edges):
+    """
+    Returns counts, an (n_months, n_bins) array, as a long DataFrame with one
+    row per month and bin.
+    """
+    n_months, n_bins = counts.shape
+    return pd.DataFrame(
+        {
+            "binning": binning,
+            "month": np.repeat(months, n_bins),
+            "bin": np.tile(np.arange(n_bins), n_months),
+            "lower": np.tile(edges[:-1], n_months),
+            "upper": np.tile(edges[1:], n_months),
+            "count": counts.ravel(),
+        }
+    )
+
+
+def calc_summary(durations, month_codes, months):
+    """
+    Returns the number of transients and the min, max and standard deviation
+    of their durations in each month.
+    """
+    order = np.argsort(month_codes, kind="stable")
+    durations = durations[order]
+    counts = np.bincount(month_codes, minlength=len(months))
+    starts = np.cumsum(counts) - counts
+
+    summary_df = pd.DataFrame({"month": months, "count": counts})
+    if len(durations):
+        # Months are only ever present if they have a transient, so no bin
+        # is empty.
+        means = np.add.reduceat(durations, starts) / counts
+        deviations = durations - np.repeat(means, counts)
+        summary_df["min"] = np.minimum.reduceat(durations, starts)
+        summary_df["max"] = np.maximum.reduceat(durations, starts)
+        summary_df["std"] = np.sqrt(
+            np.add.reduceat(deviations**2, starts) / counts
+        )
+    else:
+        for column in ("min", "max", "std"):
+            summary_df[column] = np.empty(0)
+
+    return summary_df
+
+
+@instrumentation.instrumented
+def calc_duration_stats(whole_year_transients_df):
+    """
+    Bins the durations of the whole year transients table by month into the
+    duration classes and every histogram of histogram_binnings, one
+    searchsorted and bincount over the table for each.
+    Returns a long DataFrame of the count in each binning, month and bin
+    (see bins_to_df), the duration classes having the binning
+    'duration_class', and the summary of each month (see calc_summary).
+    """
+    durations = whole_year_transients_df["duration"].to_numpy(dtype="float64")
+    months, month_codes = get_month_codes(whole_year_transients_df["month"])
+
+    class_bins, class_edges = get_duration_class_bins(durations)
+    bins_dfs = [
+        bins_to_df(
+            months,
+            "duration_class",
+            count_bins(
+                month_codes, class_bins, len(months), len(class_edges) - 1
+            ),
+            class_edges,
+        )
+    ]
+
+    for binning, (
+        bins,
+        min_duration,
+        max_duration,
+        units,
+    ) in histogram_binnings.items():
+        bin_indices, edges = get_histogram_bins(
+            durations, bins, min_duration, max_duration, units
+        )
+        bins_dfs.append(
+            bins_to_df(
+                months,
+                binning,
+                count_bins(month_codes, bin_indices, len(months), bins),
+                edges,
+            )
+        )
+
+    return (
+        pd.concat(bins_dfs, ignore_index=True),
+        calc_summary(durations, month_codes, months),
+    )
+
+
+def write_duration_stats(whole_year_transients_df, duration_stats_path=None):
+    bins_path, summary_path = get_duration_stats_paths(duration_stats_path)
+    bins_df, summary_df = calc_duration_stats(whole_year_transients_df)
+
+    os.makedirs(os.path.dirname(bins_path), exist_ok=True)
+    bins_df.to_feather(bins_path)
+    summary_df.to_feather(summary_path)
+
+
+def read_duration_stats(duration_stats_path=None):
+    """
+    Returns the binned durations and monthly summary of the whole year
+    transients, binning them first if they haven't been or the transients
+    have changed since.
+    """
+    bins_path, summary_path = get_duration_stats_paths(duration_stats_path)
+    whole_year_transients_path = os.path.join(
+        config.processed_data_path,
+        "transient_timestamps_and_durations/whole_year.feather",
+    )
+
+    if not all(
+        os.path.exists(path)
+        and os.path.getmtime(path)
+        >= os.path.getmtime(whole_year_transients_path)
+        for path in (bins_path, summary_path)
+    ):
+        logging.info("Binning whole year transient durations.")
+        write_duration_stats(
+            pd.read_feather(
+                whole_year_transients_path, columns=["duration", "month"]
+            ),
+            duration_stats_path,
+        )
+
+    return pd.read_feather(bins_path), pd.read_feather(summary_path)
+
+
+def get_class_counts(bins_df):
+    """
+    Returns the number of transients in each duration class (columns) in
+    each month (index).
+    """
+    class_counts = bins_df[bins_df["binning"] == "duration_class"].pivot(
+        index="month", columns="bin", values="count"
+    )
+    class_counts.columns = list(duration_class_edges)
+    return class_counts
+
+
+def get_histograms(bins_df, binning):
+    """
+    Returns the months and the histogram (counts and bin edges) of each
+    month of a binning of histogram_binnings.
+    """
+    histograms_df = bins_df[bins_df["binning"] == binning]
+    months = histograms_df["month"].unique()
+
+    histograms = []
+    for month in months:
+        month_df = histograms_df[histograms_df["month"] == month]
+        histograms.append(
+            (
+                month_df["count"].to_numpy(),
+                np.append(
+                    month_df["lower"].to_numpy(), month_df["upper"].iloc[-1]
+                ),
+            )
+        )
+
+    return list(months), histograms
+
+
+if __name__ == "__main__":
+    bins_df, summary_df = read_duration_stats()
+    logging.info(f"\n{summary_df}")
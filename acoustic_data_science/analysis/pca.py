@@ -0,0 +1,300 @@
+import logging
+import os
+import numpy as np
+import pyarrow as pa
+
+from acoustic_data_science import config, helpers, instrumentation
+
+# 'incremental' accumulates the exact covariance of the bands batch by batch,
+# 'randomized' accumulates a CountSketch of the rows and takes a randomized
+# SVD of it.
+modes = ("incremental", "randomized")
+
+
+def get_tol_columns(schema):
+    start = schema.names.index("25")
+    stop = schema.names.index("25119")
+    return schema.names[start : stop + 1]
+
+
+def iter_tol_batches(feather_paths, batch_rows=None):
+    """
+    Yields the month name, timestamps and TOLs (a float64 (rows, bands)
+    array) of the processed months in batches of at most batch_rows rows.
+    The files are memory-mapped and read one record batch at a time, so only
+    a batch is ever held in memory.
+    """
+    if batch_rows is None:
+        batch_rows = config.batch_rows
+
+    for feather_path in feather_paths:
+        month_name = os.path.basename(feather_path).split(".")[0]
+        with pa.memory_map(feather_path) as source:
+            reader = pa.ipc.open_file(source)
+            tol_columns = get_tol_columns(reader.schema)
+            centi_db_columns = helpers.get_centi_db_columns(reader.schema)
+            for i in range(reader.num_record_batches):
+                record_batch = reader.get_batch(i)
+                for offset in range(0, record_batch.num_rows, batch_rows):
+                    batch = record_batch.slice(offset, batch_rows)
+                    tols = np.empty((batch.num_rows, len(tol_columns)))
+                    for j, column in enumerate(tol_columns):
+                        values = batch.column(column).to_numpy(
+                            zero_copy_only=False
+                        )
+                        if column in centi_db_columns:
+                            values = helpers.decode_centi_db(values)
+                        tols[:, j] = values
+
+                    yield month_name, batch.column("timestamp").to_numpy(
+                        zero_copy_only=False
+                    ), tols
+
+
+def update_moments(moments, tols, full_covariance=True):
+    """
+    Merges the row count, mean and co-moment (sum of the outer products of
+    the deviations from the mean, or only its diagonal if full_covariance is
+    False) of a batch of rows into moments, using the pairwise update of
+    Chan et al. so the result doesn't depend on the batch size.
+    """
+    n_batch = len(tols)
+    if n_batch == 0:
+        return moments
+
+    batch_mean = tols.mean(axis=0)
+    deviations = tols - batch_mean
+    if full_covariance:
+        batch_comoment = deviations.T @ deviations
+    else:
+        batch_comoment = (deviations**2).sum(axis=0)
+
+    if moments is None:
+        return {"n": n_batch, "mean": batch_mean, "comoment": batch_comoment}
+
+    n = moments["n"] + n_batch
+    delta = batch_mean - moments["mean"]
+    if full_covariance:
+        delta_comoment = np.outer(delta, delta)
+    else:
+        delta_comoment = delta**2
+
+    return {
+        "n": n,
+        "mean": moments["mean"] + delta * n_batch / n,
+        "comoment": moments["comoment"]
+        + batch_comoment
+        + delta_comoment * moments["n"] * n_batch / n,
+    }
+
+
+def update_sketch(sketch, row_sums, tols, rng):
+    """
+    Adds a batch of rows to a CountSketch: each row is added to a random row
+    of the sketch with a random sign. row_sums is the sketch of a column of
+    ones, used to centre the sketch once the mean is known.
+    """
+    sketch_rows = len(sketch)
+    hashes = rng.integers(0, sketch_rows, len(tols))
+    signs = rng.choice([-1.0, 1.0], len(tols))
+
+    row_sums += np.bincount(hashes, weights=signs, minlength=sketch_rows)
+    for j in range(tols.shape[1]):
+        sketch[:, j] += np.bincount(
+            hashes, weights=signs * tols[:, j], minlength=sketch_rows
+        )
+
+
+def randomized_svd(matrix, n_components, rng, n_oversamples=10, n_iter=4):
+    """
+    Returns the top n_components singular values and right singular vectors
+    of matrix, by the randomized range finder of Halko et al. with n_iter
+    power iterations.
+    """
+    n_random = min(n_components + n_oversamples, matrix.shape[1])
+    q = matrix @ rng.standard_normal((matrix.shape[1], n_random))
+    q, _ = np.linalg.qr(q)
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(matrix.T @ q)
+        q, _ = np.linalg.qr(matrix @ q)
+
+    _, singular_values, vt = np.linalg.svd(q.T @ matrix, full_matrices=False)
+    return singular_values[:n_components], vt[:n_components]
+
+
+def flip_signs(components):
+    """
+    Makes the largest loading of each component positive, so the components
+    don't depend on the mode or batch size.
+    """
+    largest = np.argmax(np.abs(components), axis=1)
+    signs = np.sign(components[np.arange(len(components)), largest])
+    return components * signs[:, np.newaxis]
+
+
+@instrumentation.instrumented
+def fit_pca(
+    feather_paths=None,
+    n_components=None,
+    mode=None,
+    standardise=True,
+    batch_rows=None,
+    sketch_rows=2**14,
+    seed=0,
+):
+    """
+    Fits a PCA of the TOL bands of every row of the processed months in one
+    streaming pass (see iter_tol_batches). If standardise is True the bands
+    are scaled to unit variance first, like StandardScaler in the PCA
+    notebooks.
+    Returns the model as a dict of the mode, row count, TOL columns, mean and
+    scale of each band, components (n_components, bands) and explained
+    variance and its ratio of each component.
+    """
+    if feather_paths is None:
+        feather_paths = helpers.get_feather_paths(
+            os.path.join(config.processed_data_path, "monthly_data")
+        )
+    if n_components is None:
+        n_components = config.pca_n_components
+    if mode is None:
+        mode = config.pca_mode
+    if mode not in modes:
+        raise ValueError(f"mode must be one of {modes}, not {mode}.")
+
+    with pa.memory_map(feather_paths[0]) as source:
+        tol_columns = get_tol_columns(pa.ipc.open_file(source).schema)
+
+    rng = np.random.default_rng(seed)
+    moments = None
+    sketch = np.zeros((sketch_rows, len(tol_columns)))
+    row_sums = np.zeros(sketch_rows)
+    for _, _, tols in iter_tol_batches(feather_paths, batch_rows):
+        if mode == "incremental":
+            moments = update_moments(moments, tols)
+        else:
+            moments = update_moments(moments, tols, full_covariance=False)
+            update_sketch(sketch, row_sums, tols, rng)
+
+    n = moments["n"]
+    if mode == "incremental":
+        variances = np.diag(moments["comoment"]) / n
+    else:
+        variances = moments["comoment"] / n
+    scale = np.sqrt(variances) if standardise else np.ones(len(tol_columns))
+    total_variance = (variances / scale**2).sum() * n / (n - 1)
+
+    if mode == "incremental":
+        covariance = moments["comoment"] / np.outer(scale, scale) / (n - 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:n_components]
+        explained_variance = eigenvalues[order]
+        components = eigenvectors[:, order].T
+    else:
+        centred_sketch = (sketch - np.outer(row_sums, moments["mean"])) / scale
+        singular_values, components = randomized_svd(
+            centred_sketch, n_components, rng
+        )
+        explained_variance = singular_values**2 / (n - 1)
+
+    return {
+        "mode": mode,
+        "n_rows": n,
+        "tol_columns": list(tol_columns),
+        "mean": moments["mean"],
+        "scale": scale,
+        "components": flip_signs(components),
+        "explained_variance": explained_variance,
+        "explained_variance_ratio": explained_variance / total_variance,
+    }
+
+
+def project(model, tols):
+    """
+    Returns the scores of rows of TOLs on the components of model as
+    float32.
+    """
+    return (
+        ((tols - model["mean"]) / model["scale"]) @ model["components"].T
+    ).astype("float32")
+
+
+def save_pca_model(model, pca_path=None):
+    if pca_path is None:
+        pca_path = config.pca_path
+
+    os.makedirs(pca_path, exist_ok=True)
+    np.savez(os.path.join(pca_path, "model.npz"), **model)
+
+
+def load_pca_model(pca_path=None):
+    if pca_path is None:
+        pca_path = config.pca_path
+
+    with np.load(os.path.join(pca_path, "model.npz")) as model:
+        return {
+            key: model[key].item() if model[key].ndim == 0 else model[key]
+            for key in model.files
+        }
+
+
+@instrumentation.instrumented
+def write_pca_scores(
+    model, feather_paths=None, pca_path=None, batch_rows=None
+):
+    """
+    Projects every row of the processed months onto the components of model
+    batch by batch and saves the scores of each month as float32 columns
+    pc1, pc2... with the timestamp, one feather per month in
+    pca_path/scores.
+    """
+    if feather_paths is None:
+        feather_paths = helpers.get_feather_paths(
+            os.path.join(config.processed_data_path, "monthly_data")
+        )
+    if pca_path is None:
+        pca_path = config.pca_path
+
+    scores_path = os.path.join(pca_path, "scores")
+    os.makedirs(scores_path, exist_ok=True)
+    schema = pa.schema(
+        [("timestamp", pa.timestamp("ns"))]
+        + [
+            (f"pc{i + 1}", pa.float32())
+            for i in range(len(model["components"]))
+        ]
+    )
+    options = pa.ipc.IpcWriteOptions(compression="lz4")
+
+    for feather_path in feather_paths:
+        month_name = os.path.basename(feather_path).split(".")[0]
+        month_scores_path = os.path.join(scores_path, month_name + ".feather")
+        logging.info(f"Writing PCA scores of {month_name}.")
+        with pa.ipc.new_file(
+            month_scores_path + ".tmp", schema, options=options
+        ) as writer:
+            for _, timestamps, tols in iter_tol_batches(
+                [feather_path], batch_rows
+            ):
+                scores = project(model, tols)
+                writer.write_batch(
+                    pa.record_batch(
+                        [pa.array(timestamps)] + list(scores.T), schema=schema
+                    )
+                )
+        os.replace(month_scores_path + ".tmp", month_scores_path)
+
+
+if __name__ == "__main__":
+    model = fit_pca()
+    for i, ratio in enumerate(model["explained_variance_ratio"]):
+        logging.info(
+            f"PC{i + 1} explains {ratio * 100:.2f} % of the variance."
+        )
+    logging.info(
+        "Total explained variance"
+        f" {model['explained_variance_ratio'].sum() * 100:.2f} %."
+    )
+
+    save_pca_model(model)
+    write_pca_scores(model)
@@ -0,0 +1,56 @@
+import pandas as pd
+import numpy as np
+import os
+
+from acoustic_data_science import config, helpers
+
+
+def iter_monthly_data(columns=None, data_path=None):
+    """
+    Yields the processed data one month at a time in time order, so that only
+    one month is ever held in memory.
+    """
+    if data_path is None:
+        data_path = os.path.join(config.processed_data_path, "monthly_data")
+
+    for feather_path in helpers.get_feather_paths(data_path):
+        yield helpers.read_processed_month(feather_path, columns=columns)
+
+
+def split_open_transient(chunk):
+    """
+    Splits chunk into its rows before any transient that is still loud at
+    the end of the chunk and the rows of that transient (None if there is
+    no open transient).
+    """
+    loud = chunk["loud"].values
+    if len(chunk) == 0 or not loud[-1]:
+        return chunk, None
+
+    # The open transient starts after the last quiet row.
+    quiet_rows = np.flatnonzero(~loud)
+    last_start = quiet_rows[-1] + 1 if len(quiet_rows) > 0 else 0
+    return (
+        chunk.iloc[:last_start].reset_index(drop=True),
+        chunk.iloc[last_start:],
+    )
+
+
+def carry_open_transients(chunks):
+    """
+    Re-splits the chunks so that none of them ends part way through a
+    transient. Rows of a transient that is still loud at the end of a chunk
+    are carried over to the start of the next chunk.
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+
+        chunk, carry = split_open_transient(chunk)
+
+        yield chunk
+
+    if carry is not None:
+        yield carry.reset_index(drop=True)
+
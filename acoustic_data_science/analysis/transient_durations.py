@@ -3,95 +3,250 @@ import numpy as np
 import logging
 import os
 
-from acoustic_data_science import config, helpers
+from acoustic_data_science import config, helpers, instrumentation
+from acoustic_data_science.analysis import duration_stats, streaming
+
+
+def find_runs(mask):
+    """
+    Returns the start and stop (exclusive) positions of each run of True
+    values in the boolean array mask.
+    """
+    mask = np.asarray(mask, dtype="bool")
+    edges = np.flatnonzero(np.diff(mask.astype("int8"), prepend=0, append=0))
+    return edges[::2], edges[1::2]
+
+
+@instrumentation.instrumented
+def segment_transients(df, tol_aggregates=False):
+    """
+    Finds every transient (run of consecutive loud rows) in df in a single
+    vectorised pass over the loud column.
+    Returns a DataFrame with one row per transient giving its start and stop
+    (exclusive) row positions in df, its start and end timestamps and its
+    duration (0.5 s per loud row). If tol_aggregates is True the mean, max
+    and energy sum (in dB) of each TOL band over the transient are added as
+    columns named e.g. 25_mean, 25_max and 25_energy.
+    """
+    loud = df["loud"].values
+    starts, stops = find_runs(loud)
+    timestamps = df["timestamp"].values
+
+    transients_df = pd.DataFrame(
+        {
+            "start": starts,
+            "stop": stops,
+            "timestamp": timestamps[starts],
+            "end_timestamp": timestamps[stops - 1],
+            "duration": (stops - starts) * 0.5,
+        }
+    )
 
+    if tol_aggregates:
+        tols_df = helpers.get_tols_df(df)
+        loud_tols = tols_df.values[loud].astype("float64")
+        # Start of each transient in the loud rows only.
+        loud_starts = np.cumsum(stops - starts) - (stops - starts)
+
+        aggregates = {}
+        if len(loud_starts) > 0:
+            aggregates["mean"] = np.add.reduceat(
+                loud_tols, loud_starts, axis=0
+            ) / (stops - starts)[:, np.newaxis]
+            aggregates["max"] = np.maximum.reduceat(
+                loud_tols, loud_starts, axis=0
+            )
+            aggregates["energy"] = 10 * np.log10(
+                np.add.reduceat(10 ** (loud_tols / 10), loud_starts, axis=0)
+            )
+        else:
+            for aggregate in ("mean", "max", "energy"):
+                aggregates[aggregate] = np.empty((0, tols_df.shape[1]))
+
+        for aggregate, values in aggregates.items():
+            for band, band_values in zip(tols_df.columns, values.T):
+                transients_df[f"{band}_{aggregate}"] = band_values
 
-def get_transient_durations(df):
-    # Mask df to only get loud rows.
-    df["index_group"] = df.index - np.arange(df.shape[0])
-    index_groups = df["index_group"].unique()
-
-    transient_durations = []
-    for index_group in index_groups:
-        transient_times = df[df["index_group"] == index_group][
-            "timestamp"
-        ].values
-        transient_durations.append(
-            (transient_times[-1] - transient_times[0]).astype("float") / 1e9
-            + 0.5
+    return transients_df
+
+
+def get_transient_energy_means(transients_df):
+    """
+    Returns the TOL bands and the energy mean (mean of 10**(TOL/10)) of each
+    band over each transient as an (n_transients, n_bands) array, from the
+    energy sums of segment_transients(df, tol_aggregates=True).
+    """
+    energy_columns = [
+        column
+        for column in transients_df.columns
+        if column.endswith("_energy")
+    ]
+    tol_columns = pd.Index(
+        [column[: -len("_energy")] for column in energy_columns]
+    )
+    lengths = (transients_df["stop"] - transients_df["start"]).to_numpy()
+    energy_means = (
+        10 ** (transients_df[energy_columns].to_numpy() / 10)
+        / lengths[:, np.newaxis]
+    )
+    return tol_columns, energy_means
+
+
+@instrumentation.instrumented
+def get_spectral_features(df, split_frequency=1000):
+    """
+    Returns a DataFrame with one row per transient in df giving its
+    timestamp, duration and spectral features from its energy averaged TOL
+    spectrum: the peak band frequency, the spectral centroid and bandwidth
+    (energy weighted mean and standard deviation of the band frequencies,
+    Hz) and the ratio of the energy below split_frequency to that above
+    (dB), followed by the spectrum itself (dB) in columns named after the
+    TOL bands.
+    """
+    transients_df = segment_transients(df, tol_aggregates=True)
+    tol_columns, energy_means = get_transient_energy_means(transients_df)
+    frequencies = tol_columns.astype("float").to_numpy()
+
+    total_energies = energy_means.sum(axis=1)
+    centroids = energy_means @ frequencies / total_energies
+    bandwidths = np.sqrt(
+        ((frequencies - centroids[:, np.newaxis]) ** 2 * energy_means).sum(
+            axis=1
         )
+        / total_energies
+    )
+    low = frequencies < split_frequency
+
+    features_df = pd.DataFrame(
+        {
+            "timestamp": transients_df["timestamp"].values,
+            "duration": transients_df["duration"].values,
+            "peak_frequency": frequencies[np.argmax(energy_means, axis=1)],
+            "centroid_frequency": centroids,
+            "bandwidth": bandwidths,
+            "low_high_ratio": 10
+            * np.log10(
+                energy_means[:, low].sum(axis=1)
+                / energy_means[:, ~low].sum(axis=1)
+            ),
+        }
+    )
+    spectra_df = pd.DataFrame(10 * np.log10(energy_means), columns=tol_columns)
+
+    return pd.concat([features_df, spectra_df], axis=1)
+
+
+@instrumentation.instrumented
+def get_transient_durations(df):
+    """
+    Takes a DataFrame with a loud column and returns the duration in seconds
+    of each transient, measured from the timestamps of its first and last
+    rows plus the 0.5 s of the last row.
+    """
+    transients_df = segment_transients(df)
+    transient_durations = (
+        transients_df["end_timestamp"] - transients_df["timestamp"]
+    ).values.astype("float") / 1e9 + 0.5
 
     # Cull any detected transient with length longer than 5 mins. Arbitrary for now.
     # transient_durations[i] = transient_durations[transient_durations < 5*60]
-    transient_durations = np.array(transient_durations)
     return transient_durations
 
 
+@instrumentation.instrumented
 def get_monthly_transit_durations():
+    """
+    Returns the month names and the transient durations of each processed
+    month. The months have different numbers of transients so they are
+    returned as a list of arrays. Durations are only calculated for months
+    processed since they were last saved, see
+    helpers.load_monthly_transient_durations.
+    """
     logging.info("Getting monthly transit durations.")
-    months = helpers.get_month_names(config.processed_data_path)
-    monthly_transient_durations = []
-
-    for feather_path in helpers.get_feather_paths(config.processed_data_path):
-        df = pd.read_feather(feather_path)
-        df = df[df["loud"]]
-        monthly_transient_durations.append(get_transient_durations(df))
+    month_names = []
+
+    for feather_path in helpers.get_feather_paths(
+        os.path.join(config.processed_data_path, "monthly_data")
+    ):
+        month_name = os.path.basename(feather_path).split(".")[0]
+        month_names.append(month_name)
+        durations_path = helpers.get_transient_durations_path(month_name)
+        if os.path.exists(durations_path) and os.path.getmtime(
+            durations_path
+        ) >= os.path.getmtime(feather_path):
+            continue
+
+        df = helpers.read_processed_month(
+            feather_path, columns=["timestamp", "loud"]
+        )
+        helpers.write_transient_durations(
+            month_name, get_transient_durations(df)
+        )
 
-    monthly_transient_durations = np.array(monthly_transient_durations)
+    # Forget months that are no longer processed.
+    for durations_path in helpers.get_feather_paths(
+        config.monthly_transient_durations_path
+    ):
+        if os.path.basename(durations_path).split(".")[0] not in month_names:
+            os.remove(durations_path)
 
-    return monthly_transient_durations
+    return helpers.load_monthly_transient_durations(with_months=True)
 
 
+@instrumentation.instrumented
 def get_transient_timestamps_and_durations(df, average_tols=False):
-    # Just get the loud events.
-    df = df[df["loud"]]
-
-    # Each transient has a number called transient_group.
-    # Half-seconds in the same transient have the same transient_group.
-    df.loc[:, "transient_group"] = df.index - np.arange(df.shape[0])
-    # Recover the original index lost by grouping.
-    # =========================================================================
-    df.loc[:, "duration"] = np.full(len(df), 0.5).tolist()
-    transient_groups_summed = df.groupby(['transient_group']).sum()
-    durations = transient_groups_summed["duration"]
+    """
+    Returns the first row of every transient in df with a duration column
+    (0.5 s per loud row). If average_tols is True the TOLs are the energy
+    average over the transient rather than those of its first row.
+    """
+    transients = segment_transients(df, tol_aggregates=average_tols)
 
-    # Starting index of transients gets lost when grouping.
-    # Recover by taking cumulative sum of the durations and divide by the duration length (0.5 s) to get the number of skipped rows.
-    durations_index = (durations.index + durations.cumsum(axis=0)/0.5 - np.ones(len(durations))).astype('int').values
-    # =========================================================================
-
-    transients_df = df[df.index.isin(durations_index)]
-    transients_df.loc[:, "duration"] = durations.values
-    transients_df.drop(columns=['transient_group'], inplace=True)
-
-    transients_df = transients_df.reset_index(drop=True)
+    transients_df = df.iloc[transients["start"].values].reset_index(drop=True)
+    transients_df["duration"] = transients["duration"].values
 
     if average_tols:
-        transients_df.loc[:, "25":"25119"] = transients_df.loc[:, "25":"25119"]#.div(transients_df["duration"]/0.5, axis=0)
-    
-    return transients_df
+        _, energy_means = get_transient_energy_means(transients)
+        transients_df.loc[:, "25":"25119"] = 10 * np.log10(energy_means)
 
+    return transients_df
 
 
 if __name__ == "__main__":
-    monthly_transient_durations = get_monthly_transit_durations()
-    np.save(
-        config.monthly_transient_durations_path, monthly_transient_durations
-    )
+    month_names, monthly_transient_durations = get_monthly_transit_durations()
+    for month_name, transient_durations in zip(
+        month_names, monthly_transient_durations
+    ):
+        logging.info(f"{month_name}: {len(transient_durations)} transients.")
 
     # Create monthly transient duration and timestamp files
     monthly_feather_paths = helpers.get_feather_paths(config.processed_data_path + '/monthly_data')
     month_names = helpers.get_month_names(config.processed_data_path + '/monthly_data')
     for monthly_feather_path, month_name in zip(monthly_feather_paths, month_names):
-        df = pd.read_feather(monthly_feather_path).drop(columns=['unnormalised_broadband_spl', "short_transient"])
+        df = helpers.read_processed_month(monthly_feather_path).drop(columns=['unnormalised_broadband_spl', "short_transient"])
         transients_df = get_transient_timestamps_and_durations(df, average_tols=True)
         transients_df.to_feather(os.path.join(config.processed_data_path,f'transient_timestamps_and_durations/{month_name}.feather'))
-
-    # Create year long transient durations and timestamps file 
-    whole_year_df = pd.read_feather(config.processed_data_path + '/whole_year/whole_year.feather')
-    whole_year_df["loud"] = whole_year_df["broadband_spl"] > whole_year_df["background_spl"] + 10
-    whole_year_transients_df = get_transient_timestamps_and_durations(whole_year_df)
+        spectral_features_path = os.path.join(config.processed_data_path, f'transient_timestamps_and_durations/spectral_features/{month_name}.feather')
+        os.makedirs(os.path.dirname(spectral_features_path), exist_ok=True)
+        get_spectral_features(df).to_feather(spectral_features_path)
+
+    # Create year long transient durations and timestamps file, streaming
+    # one month at a time and carrying transients still open at the end of a
+    # month over to the next.
+    monthly_chunks = streaming.carry_open_transients(
+        streaming.iter_monthly_data(
+            columns=["timestamp", "broadband_spl", "background_spl", "loud"]
+        )
+    )
+    whole_year_transients_df = pd.concat(
+        (
+            get_transient_timestamps_and_durations(chunk)
+            for chunk in monthly_chunks
+        ),
+        ignore_index=True,
+    )
     whole_year_transients_df = whole_year_transients_df.drop(columns=["loud"])
-    whole_year_transients_df["month"] = whole_year_transients_df['timestamp'].apply(lambda x: '{year}{month:02}'.format(year=x.year, month=x.month)).values
+    whole_year_transients_df["month"] = helpers.get_month_keys(whole_year_transients_df["timestamp"])
     whole_year_transients_df.to_feather(config.processed_data_path + '/transient_timestamps_and_durations/whole_year.feather')
+    duration_stats.write_duration_stats(whole_year_transients_df)
     whole_year_transients_df
\ No newline at end of file
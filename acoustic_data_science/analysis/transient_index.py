@@ -0,0 +1,133 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from acoustic_data_science import config, helpers
+
+
+def to_ns(timestamps):
+    return np.asarray(timestamps, dtype="datetime64[ns]").astype("int64")
+
+
+def build_transient_index(transients_df):
+    """
+    Returns a sorted interval index over a transients table with timestamp
+    (start) and duration (seconds) columns, such as the whole year
+    transients. The index is a dict of int64 ns arrays in start order:
+    'start', 'end' (exclusive, start plus duration), 'max_end' (the running
+    max of end, for overlap queries) and 'positions', the row of each
+    transient in transients_df.
+    """
+    starts = to_ns(transients_df["timestamp"])
+    ends = starts + np.round(
+        transients_df["duration"].to_numpy(dtype="float64") * 1e9
+    ).astype("int64")
+
+    if np.all(starts[:-1] <= starts[1:]):
+        positions = np.arange(len(starts))
+    else:
+        positions = np.argsort(starts, kind="stable")
+        starts = starts[positions]
+        ends = ends[positions]
+
+    return {
+        "start": starts,
+        "end": ends,
+        "max_end": np.maximum.accumulate(ends) if len(ends) else ends,
+        "positions": positions,
+    }
+
+
+def query_starting_between(index, start, end):
+    """
+    Returns the rows of the transients table of the transients starting in
+    [start, end), in start order, with two binary searches.
+    """
+    lo, hi = np.searchsorted(index["start"], to_ns([start, end]), side="left")
+    return index["positions"][lo:hi]
+
+
+def query_overlapping(index, start, end):
+    """
+    Returns the rows of the transients table of the transients that overlap
+    [start, end), in start order. Only the transients starting before end
+    whose running max end is after start are checked, found by binary
+    search.
+    """
+    start, end = to_ns([start, end])
+    hi = np.searchsorted(index["start"], end, side="left")
+    lo = np.searchsorted(index["max_end"][:hi], start, side="right")
+    overlapping = index["end"][lo:hi] > start
+    return index["positions"][lo:hi][overlapping]
+
+
+def asof_join(index, df, on="timestamp", columns=None, tolerance=None):
+    """
+    Returns the columns of df, a table sorted by its on column such as the
+    ice charts, as of the start of each transient: the values of the last
+    row of df at or before it, or NaN if there is none or it is more than
+    tolerance (a Timedelta) earlier. The rows are aligned with the
+    transients table.
+    """
+    if columns is None:
+        columns = [column for column in df.columns if column != on]
+
+    df_ns = to_ns(df[on])
+    matches = np.searchsorted(df_ns, index["start"], side="right") - 1
+    matched = matches >= 0
+    if tolerance is not None:
+        matched &= (
+            index["start"] - df_ns[np.maximum(matches, 0)]
+            <= pd.Timedelta(tolerance).value
+        )
+
+    joined_df = pd.DataFrame(index=np.arange(len(matches)))
+    for column in columns:
+        values = df[column].to_numpy()
+        if values.dtype.kind in "iub":
+            values = values.astype("float64")
+        joined = np.where(matched, values[np.maximum(matches, 0)], np.nan)
+        # Put the rows back in the order of the transients table.
+        aligned = np.empty_like(joined)
+        aligned[index["positions"]] = joined
+        joined_df[column] = aligned
+
+    return joined_df
+
+
+def read_ice_charts():
+    """
+    Returns the ice charts saved by processing/ice_coverage.py in time order.
+    """
+    return pd.read_csv(
+        config.processed_data_path
+        + "/cambridge_bay_sea_ice_properties_from_ice_charts.csv",
+        usecols=[
+            "timestamp",
+            "total_concentration",
+            "stage_of_development",
+            "form_of_ice",
+            "mean_temperature",
+        ],
+        parse_dates=["timestamp"],
+    ).sort_values("timestamp", ignore_index=True)
+
+
+if __name__ == "__main__":
+    whole_year_transients_df = pd.read_feather(
+        os.path.join(
+            config.processed_data_path,
+            "transient_timestamps_and_durations/whole_year.feather",
+        ),
+        columns=["timestamp", "duration"],
+    )
+    index = build_transient_index(whole_year_transients_df)
+    ice_df = asof_join(
+        index, read_ice_charts(), columns=["total_concentration"]
+    )
+    ice_df["day"] = helpers.get_day_keys(whole_year_transients_df["timestamp"])
+    logging.info(
+        "Number of transients and ice concentration of each day:\n"
+        f"{ice_df.groupby('day')['total_concentration'].agg(['size', 'first'])}"
+    )
@@ -1,17 +1,25 @@
 import pandas as pd
 import os
-from acoustic_data_science import config, helpers
+from acoustic_data_science import config, helpers, instrumentation
+from acoustic_data_science.analysis import streaming
 
-feather_paths = helpers.get_feather_paths(config.processed_data_path + '/monthly_data')
 
-df_generator = (
-    pd.read_feather(
-        feather_path, columns=["timestamp", "broadband_spl", "background_spl"]
+@instrumentation.instrumented
+def save_whole_year_feather():
+    """
+    Concatenates every processed month into whole_year.feather. The pipeline
+    streams the months instead (see analysis/streaming.py) so this is only
+    needed for exploring the whole year at once in the notebooks.
+    """
+    df_generator = streaming.iter_monthly_data(
+        columns=["timestamp", "broadband_spl", "background_spl"]
     )
-    for feather_path in feather_paths
-)
-pd.concat(df_generator, ignore_index=True).to_feather(
-    path=os.path.join(
-        config.processed_data_path, "whole_year", "whole_year.feather"
+    pd.concat(df_generator, ignore_index=True).to_feather(
+        path=os.path.join(
+            config.processed_data_path, "whole_year", "whole_year.feather"
+        )
     )
-)
+
+
+if __name__ == "__main__":
+    save_whole_year_feather()
@@ -0,0 +1,332 @@
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np
+import pandas as pd
+
+from acoustic_data_science import config, helpers, instrumentation
+from acoustic_data_science.analysis import transient_durations
+from acoustic_data_science.benchmarks import synthetic_data
+from acoustic_data_science.plotting import whole_year_spl
+from acoustic_data_science.processing import (
+    combine_csvs,
+    process_data,
+    spl_pyramid,
+)
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=config.project_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def copy_dataframes(values):
+    return [
+        value.copy() if isinstance(value, pd.DataFrame) else value
+        for value in values
+    ]
+
+
+def time_stage(results, stage, n_rows, function, *args, **kwargs):
+    """
+    Calls function(*args, **kwargs) and appends its wall time, CPU time and
+    throughput over n_rows (or over the row count the function returns if
+    n_rows is None) to results. The function is then called again on copies
+    of its DataFrame arguments, as stages modify them, to measure its peak
+    memory: the peak allocated by Python and NumPy (tracemalloc) and the peak
+    RSS above the RSS at the start of the call. The two are separate runs as
+    tracemalloc slows down every allocation.
+    Returns the result of the timed run.
+    """
+    memory_args = copy_dataframes(args)
+    memory_kwargs = dict(zip(kwargs, copy_dataframes(kwargs.values())))
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+
+    result = function(*args, **kwargs)
+
+    wall_seconds = time.perf_counter() - start_wall
+    cpu_seconds = time.process_time() - start_cpu
+
+    tracemalloc.start()
+    with instrumentation.sample_peak_rss() as rss:
+        function(*memory_args, **memory_kwargs)
+    _, peak_traced_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if n_rows is None:
+        n_rows = result
+
+    results.append(
+        {
+            "stage": stage,
+            "rows": n_rows,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": cpu_seconds,
+            "rows_per_second": n_rows / wall_seconds,
+            "peak_traced_mb": peak_traced_bytes / 2**20,
+            "peak_rss_delta_mb": rss["peak_rss_delta_mb"],
+        }
+    )
+    logging.info(
+        f"{stage}: {wall_seconds:.3f} s, {n_rows / wall_seconds:,.0f} rows/s,"
+        f" peak {peak_traced_bytes / 2**20:.1f} MB."
+    )
+
+    return result
+
+
+def check_centi_db_round_trip(df, decoded_df):
+    """
+    Returns the largest error (dB) of the levels of df stored as centi-dB and
+    read back as decoded_df. Raises a ValueError if it is more than the
+    0.005 dB of rounding to a hundredth of a dB (plus float32 rounding) or if
+    NaNs and infs aren't read back as they were.
+    """
+    max_error = 0.0
+    for column in helpers.get_level_columns(df):
+        levels = df[column].to_numpy(dtype="float64")
+        decoded = decoded_df[column].to_numpy(dtype="float64")
+        if not np.array_equal(np.isnan(levels), np.isnan(decoded)):
+            raise ValueError(f"NaNs of {column} changed in the round trip.")
+        infs = np.isinf(levels)
+        if not np.array_equal(levels[infs], decoded[infs]):
+            raise ValueError(f"Infs of {column} changed in the round trip.")
+
+        errors = np.abs(decoded - levels)
+        max_error = max(
+            max_error, np.max(errors[~np.isnan(errors)], initial=0)
+        )
+
+    if max_error > 0.005 + 1e-4:
+        raise ValueError(
+            f"Centi-dB round-trip error of {max_error:.4f} dB is more than"
+            " 0.005 dB."
+        )
+
+    return max_error
+
+
+def run_benchmarks(n_days=2, seed=0, n_workers=1, results_path=None):
+    """
+    Generates n_days of synthetic hydrophone data and times each stage of the
+    pipeline on it separately. Results are appended as one JSON line per run
+    to results_path, tagged with the git commit, so runs on different
+    commits can be compared.
+    """
+    if results_path is None:
+        results_path = config.benchmark_results_path
+
+    results = []
+    original_paths = (
+        config.processed_data_path,
+        config.figures_path,
+        config.spl_pyramid_path,
+    )
+    try:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            # Point the pipeline at the temporary directory.
+            config.processed_data_path = os.path.join(tmp_path, "processed")
+            config.figures_path = os.path.join(tmp_path, "figures")
+            config.spl_pyramid_path = os.path.join(tmp_path, "spl_pyramid")
+            os.makedirs(
+                os.path.join(config.processed_data_path, "monthly_data")
+            )
+            os.makedirs(os.path.join(config.figures_path, "whole_year_spl"))
+
+            month_path = synthetic_data.make_synthetic_month(
+                os.path.join(tmp_path, "raw"),
+                2018,
+                9,
+                n_days=n_days,
+                seed=seed,
+            )
+            raw_feathers_path = os.path.join(tmp_path, "raw_feathers")
+            raw_feather_path = os.path.join(
+                raw_feathers_path, "2018_09.feather"
+            )
+
+            time_stage(
+                results,
+                "combine_csvs",
+                None,
+                lambda *args, **kwargs: sum(
+                    combine_csvs.shard_csvs_to_months(*args, **kwargs)[
+                        0
+                    ].values()
+                ),
+                [month_path],
+                raw_feathers_path,
+                n_workers=n_workers,
+            )
+
+            # process_df step by step.
+            df = pd.read_feather(raw_feather_path)
+            df = df.drop(columns=["1213"]).reset_index(drop=True)
+            df = time_stage(
+                results,
+                "get_timestamps",
+                len(df),
+                process_data.get_timestamps,
+                df,
+                helpers.read_file_table(raw_feather_path),
+            )
+            df = time_stage(
+                results, "clean", len(df), process_data.clean_df, df
+            )
+            df = time_stage(
+                results, "downcast", len(df), process_data.downcast_floats, df
+            )
+            df = time_stage(
+                results,
+                "sort",
+                len(df),
+                lambda df: df.sort_values(
+                    "timestamp", kind="stable", ignore_index=True
+                ),
+                df,
+            )
+            df = time_stage(
+                results,
+                "tol_headers_to_ints",
+                len(df),
+                process_data.tol_headers_to_ints,
+                df,
+            )
+            df = time_stage(
+                results,
+                "calc_broadband_spl",
+                len(df),
+                process_data.calc_broadband_spl,
+                df,
+            )
+
+            df["broadband_spl"] = (
+                df["unnormalised_broadband_spl"]
+                - df["unnormalised_broadband_spl"].max()
+            )
+            df = time_stage(
+                results,
+                "calc_background_spl",
+                len(df),
+                process_data.calc_background_spl,
+                df,
+            )
+            df = process_data.tag_loud_events(df)
+            time_stage(
+                results,
+                "segment_transients",
+                len(df),
+                transient_durations.segment_transients,
+                df,
+                tol_aggregates=True,
+            )
+
+            processed_feather_path = helpers.feather_path_from_month_name(
+                config.processed_data_path, "2018_09"
+            )
+            helpers.write_processed_month(df, processed_feather_path)
+
+            # The same month with its levels stored as centi-dB.
+            centi_db_feather_path = os.path.join(
+                tmp_path, "2018_09_centi_db.feather"
+            )
+            original_centi_db_levels = config.centi_db_levels
+            config.centi_db_levels = True
+            try:
+                time_stage(
+                    results,
+                    "write_centi_db",
+                    len(df),
+                    helpers.write_processed_month,
+                    df,
+                    centi_db_feather_path,
+                )
+            finally:
+                config.centi_db_levels = original_centi_db_levels
+            centi_db_df = time_stage(
+                results,
+                "read_centi_db",
+                len(df),
+                helpers.read_processed_month,
+                centi_db_feather_path,
+            )
+            centi_db = {
+                "max_round_trip_error_db": check_centi_db_round_trip(
+                    df, centi_db_df
+                ),
+                "size_ratio": os.path.getsize(centi_db_feather_path)
+                / os.path.getsize(processed_feather_path),
+            }
+            logging.info(
+                "Centi-dB levels: max round-trip error"
+                f" {centi_db['max_round_trip_error_db']:.4f} dB,"
+                f" {centi_db['size_ratio']:.2f} of the float32 size."
+            )
+
+            time_stage(
+                results,
+                "write_spl_pyramid",
+                len(df),
+                spl_pyramid.write_spl_pyramid,
+                df,
+                "2018_09",
+            )
+            # Average over an hour so the rolling mean has some output.
+            time_stage(
+                results,
+                "plot_avg_spl",
+                len(df),
+                whole_year_spl.plot_avg_spl,
+                averaging_window=2 * 60 * 60,
+            )
+    finally:
+        (
+            config.processed_data_path,
+            config.figures_path,
+            config.spl_pyramid_path,
+        ) = original_paths
+
+    run = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "n_days": n_days,
+        "seed": seed,
+        "n_workers": n_workers,
+        "stages": results,
+        "centi_db": centi_db,
+    }
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "a") as f:
+        print(json.dumps(run), file=f)
+    logging.info(f"Benchmark results appended to {results_path}.")
+
+    return run
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -0,0 +1,124 @@
+import datetime
+import logging
+import numpy as np
+import pandas as pd
+import os
+
+from acoustic_data_science import config
+
+# PAMGuide's false time column followed by the third octave band centre
+# frequencies from 25 Hz to 25119 Hz, as they appear in the CSV headers.
+tol_columns = ["%.15g" % 10 ** (n / 10) for n in range(14, 45)]
+csv_columns = ["1213"] + tol_columns
+
+
+def make_csv_name(start_time):
+    """
+    Returns an ICLISTEN style CSV name for a file starting at start_time e.g.
+    ICLISTENHF1266_20180930T235802.000Z_TOL_1sHannWindow_50PercentOverlap.csv
+    """
+    return (
+        f"ICLISTENHF1266_{start_time:%Y%m%dT%H%M%S}."
+        f"{start_time.microsecond // 1000:03}Z_TOL_1sHannWindow_50PercentOverlap"
+        ".csv"
+    )
+
+
+def make_synthetic_tols(
+    n_rows,
+    rng,
+    nan_rate=1e-4,
+    inf_rate=1e-5,
+    transients_per_hour=20,
+    max_transient_rows=2 * 60 * 5,
+):
+    """
+    Returns n_rows of half second TOLs (dB) as a float64 array. The spectrum
+    falls off with frequency with a slowly drifting background level and
+    random noise. Loud transients 15-30 dB above the background are injected
+    with lengths from 1 row to max_transient_rows, along with NaN and inf
+    values at the given rates.
+    """
+    n_bands = len(tol_columns)
+    band_levels = np.linspace(95, 60, n_bands)
+    drift = 5 * np.sin(np.arange(n_rows) * 2 * np.pi / (2 * 60 * 60 * 12))
+    tols = (
+        band_levels[np.newaxis, :]
+        + drift[:, np.newaxis]
+        + rng.normal(0, 2, size=(n_rows, n_bands))
+    )
+
+    n_transients = rng.poisson(transients_per_hour * n_rows / (2 * 60 * 60))
+    starts = rng.integers(0, n_rows, n_transients)
+    # Mostly short transients with a long tail.
+    lengths = np.minimum(
+        np.ceil(rng.pareto(1.2, n_transients) + 1).astype("int"),
+        max_transient_rows,
+    )
+    gains = rng.uniform(15, 30, n_transients)
+    for start, length, gain in zip(starts, lengths, gains):
+        tols[start : start + length] += gain
+
+    for rate, value in ((nan_rate, np.nan), (inf_rate, np.inf)):
+        n_bad = rng.binomial(tols.size, rate)
+        tols[
+            rng.integers(0, n_rows, n_bad), rng.integers(0, n_bands, n_bad)
+        ] = value
+
+    return tols
+
+
+def make_synthetic_month(
+    csvs_path, year, month, n_days=None, file_mins=5, seed=0, **tols_kwargs
+):
+    """
+    Writes a month of synthetic ICLISTEN TOL CSVs (or the first n_days of it)
+    to csvs_path/YYYY_MM, one CSV per file_mins minutes of half second rows.
+    The same arguments always give the same files.
+    Returns the path of the month folder.
+    """
+    rng = np.random.default_rng(seed)
+    month_path = os.path.join(csvs_path, f"{year}_{month:02}")
+    os.makedirs(month_path, exist_ok=True)
+
+    start_time = datetime.datetime(year, month, 1)
+    if n_days is None:
+        end_time = (start_time + datetime.timedelta(days=32)).replace(day=1)
+    else:
+        end_time = start_time + datetime.timedelta(days=n_days)
+
+    rows_per_file = file_mins * 60 * 2
+    n_files = int(
+        (end_time - start_time) / datetime.timedelta(minutes=file_mins)
+    )
+    logging.info(f"Writing {n_files} synthetic CSVs to {month_path}.")
+
+    tols = make_synthetic_tols(n_files * rows_per_file, rng, **tols_kwargs)
+    false_times = np.arange(rows_per_file) * 0.5
+    for i in range(n_files):
+        # Files start a few milliseconds late, as the recorder's do.
+        file_start_time = start_time + datetime.timedelta(
+            minutes=file_mins * i, milliseconds=int(rng.integers(0, 10))
+        )
+        pd.DataFrame(
+            np.column_stack(
+                (
+                    false_times,
+                    tols[i * rows_per_file : (i + 1) * rows_per_file],
+                )
+            ),
+            columns=csv_columns,
+        ).to_csv(
+            os.path.join(month_path, make_csv_name(file_start_time)),
+            index=False,
+        )
+
+    return month_path
+
+
+if __name__ == "__main__":
+    make_synthetic_month(
+        os.path.join(config.project_dir, "data/synthetic/reorganised_tols"),
+        2018,
+        9,
+    )
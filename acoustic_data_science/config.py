@@ -22,7 +22,85 @@ logging.basicConfig(level=logging.INFO, format=log_fmt, handlers=(file_log_handl
 
 figure_ending = '.jpg'
 
-monthly_transient_durations_path = os.path.join(project_dir, 'acoustic_data_science/analysis/monthly_transient_durations.npy')
+# One feather of the transient durations of each month.
+monthly_transient_durations_path = os.path.join(processed_data_path, 'transient_timestamps_and_durations/monthly_transient_durations')
 whole_year_path = os.path.join(processed_data_path, 'whole_year/whole_year.feather')
+# Monthly duration class counts and histograms of the whole year transients.
+duration_stats_path = os.path.join(processed_data_path, 'transient_timestamps_and_durations/duration_stats')
 
-figures_path = os.path.join(project_dir, 'figures')
\ No newline at end of file
+figures_path = os.path.join(project_dir, 'figures')
+# Spec hash each figure was last rendered with, see plotting/render.py.
+render_cache_path = os.path.join(figures_path, 'render_cache.json')
+
+# Number of worker processes used by the parallel pipeline stages.
+n_workers = os.cpu_count()
+# Number of rows per record batch when streaming data to feather files.
+batch_rows = 2**16
+
+# Background SPL window (minutes) used to tag loud events.
+background_window_mins = 10
+# Extra background SPL estimates saved with the processed data, one column per
+# window (minutes) and statistic ('mean', 'median' or 'quantile').
+extra_background_windows_mins = ()
+extra_background_statistics = ("mean", "median", "quantile")
+background_quantile = 0.05
+# Warm-start the background SPL of each month from the end of the previous one.
+warm_start_background = False
+
+# Also write the processed data as a Parquet dataset partitioned by
+# year/month/day. Off by default as it is a second copy of the processed data,
+# `make dataset` converts processed months that have already been made.
+write_processed_dataset = False
+processed_dataset_path = os.path.join(processed_data_path, 'dataset')
+dataset_row_group_rows = 2**14
+
+# Loud events are this many dB above the background SPL.
+loud_threshold_db = 10
+
+# Skip pipeline stages whose inputs, parameters and code are unchanged.
+incremental_builds = True
+manifest_path = os.path.join(project_dir, 'data/manifest.json')
+
+# Compression of processed monthly feathers, 'lz4', 'zstd' or 'uncompressed'.
+# Uncompressed files can be memory-mapped without copying by
+# helpers.read_processed_month.
+processed_compression = 'lz4'
+# Store the TOL and SPL columns of processed months as int16 hundredths of a
+# dB rather than float32, see helpers.encode_centi_db. They are decoded when
+# read by helpers.read_processed_month.
+centi_db_levels = False
+
+# Streaming PCA of the TOL bands, see analysis/pca.py. pca_mode is
+# 'incremental' or 'randomized'.
+pca_n_components = 4
+pca_mode = 'incremental'
+pca_path = os.path.join(processed_data_path, 'pca')
+
+# Live transient detection, see processing/live_detector.py. New CSVs are
+# picked up from live_drop_path and the transients appended to one CSV per
+# day in live_transients_path.
+live_drop_path = os.path.join(project_dir, 'data/live/incoming')
+live_transients_path = os.path.join(project_dir, 'data/live/transients')
+live_poll_seconds = 1
+
+benchmark_results_path = os.path.join(project_dir, 'reports/benchmarks/results.jsonl')
+
+# Per-stage timings, see instrumentation.py. One JSON line per stage and month.
+# Off by default, the run report grows with every run.
+instrument = False
+run_report_path = os.path.join(project_dir, 'reports/run_report.jsonl')
+# Stage to profile e.g. 'process_df' or 'process_month_second_pass', None for
+# no profiling. profiler is 'cprofile' or 'pyinstrument' (if installed).
+profile_stage = None
+profiler = 'cprofile'
+profiles_path = os.path.join(project_dir, 'reports/profiles')
+
+# Process each raw month in chunks to fit in about this many MB, or None to
+# process each month whole. Must be enough for a day of processed data.
+process_memory_budget_mb = None
+
+# Broadband and background SPL aggregated to 1 min, 10 min, 1 h and 1 day
+# bins for plotting, see processing/spl_pyramid.py. Written in the second
+# pass of processing so plotting only loads the small aggregates.
+write_spl_pyramid = True
+spl_pyramid_path = os.path.join(processed_data_path, 'spl_pyramid')
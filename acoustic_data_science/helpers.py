@@ -1,8 +1,13 @@
 from re import sub
 import glob
+import json
 import logging
 import numpy as np
 import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
 
 from acoustic_data_science import config
 
@@ -30,21 +35,304 @@ def get_feather_paths(data_path):
     return sorted(glob.glob(f'{data_path}/*.feather'))
 
 
-def load_monthly_transient_durations():
-    return list(np.load(config.monthly_transient_durations_path, allow_pickle=True))
+def get_file_table_path(feather_path):
+    """
+    Returns the path of the file table of a raw month feather, in a files
+    folder next to it so it isn't mistaken for a month.
+    """
+    return os.path.join(
+        os.path.dirname(feather_path), "files", os.path.basename(feather_path)
+    )
+
+
+def write_file_table(files_df, feather_path):
+    """Saves the file table of the CSVs combined into a raw month feather."""
+    file_table_path = get_file_table_path(feather_path)
+    os.makedirs(os.path.dirname(file_table_path), exist_ok=True)
+    files_df.to_feather(file_table_path + ".tmp")
+    os.replace(file_table_path + ".tmp", file_table_path)
+
+
+def read_file_table(feather_path):
+    """
+    Returns the file table (file_id, filename, start_time, n_rows and
+    n_bytes of each CSV) of a raw month feather.
+    """
+    return pd.read_feather(get_file_table_path(feather_path))
+
+
+def get_filenames(month_name, file_ids):
+    """
+    Returns the CSV filename of each of file_ids of month_name, e.g. the
+    file_id column of its processed rows or transients.
+    """
+    files_df = read_file_table(
+        os.path.join(config.raw_feathers_path, month_name + ".feather")
+    )
+    return files_df["filename"].to_numpy()[np.asarray(file_ids)]
+
+
+def get_transient_durations_path(month_name, durations_path=None):
+    """
+    Returns the path of the transient durations of a month. Each month is a
+    one row feather of the month name and its durations as a list<float32>,
+    so months are saved without rewriting the others.
+    """
+    if durations_path is None:
+        durations_path = config.monthly_transient_durations_path
+
+    return os.path.join(durations_path, month_name + '.feather')
+
+
+def write_transient_durations(month_name, transient_durations, durations_path=None):
+    """
+    Saves the transient durations of a month, replacing any saved before.
+    The feather is uncompressed so it can be memory-mapped.
+    """
+    durations = pa.array(np.asarray(transient_durations, dtype='float32'))
+    table = pa.table({
+        'month': [month_name],
+        'durations': pa.ListArray.from_arrays(pa.array([0, len(durations)], pa.int32()), durations),
+    })
+
+    path = get_transient_durations_path(month_name, durations_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    feather.write_feather(table, path + '.tmp', compression='uncompressed')
+    os.replace(path + '.tmp', path)
+
+
+def load_monthly_transient_durations(durations_path=None, with_months=False):
+    """
+    Returns the saved transient durations of each month as read-only float32
+    views of the memory-mapped feathers, so loading doesn't copy the
+    durations. If with_months is True the month names are returned too.
+    """
+    if durations_path is None:
+        durations_path = config.monthly_transient_durations_path
+
+    month_names = []
+    monthly_transient_durations = []
+    for path in get_feather_paths(durations_path):
+        table = feather.read_table(path, memory_map=True)
+        month_names.append(table['month'][0].as_py())
+        monthly_transient_durations.append(
+            table['durations'].chunk(0).flatten().to_numpy()
+        )
+
+    if with_months:
+        return month_names, monthly_transient_durations
+
+    return monthly_transient_durations
+
+
+# Stored in place of NaN, inf and -inf in centi-dB encoded columns.
+centi_db_nan = -32768
+centi_db_inf = 32767
+centi_db_neg_inf = -32767
+
+
+def get_level_columns(df):
+    """
+    Returns the float columns of df that are levels in dB: the TOL bands and
+    the SPL columns (broadband, unnormalised and background SPLs).
+    """
+    tol_columns = list(df.loc[:, "25":"25119"].columns)
+    return tol_columns + [
+        column
+        for column in df.columns
+        if column not in tol_columns
+        and (column.endswith("_spl") or column.startswith("background_"))
+        and df[column].dtype.kind == "f"
+    ]
+
+
+def encode_centi_db(levels):
+    """
+    Returns levels in dB as int16 hundredths of a dB, with NaN, inf and -inf
+    stored as centi_db_nan, centi_db_inf and centi_db_neg_inf. Rounding to
+    the nearest hundredth bounds the round-trip error to 0.005 dB.
+    """
+    encoded = np.round(np.asarray(levels, dtype="float64") * 100)
+    nan = np.isnan(encoded)
+    inf = np.isinf(encoded)
+    if np.any(np.abs(encoded[~(nan | inf)]) >= centi_db_inf):
+        raise ValueError(
+            "Levels must be within +-327.66 dB to be stored as centi-dB."
+        )
+
+    encoded[nan] = centi_db_nan
+    encoded[inf] = np.where(encoded[inf] > 0, centi_db_inf, centi_db_neg_inf)
+    return encoded.astype("int16")
+
+
+def decode_centi_db(encoded):
+    """Returns int16 centi-dB levels as float32 dB."""
+    levels = encoded.astype("float32") / 100
+    levels[encoded == centi_db_nan] = np.nan
+    levels[encoded == centi_db_inf] = np.inf
+    levels[encoded == centi_db_neg_inf] = -np.inf
+    return levels
+
+
+def decode_levels(df, columns=None):
+    """
+    Returns df with its centi-dB encoded columns (those listed in
+    df.attrs["centi_db_columns"], or only those of columns) decoded to float32
+    dB.
+    """
+    encoded_columns = df.attrs.get("centi_db_columns", [])
+    if columns is None:
+        columns = encoded_columns
+    columns = [column for column in columns if column in encoded_columns]
+    if not columns:
+        return df
+
+    df = df.assign(
+        **{column: decode_centi_db(df[column].to_numpy()) for column in columns}
+    )
+    df.attrs["centi_db_columns"] = [
+        column
+        for column in encoded_columns
+        if column in df.columns and column not in columns
+    ]
+    return df
+
+
+def get_centi_db_columns(schema):
+    """
+    Returns the columns of a processed month's Arrow schema that are stored
+    as centi-dB, listed in its metadata by write_processed_month.
+    """
+    metadata = schema.metadata or {}
+    if b"centi_db_columns" not in metadata:
+        return []
+
+    return [
+        column
+        for column in json.loads(metadata[b"centi_db_columns"])
+        if column in schema.names
+    ]
+
+
+def write_processed_month(df, feather_path):
+    """
+    Saves a processed month with config.processed_compression. Uncompressed
+    files are written as a single record batch so read_processed_month can
+    map every column without copying. If config.centi_db_levels is True the
+    TOL and SPL columns are stored as int16 centi-dB (see encode_centi_db),
+    about half the size of float32.
+    The file is written to a temporary path and moved into place so processes
+    that have the old file memory-mapped are unaffected.
+    """
+    if config.processed_compression == "uncompressed":
+        chunksize = max(len(df), 1)
+    else:
+        chunksize = None
+
+    df = decode_levels(df)
+    centi_db_columns = []
+    if config.centi_db_levels:
+        centi_db_columns = get_level_columns(df)
+        df = df.assign(
+            **{
+                column: encode_centi_db(df[column].to_numpy())
+                for column in centi_db_columns
+            }
+        )
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if centi_db_columns:
+        table = table.replace_schema_metadata(
+            {
+                **(table.schema.metadata or {}),
+                b"centi_db_columns": json.dumps(centi_db_columns),
+            }
+        )
+
+    feather.write_feather(
+        table,
+        feather_path + ".tmp",
+        compression=config.processed_compression,
+        chunksize=chunksize,
+    )
+    os.replace(feather_path + ".tmp", feather_path)
+
+
+def read_processed_month(feather_path, columns=None, decode=True):
+    """
+    Reads a processed month through a memory map. If the file is uncompressed
+    the numeric and timestamp columns of the returned DataFrame are read-only
+    views of the file in the OS page cache, shared by every process reading
+    it, rather than copies.
+    Columns stored as centi-dB are decoded to float32 dB, unless decode is
+    False in which case they are left as int16 and listed in
+    df.attrs["centi_db_columns"] to be decoded on access by get_tols_df or
+    decode_levels.
+    """
+    table = feather.read_table(feather_path, columns=columns, memory_map=True)
+    df = table.to_pandas(split_blocks=True)
+    df.attrs["centi_db_columns"] = get_centi_db_columns(table.schema)
+    if decode:
+        df = decode_levels(df)
+
+    return df
+
+
+def get_column_views(feather_path, columns):
+    """
+    Returns a dict of column name to read-only NumPy array for the given
+    columns of a processed month, e.g. the TOL bands, timestamp and
+    broadband_spl. For uncompressed files the arrays are zero-copy views of
+    the memory-mapped file. Arrow stores each column separately so the TOL
+    bands are one view per band (np.column_stack them for a 2D copy).
+    Columns stored as centi-dB are decoded, so are copies.
+    """
+    table = feather.read_table(feather_path, columns=columns, memory_map=True)
+    centi_db_columns = get_centi_db_columns(table.schema)
+
+    column_views = {}
+    for column in columns:
+        chunked_array = table.column(column)
+        if chunked_array.num_chunks == 1 and chunked_array.null_count == 0:
+            column_views[column] = chunked_array.chunk(0).to_numpy(
+                zero_copy_only=False
+            )
+        else:
+            column_views[column] = chunked_array.to_numpy()
+
+        if column in centi_db_columns:
+            column_views[column] = decode_centi_db(column_views[column])
+
+    return column_views
 
 
 def get_tols_df(df):
-    return df.loc[:, "25":"25119"]
+    """
+    Returns the TOL bands of df, decoding them if they are still centi-dB
+    (see read_processed_month).
+    """
+    tols_df = df.loc[:, "25":"25119"]
+    if df.attrs.get("centi_db_columns"):
+        tols_df = decode_levels(tols_df, tols_df.columns)
+
+    return tols_df
 
 
 def get_month_paths(data_path):
+    """
+    Returns the month folders and month feathers (without .feather) in
+    data_path, in month order. Anything else, e.g. a leftover
+    2018_09.feather.tmp, is ignored.
+    """
     month_paths = []
     for month_name in os.listdir(data_path):
-        month_path = os.path.join(data_path, month_name.split('.')[0])
-        if month_name[:2] == '20':
-            month_paths.append(month_path)
-    
+        if month_name[:2] != '20':
+            continue
+        if month_name.endswith('.feather'):
+            month_paths.append(os.path.join(data_path, month_name[:-len('.feather')]))
+        elif os.path.isdir(os.path.join(data_path, month_name)):
+            month_paths.append(os.path.join(data_path, month_name))
+
     month_paths.sort()
 
     return month_paths
@@ -57,6 +345,22 @@ def get_month_names(data_path):
     return month_names
 
 
+def get_month_keys(timestamps):
+    """
+    Returns the month of each timestamp as a string such as '201809',
+    computed with datetime64 arithmetic rather than formatting each row.
+    """
+    months = np.asarray(timestamps, dtype='datetime64[ns]').astype('datetime64[M]').astype('int64')
+    return (((months // 12) + 1970) * 100 + months % 12 + 1).astype('str')
+
+
+def get_day_keys(timestamps):
+    """
+    Returns the day of each timestamp as a datetime64[D].
+    """
+    return np.asarray(timestamps, dtype='datetime64[ns]').astype('datetime64[D]')
+
+
 def get_figure_path(figure_name, folder=''):
 
         if folder == '':
@@ -68,4 +372,106 @@ def get_figure_path(figure_name, folder=''):
             figure_name + config.figure_ending,
         )
 
-        return figure_path
\ No newline at end of file
+        return figure_path
+
+
+processed_dataset_partitioning = ds.partitioning(
+    pa.schema(
+        [("year", pa.int16()), ("month", pa.int8()), ("day", pa.int8())]
+    ),
+    flavor="hive",
+)
+
+
+def get_processed_dataset_paths(dataset_path, start=None, end=None):
+    """
+    Returns the Parquet files of the processed dataset for the days between
+    start and end (inclusive), found from the year=/month=/day= folder names
+    so that files outside the range are never opened.
+    """
+    start_day = None if start is None else pd.Timestamp(start).floor("D")
+    end_day = None if end is None else pd.Timestamp(end).floor("D")
+
+    day_paths = []
+    for day_path in glob.glob(
+        os.path.join(dataset_path, "year=*", "month=*", "day=*")
+    ):
+        year, month, day = [
+            int(folder.split("=")[1]) for folder in day_path.split("/")[-3:]
+        ]
+        day_timestamp = pd.Timestamp(year=year, month=month, day=day)
+        if start_day is not None and day_timestamp < start_day:
+            continue
+        if end_day is not None and day_timestamp > end_day:
+            continue
+        day_paths.append((day_timestamp, day_path))
+
+    # Sort by date rather than by folder name (month=10 is before month=9).
+    paths = []
+    for _, day_path in sorted(day_paths):
+        paths += sorted(
+            glob.glob(os.path.join(day_path, "*.parquet")),
+            key=lambda path: int(path.split("-")[-1].split(".")[0]),
+        )
+
+    return paths
+
+
+def query_processed_data(
+    columns=None, start=None, end=None, loud=None, dataset_path=None
+):
+    """
+    Reads the processed dataset, pushing the column selection and the filters
+    down to the Parquet reader. Only the day folders between start and end are
+    listed and row groups whose timestamp or loud statistics rule them out are
+    skipped.
+    start is inclusive and end exclusive, either can be None. If loud is True
+    or False only rows with that loud value are returned.
+    e.g. all loud rows in March 2019:
+        query_processed_data(
+            ["timestamp", "broadband_spl"], "2019-03", "2019-04", loud=True
+        )
+    """
+    if dataset_path is None:
+        dataset_path = config.processed_dataset_path
+
+    paths = get_processed_dataset_paths(dataset_path, start, end)
+    if len(paths) == 0:
+        return pd.DataFrame(columns=columns)
+
+    dataset = ds.dataset(
+        paths,
+        format="parquet",
+        partitioning=processed_dataset_partitioning,
+        partition_base_dir=dataset_path,
+    )
+
+    conditions = []
+    if start is not None:
+        conditions.append(
+            ds.field("timestamp")
+            >= pa.scalar(pd.Timestamp(start), pa.timestamp("ns"))
+        )
+    if end is not None:
+        conditions.append(
+            ds.field("timestamp")
+            < pa.scalar(pd.Timestamp(end), pa.timestamp("ns"))
+        )
+    if loud is not None:
+        conditions.append(ds.field("loud") == loud)
+
+    data_filter = None
+    for condition in conditions:
+        if data_filter is None:
+            data_filter = condition
+        else:
+            data_filter = data_filter & condition
+
+    if columns is None:
+        columns = [
+            name
+            for name in dataset.schema.names
+            if name not in ("year", "month", "day")
+        ]
+
+    return dataset.to_table(columns=columns, filter=data_filter).to_pandas()
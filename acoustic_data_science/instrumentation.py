@@ -0,0 +1,214 @@
+import contextlib
+import cProfile
+import datetime
+import functools
+import inspect
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+import pandas as pd
+
+from acoustic_data_science import config
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# Identifies the records of one run of the pipeline in the run report.
+run_id = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+
+# Names and months of the stages currently running in this process.
+_stage_stack = []
+
+
+def get_io_bytes():
+    """
+    Returns the bytes read and written by this process so far, or None where
+    /proc/self/io is not available. Reads of memory-mapped files are not
+    counted.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        return int(io["rchar"]), int(io["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def get_rss_bytes():
+    """
+    Returns the resident set size of this process, or None where
+    /proc/self/statm is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+@contextlib.contextmanager
+def sample_peak_rss(interval_seconds=0.01):
+    """
+    Samples the resident set size in a thread every interval_seconds while
+    the block runs. Yields a dict whose peak_rss_delta_mb is set on exit to
+    the peak RSS above the RSS at the start of the block, or None where the
+    RSS can't be read. Unlike ru_maxrss this is the peak of this block only,
+    not of the process so far.
+    """
+    start_rss = get_rss_bytes()
+    sample = {"peak_rss_bytes": start_rss, "peak_rss_delta_mb": None}
+    if start_rss is None:
+        yield sample
+        return
+
+    def update_peak():
+        rss = get_rss_bytes()
+        if rss is not None and rss > sample["peak_rss_bytes"]:
+            sample["peak_rss_bytes"] = rss
+
+    stop = threading.Event()
+
+    def sample_until_stopped():
+        while not stop.wait(interval_seconds):
+            update_peak()
+
+    thread = threading.Thread(target=sample_until_stopped, daemon=True)
+    thread.start()
+    try:
+        yield sample
+    finally:
+        stop.set()
+        thread.join()
+        update_peak()
+        sample["peak_rss_delta_mb"] = (
+            sample["peak_rss_bytes"] - start_rss
+        ) / 2**20
+
+
+def write_record(record):
+    """
+    Appends a record to the JSON lines run report. Records are one short
+    line so parallel workers can append to the same report.
+    """
+    os.makedirs(os.path.dirname(config.run_report_path), exist_ok=True)
+    with open(config.run_report_path, "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+@contextlib.contextmanager
+def profile(stage_name, month):
+    """
+    Profiles the block with cProfile (or pyinstrument if config.profiler is
+    'pyinstrument') if stage_name is config.profile_stage.
+    """
+    if stage_name != config.profile_stage:
+        yield
+        return
+
+    os.makedirs(config.profiles_path, exist_ok=True)
+    profile_path = os.path.join(
+        config.profiles_path, f"{stage_name}_{month}_{run_id}_{os.getpid()}"
+    )
+
+    if config.profiler == "pyinstrument" and pyinstrument is not None:
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(profile_path + ".html", "w") as f:
+                f.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profile_path + ".prof")
+
+
+@contextlib.contextmanager
+def stage(name, month=None, rows_in=None):
+    """
+    Records the wall time, CPU time, peak RSS above the RSS at the start and
+    bytes read and written by the block as one record of the run report.
+    Yields the record so the block can add to it, e.g. rows_out.
+    Stages can be nested, nested stages inherit the month of their parent and
+    their path is parent.child.
+    """
+    if not config.instrument:
+        yield {}
+        return
+
+    if month is None and _stage_stack:
+        month = _stage_stack[-1][1]
+    _stage_stack.append((name, month))
+    path = ".".join(stage_name for stage_name, _ in _stage_stack)
+
+    record = {
+        "run_id": run_id,
+        "pid": os.getpid(),
+        "stage": name,
+        "path": path,
+        "month": month,
+        "rows_in": rows_in,
+        "rows_out": None,
+    }
+    start_io = get_io_bytes()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        with sample_peak_rss() as rss, profile(name, month):
+            yield record
+    finally:
+        record["wall_seconds"] = time.perf_counter() - start_wall
+        record["cpu_seconds"] = time.process_time() - start_cpu
+        record["peak_rss_delta_mb"] = rss["peak_rss_delta_mb"]
+        end_io = get_io_bytes()
+        if start_io is not None and end_io is not None:
+            record["bytes_read"] = end_io[0] - start_io[0]
+            record["bytes_written"] = end_io[1] - start_io[1]
+        _stage_stack.pop()
+
+        write_record(record)
+        logging.info(
+            f"{path}{f' ({month})' if month else ''} took"
+            f" {record['wall_seconds']:.2f} s."
+        )
+
+
+def instrumented(function):
+    """
+    Decorator that runs the function as a stage named after it. The month of
+    the stage is the function's month_name argument if it has one. rows_in
+    and rows_out are the lengths of the first DataFrame argument and of the
+    returned DataFrame.
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs).arguments
+        month = arguments.get("month_name")
+        rows_in = None
+        for argument in arguments.values():
+            if isinstance(argument, pd.DataFrame):
+                rows_in = len(argument)
+                break
+
+        with stage(function.__name__, month, rows_in) as record:
+            result = function(*args, **kwargs)
+            if isinstance(result, pd.DataFrame):
+                record["rows_out"] = len(result)
+
+        return result
+
+    return wrapper
@@ -3,13 +3,17 @@ import pandas as pd
 import datetime
 import numpy as np
 import os
-from acoustic_data_science import config, helpers
+from acoustic_data_science import config, helpers, instrumentation
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import logging
 
+from acoustic_data_science.plotting import render
+
 colours = ["blue", "orange", "green", "red"]
 
 
+@instrumentation.instrumented
 def plot_ice_coverage_property(df, ice_property):
     plt.figure(figsize=(16, 8))
     mask = df[ice_property].notnull()
@@ -22,8 +26,9 @@ def plot_ice_coverage_property(df, ice_property):
     plt.show()
 
 
-def plot_multiple_ice_coverage_properties_as_one_plot(df, ice_properties):
-    plt.figure(figsize=(16, 10))
+def draw_multiple_ice_coverage_properties_as_one_plot(df, ice_properties):
+    fig = Figure(figsize=(16, 10))
+    ax = fig.add_subplot()
     for i, ice_property in enumerate(ice_properties):
         mask = df[ice_property].notnull()
         x = df["timestamp"][mask]
@@ -38,62 +43,96 @@ def plot_multiple_ice_coverage_properties_as_one_plot(df, ice_properties):
             )
         else:
             y_norm = y
-        plt.plot(x, y_norm, c=colours[i])
-        plt.scatter(x, y_norm, label=ice_property, c=colours[i])
+        ax.plot(x, y_norm, c=colours[i])
+        ax.scatter(x, y_norm, label=ice_property, c=colours[i])
 
-    plt.xlabel("Date (YYYY-MM)")
-    plt.ylabel("Noramalized quantity (0-1)")
-    plt.legend(loc="lower left")
-    figure_path = helpers.get_figure_path(
-        "multiple_ice_coverage_properties_as_one_plot", "ice_coverage"
-    )
-    plt.savefig(figure_path)
+    ax.set_xlabel("Date (YYYY-MM)")
+    ax.set_ylabel("Noramalized quantity (0-1)")
+    ax.legend(loc="lower left")
+    return fig
 
 
-def plot_multiple_ice_coverage_properties_as_grid(df, ice_properties):
-    fig = plt.figure(figsize=(20, 15))
+def draw_multiple_ice_coverage_properties_as_grid(df, ice_properties):
+    fig = Figure(figsize=(20, 15))
     for i, ice_property in enumerate(ice_properties):
         mask = df[ice_property].notnull()
         x = df["timestamp"][mask]
         y = df[ice_property][mask]
-        # Min-max normalization
-        # https://stackoverflow.com/questions/26414913/normalize-columns-of-pandas-data-frame
         ax = fig.add_subplot(2, 2, i + 1)
         ax.plot(x, y, c=colours[i])
         ax.scatter(x, y, label=ice_property, c=colours[i])
         ax.set_title(ice_property)
 
         if ice_property == "mean_temperature":
-            plt.ylabel("Mean temperature (degrees C)")
+            ax.set_ylabel("Mean temperature (degrees C)")
         else:
-            plt.ylim(0, 11.5)
-            plt.ylabel(ice_property)
+            ax.set_ylim(0, 11.5)
+            ax.set_ylabel(ice_property)
+
+        ax.set_xlabel("Date (YYYY-MM)")
+
+    # The legend of the last subplot, as pyplot would place it.
+    ax.legend(loc="upper left")
+    fig.tight_layout()
+    return fig
+
+
+def get_multiple_ice_coverage_properties_spec(df, ice_properties, layout):
+    """
+    layout is 'one_plot' or 'grid'.
+    """
+    draw_functions = {
+        "one_plot": draw_multiple_ice_coverage_properties_as_one_plot,
+        "grid": draw_multiple_ice_coverage_properties_as_grid,
+    }
+    return render.make_spec(
+        draw_functions[layout],
+        helpers.get_figure_path(
+            f"multiple_ice_coverage_properties_as_{layout}", "ice_coverage"
+        ),
+        df=df[["timestamp", *ice_properties]],
+        ice_properties=ice_properties,
+    )
 
-        plt.xlabel("Date (YYYY-MM)")
 
-    plt.legend(loc="upper left")
-    plt.tight_layout()
-    figure_path = helpers.get_figure_path(
-        "multiple_ice_coverage_properties_as_grid", "ice_coverage"
+@instrumentation.instrumented
+def plot_multiple_ice_coverage_properties_as_one_plot(df, ice_properties):
+    render.render_figure(
+        get_multiple_ice_coverage_properties_spec(
+            df, ice_properties, "one_plot"
+        )
     )
-    plt.savefig(figure_path)
+
+
+@instrumentation.instrumented
+def plot_multiple_ice_coverage_properties_as_grid(df, ice_properties):
+    render.render_figure(
+        get_multiple_ice_coverage_properties_spec(df, ice_properties, "grid")
+    )
+
 
 def plot_ice_conc_sod_temp_as_one_plot():
     return None
 
-if __name__ == "__main__":
-    ice_properties = [
-        "total_concentration",
-        "stage_of_development",
-        "form_of_ice",
-        "mean_temperature",
-    ]
 
+ice_properties = [
+    "total_concentration",
+    "stage_of_development",
+    "form_of_ice",
+    "mean_temperature",
+]
+
+
+def get_figure_specs():
     df = pd.read_csv(
         config.processed_data_path
         + "/cambridge_bay_sea_ice_properties_from_ice_charts.csv"
     )
+    return [
+        get_multiple_ice_coverage_properties_spec(df, ice_properties, layout)
+        for layout in ("one_plot", "grid")
+    ]
 
-    plot_multiple_ice_coverage_properties_as_one_plot(df, ice_properties)
-    plot_multiple_ice_coverage_properties_as_grid(df, ice_properties)
-    plot_ice_conc_sod_temp_as_one_plot(df, ice_properties)
+
+if __name__ == "__main__":
+    render.render_figures(get_figure_specs(), n_workers=config.n_workers)
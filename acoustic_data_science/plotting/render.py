@@ -0,0 +1,150 @@
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+from acoustic_data_science import config, instrumentation
+
+
+def make_spec(draw_function, figure_path, **kwargs):
+    """
+    Returns the spec of a figure: draw_function(**kwargs) must return a
+    matplotlib Figure (not use pyplot) and kwargs should be the small,
+    precomputed arrays and options it needs, so specs are cheap to hash and
+    to send to worker processes.
+    """
+    return {
+        "draw_function": draw_function,
+        "figure_path": figure_path,
+        "kwargs": kwargs,
+    }
+
+
+def update_hash(sha256, value):
+    if isinstance(value, pd.DataFrame):
+        value = {
+            "index": value.index,
+            "columns": list(value.columns),
+            "values": [value[column] for column in value.columns],
+        }
+
+    if isinstance(value, (pd.Series, pd.Index)):
+        value = value.to_numpy()
+
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == "O":
+            value = value.astype("str")
+        sha256.update(f"{value.dtype}{value.shape}".encode())
+        sha256.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value):
+            sha256.update(repr(key).encode())
+            update_hash(sha256, value[key])
+    elif isinstance(value, (list, tuple)):
+        sha256.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            update_hash(sha256, item)
+    else:
+        sha256.update(repr(value).encode())
+
+
+def get_spec_hash(spec):
+    """
+    Returns a hash of everything a figure depends on: the source of the
+    module drawing it, its arguments and the figure format.
+    """
+    draw_function = spec["draw_function"]
+    sha256 = hashlib.sha256()
+    with open(inspect.getsourcefile(draw_function), "rb") as f:
+        sha256.update(f.read())
+    sha256.update(draw_function.__qualname__.encode())
+    sha256.update(config.figure_ending.encode())
+    update_hash(sha256, spec["kwargs"])
+
+    return sha256.hexdigest()
+
+
+def render_figure(spec):
+    """
+    Draws and saves the figure of a spec.
+    """
+    logging.info(f"Rendering {spec['figure_path']}.")
+    fig = spec["draw_function"](**spec["kwargs"])
+    os.makedirs(os.path.dirname(spec["figure_path"]), exist_ok=True)
+    fig.savefig(spec["figure_path"])
+
+
+def load_render_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+@instrumentation.instrumented
+def render_figures(specs, n_workers=1, cache_path=None):
+    """
+    Renders the figures of specs in a pool of n_workers processes, skipping
+    figures that exist and whose spec hash is the one they were last
+    rendered with.
+    """
+    if cache_path is None:
+        cache_path = config.render_cache_path
+
+    cache = load_render_cache(cache_path)
+    spec_hashes = [get_spec_hash(spec) for spec in specs]
+    stale_specs = [
+        spec
+        for spec, spec_hash in zip(specs, spec_hashes)
+        if cache.get(spec["figure_path"]) != spec_hash
+        or not os.path.exists(spec["figure_path"])
+    ]
+    logging.info(
+        f"Rendering {len(stale_specs)} of {len(specs)} figures, the rest are"
+        " up to date."
+    )
+
+    if n_workers > 1 and len(stale_specs) > 1:
+        with multiprocessing.Pool(min(n_workers, len(stale_specs))) as pool:
+            pool.map(render_figure, stale_specs, chunksize=1)
+    else:
+        for spec in stale_specs:
+            render_figure(spec)
+
+    for spec, spec_hash in zip(specs, spec_hashes):
+        cache[spec["figure_path"]] = spec_hash
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path + ".tmp", "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(cache_path + ".tmp", cache_path)
+
+
+if __name__ == "__main__":
+    # No windows when run as a script. Figures are drawn on Figure objects
+    # rather than with pyplot, so importing this module leaves the backend
+    # alone.
+    matplotlib.use("Agg")
+
+    from acoustic_data_science.analysis import duration_stats
+    from acoustic_data_science.plotting import (
+        ice_coverage,
+        transient_durations,
+        whole_year_spl,
+    )
+
+    bins_df, summary_df = duration_stats.read_duration_stats()
+    specs = (
+        transient_durations.get_figure_specs(bins_df)
+        + whole_year_spl.get_figure_specs()
+        + ice_coverage.get_figure_specs()
+    )
+    render_figures(specs, n_workers=config.n_workers)
+
+    transient_durations.report_monthly_transient_stats(bins_df, summary_df)
@@ -2,10 +2,12 @@ import pandas as pd
 import datetime
 import numpy as np
 import os
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import logging
 
-from acoustic_data_science import config, helpers
+from acoustic_data_science import config, helpers, instrumentation
+from acoustic_data_science.analysis import duration_stats
+from acoustic_data_science.plotting import render
 
 durations_stats_txt_path = os.path.join(
     config.project_dir,
@@ -13,274 +15,261 @@ durations_stats_txt_path = os.path.join(
     "durations_stats.txt",
 )
 
-
-def report_transient_stats(transient_durations, f):
-    print(f"min (s) {transient_durations.min()}", file=f)
-    print(f"max (s) {transient_durations.max() / 60}", file=f)
-    print(f"max (mins) {transient_durations.max()/ 60:.2f}", file=f)
-    print(f"sd {transient_durations.std()}", file=f)
-
+# Legend label of each duration class of duration_stats.
+duration_class_labels = {
+    "short": r"$0 \less \rm{duration} \leq 0.5$ sec",
+    "med_short": r"$0.5 \less \rm{duration} \leq 5$ sec",
+    "med": r"$5 \less \rm{duration} \leq 3 \rm{min}$",
+    "long": r"$3 \rm{min} \less \rm{duration} \leq 20 \rm{min}$",
+}
+
+# Title of each histogram of duration_stats.histogram_binnings.
+histogram_titles = {
+    "all_transients": "All transients.",
+    "longer_than_3_minutes": "Only transients longer than 3 minutes.",
+    "shorter_than_3_minutes": "Only transients shorter than 3 minutes.",
+    "shorter_than_15_seconds": "Only transients shorter than 15 seconds.",
+}
+
+
+def report_transient_stats(month_summary, n_half_second, f):
+    print(f"min (s) {month_summary['min']}", file=f)
+    print(f"max (s) {month_summary['max']}", file=f)
+    print(f"max (mins) {month_summary['max'] / 60:.2f}", file=f)
+    print(f"sd {month_summary['std']}", file=f)
+
+    # Durations are multiples of 0.5 s, so the short class is the 0.5 s
+    # transients.
     print(
         "Number of transients with durations > 0.5"
-        f" {len(transient_durations[transient_durations > 0.5])}",
+        f" {month_summary['count'] - n_half_second}",
         file=f,
     )
     print(
-        "Number of transients with durations = 0.5"
-        f" {len(transient_durations[transient_durations == 0.5])}",
+        f"Number of transients with durations = 0.5 {n_half_second}",
         file=f,
     )
     print("", file=f)
 
 
-def report_monthly_transient_stats(monthly_transient_durations):
+@instrumentation.instrumented
+def report_monthly_transient_stats(bins_df, summary_df):
     logging.info("Reporting monthly transient stats.")
-    month_names = helpers.get_month_names(config.processed_data_path)
+    class_counts = duration_stats.get_class_counts(bins_df)
 
     with open(durations_stats_txt_path, "w") as f:
         print("Transit Duration Stats\n", file=f)
 
-        for transient_durations, month_name in zip(
-            monthly_transient_durations, month_names
-        ):
-            print(f"=== {month_name} ===", file=f)
-            report_transient_stats(transient_durations, f)
-
-
-def get_longest_duration(monthly_transient_durations):
-    longest_duration = np.max(
-        np.concatenate(monthly_transient_durations)
-    )  # seconds
-    return longest_duration
-
-
-def get_max_bin_size(
-    monthly_transient_durations, bins, min_duration=None, max_duration=None
-):
-    max_bin_size = 0
-
-    months = helpers.get_month_names(config.processed_data_path)
-
-    for transient_durations, month in zip(monthly_transient_durations, months):
-        if min_duration is not None:
-            transient_durations = transient_durations[
-                transient_durations >= min_duration
-            ]
+        for _, month_summary in summary_df.iterrows():
+            print(f"=== {month_summary['month']} ===", file=f)
+            report_transient_stats(
+                month_summary,
+                class_counts.loc[month_summary["month"], "short"],
+                f,
+            )
 
-        if max_duration is not None:
-            transient_durations = transient_durations[
-                transient_durations <= max_duration
-            ]
 
-        bin_size = max(np.histogram(transient_durations, bins=bins)[0])
-        if bin_size > max_bin_size:
-            max_bin_size = bin_size
-
-    return max_bin_size
-
-
-def plot_duration_histograms(
-    monthly_transient_durations,
-    bins,
-    min_duration=None,
-    max_duration=None,
-    title="",
-    xunits="seconds",
-):
-    logging.info("Plotting histogram of monthly transit durations.")
-    fig = plt.figure(figsize=(15, 15))
+def draw_duration_histograms(histograms, months, bins, title, xunits):
+    fig = Figure(figsize=(15, 15))
     fig.suptitle(f"{title} {bins} bins.")
 
-    months = helpers.get_month_names(config.processed_data_path)
-
-    i = 0
-    for transient_durations, month in zip(monthly_transient_durations, months):
-        i += 1
-
-        if min_duration is not None:
-            transient_durations = transient_durations[
-                transient_durations >= min_duration
-            ]
-
-        if max_duration is not None:
-            transient_durations = transient_durations[
-                transient_durations <= max_duration
-            ]
+    # Every month shares the y axis.
+    max_bin_size = max((counts.max() for counts, _ in histograms), default=0)
 
-        if xunits == "minutes":
-            transient_durations = transient_durations / 60
-
-        ax = fig.add_subplot(4, 3, i)
+    for i, ((counts, bin_edges), month) in enumerate(zip(histograms, months)):
+        ax = fig.add_subplot(4, 3, i + 1)
         ax.set_title(month)
-        ax.hist(transient_durations, bins=bins)
-        ax.set_ylim(
-            0,
-            get_max_bin_size(
-                monthly_transient_durations,
-                bins=bins,
-                min_duration=min_duration,
-                max_duration=max_duration,
-            ),
-        )
+        ax.hist(bin_edges[:-1], bins=bin_edges, weights=counts)
+        ax.set_ylim(0, max_bin_size)
 
         ax.set_ylabel("Count")
         ax.set_xlabel(f"Duration ({xunits})")
 
-    plt.tight_layout()
-    fig_file_name = helpers.snake_case(title)
-    plt.savefig(
+    fig.tight_layout()
+    return fig
+
+
+def get_duration_histograms_spec(bins_df, binning):
+    months, histograms = duration_stats.get_histograms(bins_df, binning)
+    bins, _, _, xunits = duration_stats.histogram_binnings[binning]
+    title = histogram_titles[binning]
+    return render.make_spec(
+        draw_duration_histograms,
         os.path.join(
             config.project_dir,
             "figures/transient_durations",
-            fig_file_name + config.figure_ending,
-        )
+            helpers.snake_case(title) + config.figure_ending,
+        ),
+        histograms=histograms,
+        months=months,
+        bins=bins,
+        title=title,
+        xunits=xunits,
     )
 
-def plot_monthly_transient_durations_by_length(whole_year_transients_df):
-    short_transients_df = whole_year_transients_df[whole_year_transients_df["duration"] <= 0.5].groupby("month").size()
-    med_short_transients_df = whole_year_transients_df[(0.5 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 5)].groupby("month").size()
-    med_transients_df = whole_year_transients_df[(5 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 3*60)].groupby("month").size()
-    long_transients_df = whole_year_transients_df[(3*60 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 20*60)].groupby("month").size()
-
-    plt.figure(figsize=(16,8))
-
-    x = short_transients_df.index
-    y = short_transients_df.values
-    plt.bar(x, y, label=r"$0 \less \rm{duration} \leq 0.5$ sec")
-
-    x = med_short_transients_df.index
-    y = med_short_transients_df.values
-    plt.bar(x, y, label=r"$0.5 \less \rm{duration} \leq 5$ sec")
 
-    x = med_transients_df.index
-    y = med_transients_df.values
-    plt.bar(x, y, label=r"$5 \less \rm{duration} \leq 3 \rm{min}$")
-
-    x = long_transients_df.index
-    y = long_transients_df.values
-    plt.bar(x, y, label=r"$3 \rm{min} \less \rm{duration} \leq 20 \rm{min}$")
+@instrumentation.instrumented
+def plot_duration_histograms(bins_df, binning):
+    logging.info("Plotting histogram of monthly transit durations.")
+    render.render_figure(get_duration_histograms_spec(bins_df, binning))
 
-    plt.legend()
 
-    plt.savefig(
-        os.path.join(
-            config.figures_path,
-            "transient_durations/monthly_transient_durations_by_length" + config.figure_ending,
-        )
+def get_monthly_ice_concentration():
+    return pd.read_csv(
+        config.processed_data_path + "/monthly_ice_concentration.csv"
     )
 
 
-def plot_monthly_long_transient_durations_and_ice_concentration(whole_year_transients_df):
-    short_transients_df = whole_year_transients_df[whole_year_transients_df["duration"] <= 0.5].groupby("month").size()
-    med_short_transients_df = whole_year_transients_df[(0.5 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 5)].groupby("month").size()
-    med_transients_df = whole_year_transients_df[(5 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 3*60)].groupby("month").size()
-    long_transients_df = whole_year_transients_df[(3*60 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 20*60)].groupby("month").size()
+def draw_monthly_transient_durations_by_length(class_counts):
+    fig = Figure(figsize=(16, 8))
+    ax = fig.add_subplot()
+
+    for duration_class, label in duration_class_labels.items():
+        ax.bar(class_counts.index, class_counts[duration_class], label=label)
 
-    fig, ax = plt.subplots(1,1,figsize=(16,8))
+    ax.legend()
+    return fig
 
-    ax.bar(whole_year_transients_df["month"].unique(), 0)
 
-    x = long_transients_df.index
-    y = long_transients_df.values
-    ax.bar(x, y, label=r"$3 \rm{min} \less \rm{duration} \leq 20 \rm{min}$")
+def draw_monthly_long_transient_durations_and_ice_property(
+    class_counts,
+    ice_months,
+    ice_values,
+    ice_label,
+    duration_classes_shown,
+    colour=None,
+):
+    fig = Figure(figsize=(16, 8))
+    ax = fig.add_subplot()
     ax.set_ylabel("Number of long transients per month")
 
+    for duration_class in duration_classes_shown:
+        ax.bar(
+            class_counts.index,
+            class_counts[duration_class],
+            label=duration_class_labels[duration_class],
+        )
+
     ax2 = ax.twinx()
-    ax.set_ylabel("Number of long transients per month")
-    monthly_ice_concentration = pd.read_csv(config.processed_data_path + "/monthly_ice_concentration.csv")
-    x = monthly_ice_concentration["month"].astype("str")
-    y = monthly_ice_concentration["total_concentration"]
-    ax2.set_ylabel("Ice concentration (/10)")
-    ax2.scatter(x, y, label="Ice concentration")
-    ax2.plot(x, y)
+    ax2.set_ylabel(ice_label)
+    ax2.scatter(ice_months, ice_values, label=ice_label, color=colour)
+    ax2.plot(ice_months, ice_values, color=colour)
 
     ax.legend(loc="upper left")
     ax2.legend(loc="upper right")
-    plt.savefig(
+    return fig
+
+
+def get_monthly_transient_durations_by_length_spec(class_counts):
+    return render.make_spec(
+        draw_monthly_transient_durations_by_length,
         os.path.join(
             config.figures_path,
-            "transient_durations/monthly_long_transient_durations_and_ice_concentration" + config.figure_ending,
-        )
+            "transient_durations/monthly_transient_durations_by_length"
+            + config.figure_ending,
+        ),
+        class_counts=class_counts,
     )
 
 
-def plot_monthly_long_transient_durations_and_temperature(whole_year_transients_df):
-    short_transients_df = whole_year_transients_df[whole_year_transients_df["duration"] <= 0.5].groupby("month").size()
-    med_short_transients_df = whole_year_transients_df[(0.5 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 5)].groupby("month").size()
-    med_transients_df = whole_year_transients_df[(5 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 3*60)].groupby("month").size()
-    long_transients_df = whole_year_transients_df[(3*60 < whole_year_transients_df["duration"]) & (whole_year_transients_df["duration"] <= 20*60)].groupby("month").size()
+def get_monthly_long_transient_durations_and_ice_concentration_spec(
+    class_counts, monthly_ice_concentration
+):
+    return render.make_spec(
+        draw_monthly_long_transient_durations_and_ice_property,
+        os.path.join(
+            config.figures_path,
+            "transient_durations/monthly_long_transient_durations_and_ice_concentration"
+            + config.figure_ending,
+        ),
+        class_counts=class_counts,
+        ice_months=monthly_ice_concentration["month"].astype("str"),
+        ice_values=monthly_ice_concentration["total_concentration"],
+        ice_label="Ice concentration (/10)",
+        duration_classes_shown=["long"],
+    )
 
-    fig, ax = plt.subplots(1,1,figsize=(16,8))
-    ax.set_ylabel("Number of long transients per month")
 
-    x = short_transients_df.index
-    y = short_transients_df.values
-    ax.bar(x, y, label=r"$0 \less \rm{duration} \leq 0.5$ sec")
+def get_monthly_long_transient_durations_and_temperature_spec(
+    class_counts, monthly_ice_concentration
+):
+    return render.make_spec(
+        draw_monthly_long_transient_durations_and_ice_property,
+        os.path.join(
+            config.figures_path,
+            "transient_durations/monthly_long_transient_durations_and_temperature"
+            + config.figure_ending,
+        ),
+        class_counts=class_counts,
+        ice_months=monthly_ice_concentration["month"].astype("str"),
+        ice_values=monthly_ice_concentration["mean_temperature"],
+        ice_label="Temperature (deg C)",
+        duration_classes_shown=list(duration_class_labels),
+        colour="black",
+    )
 
-    x = med_short_transients_df.index
-    y = med_short_transients_df.values
-    ax.bar(x, y, label=r"$0.5 \less \rm{duration} \leq 5$ sec")
 
-    x = med_transients_df.index
-    y = med_transients_df.values
-    ax.bar(x, y, label=r"$5 \less \rm{duration} \leq 3 \rm{min}$")
+@instrumentation.instrumented
+def plot_monthly_transient_durations_by_length(bins_df):
+    render.render_figure(
+        get_monthly_transient_durations_by_length_spec(
+            duration_stats.get_class_counts(bins_df)
+        )
+    )
 
-    x = long_transients_df.index
-    y = long_transients_df.values
-    ax.bar(x, y, label=r"$3 \rm{min} \less \rm{duration} \leq 20 \rm{min}$")
 
-    ax2 = ax.twinx()
-    monthly_ice_concentration = pd.read_csv(config.processed_data_path + "/monthly_ice_concentration.csv")
-    x = monthly_ice_concentration["month"].astype("str")
-    y = monthly_ice_concentration["mean_temperature"]
-    ax2.set_ylabel("Temperature (deg C)")
-    ax2.scatter(x, y, label="Temperature (deg C)", color="black")
-    ax2.plot(x, y, color="black")
+@instrumentation.instrumented
+def plot_monthly_long_transient_durations_and_ice_concentration(bins_df):
+    render.render_figure(
+        get_monthly_long_transient_durations_and_ice_concentration_spec(
+            duration_stats.get_class_counts(bins_df),
+            get_monthly_ice_concentration(),
+        )
+    )
 
-    ax.legend(loc="upper left")
-    ax2.legend(loc="upper right")
 
-    plt.legend()
-    plt.savefig(
-        os.path.join(
-            config.figures_path,
-            "transient_durations/monthly_long_transient_durations_and_temperature" + config.figure_ending,
+@instrumentation.instrumented
+def plot_monthly_long_transient_durations_and_temperature(bins_df):
+    render.render_figure(
+        get_monthly_long_transient_durations_and_temperature_spec(
+            duration_stats.get_class_counts(bins_df),
+            get_monthly_ice_concentration(),
         )
     )
 
 
+def get_figure_specs(bins_df=None):
+    """
+    Returns the specs of every transient duration figure, see render.py.
+    """
+    if bins_df is None:
+        bins_df, _ = duration_stats.read_duration_stats()
+
+    specs = [
+        get_duration_histograms_spec(bins_df, binning)
+        for binning in duration_stats.histogram_binnings
+    ]
+
+    class_counts = duration_stats.get_class_counts(bins_df)
+    monthly_ice_concentration = get_monthly_ice_concentration()
+    specs += [
+        get_monthly_transient_durations_by_length_spec(class_counts),
+        get_monthly_long_transient_durations_and_ice_concentration_spec(
+            class_counts, monthly_ice_concentration
+        ),
+        get_monthly_long_transient_durations_and_temperature_spec(
+            class_counts, monthly_ice_concentration
+        ),
+    ]
+
+    return specs
+
+
 if __name__ == "__main__":
-    monthly_transient_durations = helpers.load_monthly_transient_durations()
+    bins_df, summary_df = duration_stats.read_duration_stats()
 
-    plot_duration_histograms(
-        monthly_transient_durations,
-        bins=20,
-        title="All transients.",
-        xunits="minutes",
+    render.render_figures(
+        get_figure_specs(bins_df), n_workers=config.n_workers
     )
-    plot_duration_histograms(
-        monthly_transient_durations,
-        bins=20,
-        min_duration=3 * 60,
-        title="Only transients longer than 3 minutes.",
-        xunits="minutes",
-    )
-    plot_duration_histograms(
-        monthly_transient_durations,
-        bins=20,
-        max_duration=3 * 60,
-        title="Only transients shorter than 3 minutes.",
-    )
-    plot_duration_histograms(
-        monthly_transient_durations,
-        bins=15,
-        max_duration=15,
-        title="Only transients shorter than 15 seconds.",
-    )
-
-    whole_year_transients_df = pd.read_feather(config.processed_data_path + '/transient_timestamps_and_durations/whole_year.feather')
-    plot_monthly_transient_durations_by_length(whole_year_transients_df)
-    plot_monthly_long_transient_durations_and_ice_concentration(whole_year_transients_df)
-    plot_monthly_long_transient_durations_and_temperature(whole_year_transients_df)
 
-    report_monthly_transient_stats(monthly_transient_durations)
+    report_monthly_transient_stats(bins_df, summary_df)
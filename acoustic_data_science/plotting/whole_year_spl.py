@@ -1,30 +1,137 @@
-import matplotlib.pyplot as plt
 import pandas as pd
 import os
-from acoustic_data_science import config, helpers
+from matplotlib.figure import Figure
+from acoustic_data_science import config, helpers, instrumentation
+from acoustic_data_science.plotting import render
+from acoustic_data_science.processing import spl_pyramid
 import logging
 
 
-def plot_avg_spl(averaging_window=2 * 60 * 60 * 24 * 2):
+def get_avg_spl(averaging_window, resolution_mins):
+    """
+    Returns the rolling mean broadband SPL over averaging_window / 2 seconds,
+    one value every resolution_mins minutes. The mean is calculated from the
+    coarsest level of the SPL pyramid with bins of at most resolution_mins,
+    weighting each bin by the rows in it.
+
+    The window is a time span rather than a count of averaging_window rows as
+    it was before the pyramid, so across gaps in the recordings it covers
+    fewer rows than the old curve and no longer reaches back over the gap.
+    """
+    level = spl_pyramid.get_coarsest_level(resolution_mins * 60)
+    df = spl_pyramid.read_spl_pyramid(
+        level, columns=["timestamp", "count", "broadband_spl_mean"]
+    ).set_index("timestamp")
+    if df.empty:
+        return pd.Series(index=df.index, dtype="float64")
+
+    window = pd.Timedelta(seconds=averaging_window / 2)
+    rolling_sums = (
+        df.assign(broadband_spl_sum=df["broadband_spl_mean"] * df["count"])[
+            ["broadband_spl_sum", "count"]
+        ]
+        .rolling(window)
+        .sum()
+    )
+    rolling_mean = rolling_sums["broadband_spl_sum"] / rolling_sums["count"]
+    # The first window isn't a full window.
+    return rolling_mean[rolling_mean.index >= df.index[0] + window]
+
+
+def draw_avg_spl(timestamps, avg_spl):
+    fig = Figure(figsize=(16, 12))
+    ax = fig.add_subplot()
+
+    ax.plot(timestamps, avg_spl, "b-", label="Broadband SPL")
+
+    ax.legend()
+    return fig
+
+
+def get_avg_spl_spec(
+    averaging_window=2 * 60 * 60 * 24 * 2, resolution_mins=10
+):
+    avg_spl = get_avg_spl(averaging_window, resolution_mins)
+    return render.make_spec(
+        draw_avg_spl,
+        helpers.get_figure_path("whole_year_spl"),
+        timestamps=avg_spl.index,
+        avg_spl=avg_spl.values,
+    )
+
+
+@instrumentation.instrumented
+def plot_avg_spl(averaging_window=2 * 60 * 60 * 24 * 2, resolution_mins=10):
     logging.info("Plotting broadband SPL over the year.")
+    render.render_figure(get_avg_spl_spec(averaging_window, resolution_mins))
+
+
+def draw_daily_spl_and_ice_concentration(daily_spl, ice_coverage):
+    fig = Figure(figsize=(16, 8))
+    ax = fig.add_subplot()
+    ax.plot(
+        daily_spl["timestamp"],
+        daily_spl["broadband_spl_energy_mean"],
+        label="Daily broadband SPL (energy mean)",
+    )
+    ax.plot(
+        daily_spl["timestamp"],
+        daily_spl["background_spl_mean"],
+        label="Daily mean background SPL",
+    )
+    ax.set_xlabel("Date (YYYY-MM)")
+    ax.set_ylabel("SPL relative to maximum (dB)")
+
+    ax2 = ax.twinx()
+    ax2.scatter(
+        ice_coverage["timestamp"],
+        ice_coverage["total_concentration"],
+        color="black",
+        label="Ice concentration",
+    )
+    ax2.set_ylabel("Ice concentration (/10)")
+
+    ax.legend(loc="upper left")
+    ax2.legend(loc="upper right")
+    return fig
 
-    df = pd.read_feather(path=config.whole_year_path)
 
-    rolling_mean = df["broadband_spl"].rolling(averaging_window).mean()
-    rolling_mean_not_null = rolling_mean.notnull()
-    rolling_mean = rolling_mean[rolling_mean_not_null]
+def get_daily_spl_and_ice_concentration_spec():
+    """
+    The daily energy mean broadband SPL and mean background SPL from the SPL
+    pyramid against the ice concentration from the ice charts.
+    """
+    return render.make_spec(
+        draw_daily_spl_and_ice_concentration,
+        helpers.get_figure_path(
+            "daily_spl_and_ice_concentration", "whole_year_spl"
+        ),
+        daily_spl=spl_pyramid.read_spl_pyramid(
+            "1d",
+            columns=[
+                "timestamp",
+                "broadband_spl_energy_mean",
+                "background_spl_mean",
+            ],
+        ),
+        ice_coverage=pd.read_csv(
+            config.processed_data_path
+            + "/cambridge_bay_sea_ice_properties_from_ice_charts.csv",
+            usecols=["timestamp", "total_concentration"],
+            parse_dates=["timestamp"],
+        ),
+    )
 
-    plt.figure(figsize=(16, 12))
 
-    step = 1000
+@instrumentation.instrumented
+def plot_daily_spl_and_ice_concentration():
+    logging.info("Plotting daily SPL and ice concentration.")
+    render.render_figure(get_daily_spl_and_ice_concentration_spec())
 
-    t = df["timestamp"][rolling_mean_not_null]
-    y = rolling_mean
-    plt.plot(t[::step], y[::step], "b-", label="Broadband SPL")
 
-    plt.legend()
-    plt.savefig(helpers.get_figure_path("whole_year_spl"))
+def get_figure_specs():
+    return [get_avg_spl_spec(), get_daily_spl_and_ice_concentration_spec()]
 
 
 if __name__ == "__main__":
-    plot_avg_spl()
+    render.render_figures(get_figure_specs(), n_workers=config.n_workers)
@@ -0,0 +1,60 @@
+import pandas as pd
+import numpy as np
+
+
+def get_background_column_name(statistic, window_mins):
+    return f"background_{statistic}_{window_mins}min"
+
+
+def calc_background_spls(
+    broadband_spl,
+    windows_mins=(10,),
+    statistics=("mean",),
+    quantile=0.05,
+    state=None,
+):
+    """
+    Calculates rolling estimates of the background SPL from broadband_spl
+    (half second rows) for every combination of window length (in minutes)
+    and statistic in one call.
+
+    statistics can include 'mean' (O(n)), 'median' and 'quantile' (the given
+    low quantile), which are O(n log w) using pandas' skiplist.
+
+    state holds the last broadband SPL values of the previous month (as
+    returned by the previous call). Passing it warm-starts the windows so no
+    rows at the start of the month are null.
+
+    Returns a DataFrame with a column per window and statistic, named by
+    get_background_column_name, and the state for the next month.
+    """
+    broadband_spl = pd.Series(np.asarray(broadband_spl))
+    if state is None:
+        state = pd.Series([], dtype=broadband_spl.dtype)
+
+    values = pd.concat([state, broadband_spl], ignore_index=True)
+
+    background_spls = {}
+    for window_mins in windows_mins:
+        # Window is in half second intervals.
+        window = window_mins * 60 * 2
+        rolling = values.rolling(window)
+
+        for statistic in statistics:
+            if statistic == "mean":
+                background_spl = rolling.mean()
+            elif statistic == "median":
+                background_spl = rolling.median()
+            elif statistic == "quantile":
+                background_spl = rolling.quantile(quantile)
+            else:
+                raise ValueError(f"Unknown background statistic {statistic}.")
+
+            background_spls[
+                get_background_column_name(statistic, window_mins)
+            ] = background_spl.values[len(state) :]
+
+    max_window = max(windows_mins) * 60 * 2
+    new_state = values.iloc[max(0, len(values) - (max_window - 1)) :]
+
+    return pd.DataFrame(background_spls), new_state.reset_index(drop=True)
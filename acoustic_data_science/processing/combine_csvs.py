@@ -1,53 +1,483 @@
 import glob
+import multiprocessing
+from functools import partial
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import os
 import acoustic_data_science.config as config
+from acoustic_data_science import helpers, instrumentation
+from acoustic_data_science.processing import manifest
+from acoustic_data_science.processing.process_data import get_timestamp
 import logging
 
 
+def make_file_table(csv_paths, n_rows, first_rows=None):
+    """
+    Returns the per-file metadata of a month's CSVs, one row per file in
+    file_id order: the filename, the start time of its rows (parsed from the
+    filename, NaT if unrecognised), number of rows (n_rows), size in bytes
+    and first_row, the row of the CSV its rows start at if only some of them
+    are in the month (see shard_csvs_to_months).
+    Rows of the combined data refer to their file by its file_id, the
+    position of the file in csv_paths.
+    """
+    filenames = [os.path.basename(csv_path) for csv_path in csv_paths]
+    if first_rows is None:
+        first_rows = np.zeros(len(csv_paths), dtype="int64")
+    first_rows = np.asarray(first_rows, dtype="int64")
+
+    return pd.DataFrame(
+        {
+            "file_id": np.arange(len(csv_paths), dtype="int32"),
+            "filename": filenames,
+            "start_time": pd.to_datetime(
+                pd.Series(
+                    [get_timestamp(filename) for filename in filenames],
+                    dtype="object",
+                )
+            ).values.astype("datetime64[ns]")
+            + (first_rows * 500_000_000).astype("timedelta64[ns]"),
+            "n_rows": np.asarray(n_rows, dtype="int64"),
+            "n_bytes": np.array(
+                [os.path.getsize(csv_path) for csv_path in csv_paths],
+                dtype="int64",
+            ),
+            "first_row": first_rows,
+        }
+    )
+
+
 def combine_csvs(month):
     """
     Takes path to month folder which should contain all CSVs to be combined as
     top level files e.g. ../data/raw/reorganised_tols/
-    Returns dataframe with CSVs contatenated and filenames column.
+    Returns dataframe with CSVs contatenated and a file_id column, and the
+    file table of the CSVs (see make_file_table).
     """
     logging.info("Getting list of csv files in month directory.")
-    files = glob.iglob(os.path.join(month, "*.csv"))
-    logging.info(
-        "Making DataFrame generator for each CSV. Name of file saved in"
-        " filename column."
-    )
-    df_from_each_file = (
-        pd.read_csv(f).assign(filename=os.path.basename(f).split("/")[-1])
-        for f in files
-    )
+    files = list(glob.iglob(os.path.join(month, "*.csv")))
+    logging.info("Reading each CSV. Number of file saved in file_id column.")
+    df_from_each_file = [
+        pd.read_csv(f).assign(file_id=np.int32(file_id))
+        for file_id, f in enumerate(files)
+    ]
     # Time ordering of rows preserved within each DF but DFs are in wrong order at this point.
     # Save in interim path as YYYY_MM.feather.
     logging.info("Concatenate each DataFrame.")
-    return pd.concat(df_from_each_file, ignore_index=True)
+    return pd.concat(df_from_each_file, ignore_index=True), make_file_table(
+        files, [len(df) for df in df_from_each_file]
+    )
     # .to_feather(os.path.join(config.interim_data_path,month.split('/')[-1]+'.feather'))
 
 
-def combine_monthly_csvs():
+def get_csv_schema(csv_path, usecols=None, tol_dtype="float64"):
+    """
+    Reads only the header of a TOL CSV and pins every column to tol_dtype so
+    that no CSV in the month needs its types inferring.
+    Returns the pandas dtypes and the matching arrow schema (see
+    add_file_id for the schema with the file_id column).
+    """
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    if usecols is not None:
+        columns = [column for column in columns if column in usecols]
+
+    dtypes = {column: tol_dtype for column in columns}
+    schema = pa.schema(
+        [
+            pa.field(column, pa.from_numpy_dtype(tol_dtype))
+            for column in columns
+        ]
+    )
+
+    return dtypes, schema
+
+
+def read_csv_as_batch(csv_path, dtypes, schema):
+    """
+    Reads a single TOL CSV with the pinned dtypes and returns it as an arrow
+    record batch.
+    """
+    df = pd.read_csv(csv_path, usecols=list(dtypes), dtype=dtypes)
+
+    return pa.RecordBatch.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def add_file_id(batch, file_id, schema):
+    """
+    Returns the rows of a CSV's record batch with a file_id column attached,
+    as a record batch of schema (the CSV schema plus file_id).
+    """
+    return pa.RecordBatch.from_arrays(
+        batch.columns
+        + [pa.array(np.full(batch.num_rows, file_id, dtype="int32"))],
+        schema=schema,
+    )
+
+
+def get_month_runs(csv_path, n_rows, folder_month_name):
+    """
+    Splits the rows of a CSV by the month (YYYY_MM) of their timestamp, the
+    start time parsed from its filename plus half a second for each row.
+    Rows are in time order so each month's rows are one run.
+    Returns the month name, first row and number of rows of each run, all
+    the rows being in folder_month_name if the filename isn't recognised.
+    """
+    start_time = pd.to_datetime(get_timestamp(os.path.basename(csv_path)))
+    if pd.isnull(start_time):
+        return [(folder_month_name, 0, n_rows)]
+
+    months = (
+        np.datetime64(start_time, "ns")
+        + (np.arange(n_rows) * 500_000_000).astype("timedelta64[ns]")
+    ).astype("datetime64[M]")
+    starts = np.flatnonzero(np.append(True, months[1:] != months[:-1]))
+    lengths = np.diff(np.append(starts, n_rows))
+
+    return [
+        (str(months[start]).replace("-", "_"), start, length)
+        for start, length in zip(starts.tolist(), lengths.tolist())
+    ]
+
+
+def write_partition_batches(partition):
+    """Writes the buffered rows of a month partition (see open_partition)."""
+    if partition["batches"]:
+        partition["writer"].write_table(
+            pa.Table.from_batches(
+                partition["batches"], partition["schema"]
+            ).combine_chunks()
+        )
+        partition["n_rows"] += partition["buffered_rows"]
+        partition["batches"] = []
+        partition["buffered_rows"] = 0
+
+
+def open_partition(feathers_path, month_name, schema):
+    """
+    Returns the state of the raw feather of a month being written by
+    shard_csvs_to_months: its writer, the rows buffered for it and the
+    CSVs (with the number of their rows and the row they start at) whose
+    rows are in it, in file_id order.
+    """
+    feather_path = os.path.join(feathers_path, month_name + ".feather")
+    options = pa.ipc.IpcWriteOptions(compression="lz4")
+    return {
+        "feather_path": feather_path,
+        "schema": schema,
+        "writer": pa.ipc.new_file(
+            feather_path + ".tmp", schema, options=options
+        ),
+        "batches": [],
+        "buffered_rows": 0,
+        "n_rows": 0,
+        "csv_paths": [],
+        "file_n_rows": [],
+        "first_rows": [],
+    }
+
+
+@instrumentation.instrumented
+def shard_csvs_to_months(
+    month_paths,
+    feathers_path,
+    n_workers=config.n_workers,
+    usecols=None,
+    tol_dtype="float64",
+    batch_rows=config.batch_rows,
+    month_names=None,
+    csv_paths=None,
+):
+    """
+    Parses every CSV in the month folders in a process pool and streams each
+    row to the raw feather in feathers_path of the month its timestamp is in
+    (see get_month_runs), in a single pass. The rows of files straddling the
+    end of a month go to the next month rather than being dropped by
+    select_exactly_one_month, and no month processes rows of another.
+    Each month's file table (see make_file_table) has one row for each CSV
+    with rows in it, starting at the first of them.
+    If csv_paths is given only those CSVs of the folders are read, and if
+    month_names is given only those months are written, so a few months can
+    be rewritten from the CSVs with rows in them. The months are the same as
+    if every month was written.
+    Returns the number of rows written to each month and the months the rows
+    of each CSV read are in (including months that weren't written).
+    """
+    csvs = [
+        (csv_path, helpers.month_name_from_month_path(month_path))
+        for month_path in sorted(month_paths)
+        for csv_path in sorted(glob.glob(os.path.join(month_path, "*.csv")))
+        if csv_paths is None or csv_path in csv_paths
+    ]
+    if len(csvs) == 0:
+        raise FileNotFoundError(f"No CSV files found in {month_paths}.")
+
+    dtypes, csv_schema = get_csv_schema(csvs[0][0], usecols, tol_dtype)
+    read_csv = partial(read_csv_as_batch, dtypes=dtypes, schema=csv_schema)
+    schema = csv_schema.append(pa.field("file_id", pa.int32()))
+    # Limit the number of parsed files waiting to be written.
+    files_in_flight = n_workers * 4
+
+    logging.info(
+        f"Sharding {len(csvs)} CSVs into months in {feathers_path} with"
+        f" {n_workers} workers."
+    )
+    os.makedirs(feathers_path, exist_ok=True)
+    partitions = {}
+    csv_months = {}
+    completed = False
+    try:
+        with multiprocessing.Pool(n_workers) as pool:
+            for i in range(0, len(csvs), files_in_flight):
+                month_csvs = csvs[i : i + files_in_flight]
+                batches = pool.imap(
+                    read_csv, [csv_path for csv_path, _ in month_csvs]
+                )
+                for batch, (csv_path, folder_month_name) in zip(
+                    batches, month_csvs
+                ):
+                    month_runs = get_month_runs(
+                        csv_path, batch.num_rows, folder_month_name
+                    )
+                    csv_months[csv_path] = [
+                        month_name for month_name, _, _ in month_runs
+                    ]
+                    for month_name, start, length in month_runs:
+                        if month_names is not None and (
+                            month_name not in month_names
+                        ):
+                            continue
+                        if month_name not in partitions:
+                            partitions[month_name] = open_partition(
+                                feathers_path, month_name, schema
+                            )
+                        partition = partitions[month_name]
+
+                        partition["batches"].append(
+                            add_file_id(
+                                batch.slice(start, length),
+                                len(partition["csv_paths"]),
+                                schema,
+                            )
+                        )
+                        partition["buffered_rows"] += length
+                        partition["csv_paths"].append(csv_path)
+                        partition["file_n_rows"].append(length)
+                        partition["first_rows"].append(start)
+
+                        # Coalesce the small per-file batches into larger
+                        # ones.
+                        if partition["buffered_rows"] >= batch_rows:
+                            write_partition_batches(partition)
+
+        for partition in partitions.values():
+            write_partition_batches(partition)
+        completed = True
+    finally:
+        # Don't leave partly written months behind if anything failed.
+        for partition in partitions.values():
+            partition["writer"].close()
+            if not completed:
+                os.remove(partition["feather_path"] + ".tmp")
+
+    for month_name, partition in partitions.items():
+        os.replace(
+            partition["feather_path"] + ".tmp", partition["feather_path"]
+        )
+        helpers.write_file_table(
+            make_file_table(
+                partition["csv_paths"],
+                partition["file_n_rows"],
+                partition["first_rows"],
+            ),
+            partition["feather_path"],
+        )
+        logging.info(f"{month_name}: {partition['n_rows']} rows.")
+
+    month_n_rows = {
+        month_name: partition["n_rows"]
+        for month_name, partition in partitions.items()
+    }
+    return month_n_rows, csv_months
+
+
+def get_possible_months(csv_path, folder_month_name):
     """
-    Combines monthly CSVs and saves them as feather files.
+    Returns the months the rows of a CSV can be in without reading it: the
+    month it starts in and the next, which it reaches if it straddles the end
+    of the month (see get_month_runs).
     """
-    logging.info("Combining CSVs to feather file.")
+    start_time = pd.to_datetime(get_timestamp(os.path.basename(csv_path)))
+    if pd.isnull(start_time):
+        return [folder_month_name]
 
-    month_paths = []
-    for month in os.listdir(config.raw_csvs_path):
-        logging.info(f"=== Processing {month.split('/')[-1]} ===")
-        csv_folder_path = f"{config.raw_csvs_path}/{month}"
-        if os.path.isdir(csv_folder_path):
-            month_paths.append(csv_folder_path)
+    month = np.datetime64(start_time, "M")
+    return [str(month).replace("-", "_"), str(month + 1).replace("-", "_")]
 
-    for month in month_paths:
-        combine_csvs(month).to_feather(
-            os.path.join(
-                config.raw_feathers_path, month.split("/")[-1] + ".feather"
+
+def get_combine_record(build_manifest, csv_paths):
+    return manifest.make_record(
+        inputs={
+            os.path.basename(csv_path): manifest.get_file_hash(
+                build_manifest, csv_path
             )
+            for csv_path in csv_paths
+        },
+        params={"tol_dtype": "float64", "usecols": None},
+        code_version=manifest.get_code_version(__file__),
+    )
+
+
+def get_combine_output_paths(record):
+    """
+    Returns the raw feathers and file tables of the months the CSVs of a
+    folder's combine record have rows in.
+    """
+    csv_months = record["csv_months"] if record else {}
+    feather_paths = [
+        os.path.join(config.raw_feathers_path, month_name + ".feather")
+        for month_name in sorted(set().union(*csv_months.values()))
+    ]
+    return feather_paths + [
+        helpers.get_file_table_path(feather_path)
+        for feather_path in feather_paths
+    ]
+
+
+@instrumentation.instrumented
+def combine_monthly_csvs(n_workers=config.n_workers, incremental=False):
+    """
+    Combines monthly CSVs and saves them as feather files, one per month of
+    the rows' timestamps (see shard_csvs_to_months).
+    If incremental, each CSV folder is recorded in the build manifest with
+    the months its CSVs have rows in. Only the months that the folders
+    changed since they were last combined had rows in, or can have rows in
+    now, are written again, from the CSVs of any folder with rows in them.
+    """
+    logging.info("Combining CSVs to feather files.")
+    month_paths = helpers.get_month_paths(config.raw_csvs_path)
+
+    if not incremental:
+        shard_csvs_to_months(
+            month_paths, config.raw_feathers_path, n_workers=n_workers
+        )
+        return
+
+    build_manifest = manifest.load_manifest()
+    folder_csv_paths = {
+        helpers.month_name_from_month_path(month_path): sorted(
+            glob.glob(os.path.join(month_path, "*.csv"))
+        )
+        for month_path in month_paths
+    }
+    records = {}
+    changed_folders = []
+    for folder_month_name, csv_paths in folder_csv_paths.items():
+        records[folder_month_name] = get_combine_record(
+            build_manifest, csv_paths
+        )
+        if not manifest.is_up_to_date(
+            build_manifest,
+            "combine",
+            folder_month_name,
+            records[folder_month_name],
+            get_combine_output_paths(
+                manifest.get_stored_record(
+                    build_manifest, "combine", folder_month_name
+                )
+            ),
+        ):
+            changed_folders.append(folder_month_name)
+    removed_folders = [
+        folder_month_name
+        for folder_month_name in build_manifest["stages"].get("combine", {})
+        if folder_month_name not in folder_csv_paths
+    ]
+    if not changed_folders and not removed_folders:
+        return
+
+    # The months the changed folders had rows in and can have rows in now.
+    month_names = set()
+    for folder_month_name in changed_folders + removed_folders:
+        stored_record = manifest.get_stored_record(
+            build_manifest, "combine", folder_month_name
+        )
+        if stored_record is not None:
+            for csv_month_names in stored_record["csv_months"].values():
+                month_names.update(csv_month_names)
+    for folder_month_name in changed_folders:
+        for csv_path in folder_csv_paths[folder_month_name]:
+            month_names.update(
+                get_possible_months(csv_path, folder_month_name)
+            )
+
+    # Every CSV with rows in those months. Those of unchanged folders are
+    # known from their records, e.g. a file straddling into a new month.
+    csv_paths = [
+        csv_path
+        for folder_month_name in changed_folders
+        for csv_path in folder_csv_paths[folder_month_name]
+    ]
+    for folder_month_name, folder_paths in folder_csv_paths.items():
+        if folder_month_name in changed_folders:
+            continue
+        csv_months = manifest.get_stored_record(
+            build_manifest, "combine", folder_month_name
+        )["csv_months"]
+        csv_paths += [
+            csv_path
+            for csv_path in folder_paths
+            if month_names.intersection(csv_months[os.path.basename(csv_path)])
+        ]
+
+    logging.info(
+        f"Combining {', '.join(sorted(month_names))} from {len(csv_paths)}"
+        f" CSVs of changed folders {', '.join(changed_folders)}."
+    )
+    month_n_rows, csv_months = {}, {}
+    if csv_paths:
+        month_n_rows, csv_months = shard_csvs_to_months(
+            month_paths,
+            config.raw_feathers_path,
+            n_workers=n_workers,
+            month_names=month_names,
+            csv_paths=set(csv_paths),
+        )
+    if not month_names.issuperset(
+        month_name
+        for folder_month_name in changed_folders
+        for csv_path in folder_csv_paths[folder_month_name]
+        for month_name in csv_months[csv_path]
+    ):
+        # A changed CSV longer than a month, so combine every month.
+        logging.info("Rows reach months that weren't expected, combining all.")
+        month_n_rows, csv_months = shard_csvs_to_months(
+            month_paths, config.raw_feathers_path, n_workers=n_workers
+        )
+        changed_folders = list(folder_csv_paths)
+
+    # Months that no longer have any rows.
+    for month_name in month_names - set(month_n_rows):
+        feather_path = os.path.join(
+            config.raw_feathers_path, month_name + ".feather"
+        )
+        for path in (feather_path, helpers.get_file_table_path(feather_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    for folder_month_name in changed_folders:
+        record = records[folder_month_name]
+        record["csv_months"] = {
+            os.path.basename(csv_path): csv_months.get(csv_path, [])
+            for csv_path in folder_csv_paths[folder_month_name]
+        }
+        manifest.update_record(
+            build_manifest, "combine", folder_month_name, record
         )
+    for folder_month_name in removed_folders:
+        del build_manifest["stages"]["combine"][folder_month_name]
+    manifest.save_manifest(build_manifest)
 
 
 if __name__ == "__main__":
-    combine_monthly_csvs()
+    combine_monthly_csvs(incremental=config.incremental_builds)
@@ -0,0 +1,138 @@
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# 10**(x/10) == exp(x*DB_TO_NEPER).
+DB_TO_NEPER = np.log(10) / 10
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _energy_sum_db_numba(levels, out):
+        for i in numba.prange(levels.shape[0]):
+            row_max = levels[i, 0]
+            for j in range(1, levels.shape[1]):
+                if levels[i, j] > row_max:
+                    row_max = levels[i, j]
+
+            energy = 0.0
+            for j in range(levels.shape[1]):
+                energy += np.exp((levels[i, j] - row_max) * DB_TO_NEPER)
+
+            out[i] = row_max + 10 * np.log10(energy)
+
+
+def energy_sum_db(levels, chunk_rows=2**16, backend="numpy", overwrite=False):
+    """
+    Sums the energy of each row of levels (a 2D array of levels in dB) and
+    returns it in dB, i.e. 10*log10(sum(10**(x/10))).
+
+    Uses the log-sum-exp form m + 10*log10(sum(10**((x - m)/10))), where m is
+    the row maximum, so 10**(x/10) never overflows float32.
+    Rows are processed chunk_rows at a time with a single work buffer. If
+    overwrite is True levels itself is used as the work buffer and is
+    destroyed.
+    backend can be 'numpy' (the default), or 'numexpr' or 'numba' when they
+    are installed. Both are multithreaded so are faster on machines with
+    several cores.
+    """
+    levels = np.asarray(levels)
+    if backend not in ("numpy", "numexpr", "numba"):
+        raise ValueError(f"Unknown energy sum backend {backend}.")
+    if backend != "numpy" and globals()[backend] is None:
+        raise ImportError(
+            f"The {backend} energy sum backend is not installed."
+        )
+
+    out = np.empty(levels.shape[0], dtype=levels.dtype)
+
+    if backend == "numba":
+        _energy_sum_db_numba(np.ascontiguousarray(levels), out)
+        return out
+
+    if not overwrite:
+        buffer = np.empty(
+            (min(chunk_rows, levels.shape[0]), levels.shape[1]),
+            dtype=levels.dtype,
+        )
+
+    for start in range(0, levels.shape[0], chunk_rows):
+        chunk = levels[start : start + chunk_rows]
+        work = chunk if overwrite else buffer[: len(chunk)]
+        row_max = chunk.max(axis=1)
+
+        if backend == "numexpr":
+            numexpr.evaluate(
+                "exp((chunk - row_max) * k)",
+                local_dict={
+                    "chunk": chunk,
+                    "row_max": row_max[:, np.newaxis],
+                    "k": levels.dtype.type(DB_TO_NEPER),
+                },
+                out=work,
+            )
+        else:
+            np.subtract(chunk, row_max[:, np.newaxis], out=work)
+            work *= levels.dtype.type(DB_TO_NEPER)
+            np.exp(work, out=work)
+
+        energy = work.sum(axis=1)
+        np.log10(energy, out=energy)
+        energy *= 10
+        out[start : start + len(chunk)] = row_max + energy
+
+    return out
+
+
+def benchmark(n_rows=2 * 60 * 60 * 24, n_bands=31, seed=0):
+    """
+    Times energy_sum_db against the original applymap implementation of
+    calc_broadband_spl on n_rows of synthetic float32 TOLs (one day of half
+    second rows by default).
+    """
+    rng = np.random.default_rng(seed)
+    tols_df = pd.DataFrame(
+        rng.normal(80, 10, size=(n_rows, n_bands)).astype("float32")
+    )
+
+    start = time.perf_counter()
+    reference = (
+        10
+        * np.log10(
+            tols_df.applymap(lambda x: 10 ** (x / 10)).sum(axis=1)
+        ).values
+    )
+    applymap_seconds = time.perf_counter() - start
+    logging.info(f"applymap: {applymap_seconds:.3f} s for {n_rows} rows.")
+
+    for backend in ("numpy", "numexpr", "numba"):
+        if backend != "numpy" and globals()[backend] is None:
+            continue
+        # Run once beforehand so compilation is not timed.
+        energy_sum_db(tols_df.values[:10], backend=backend)
+
+        start = time.perf_counter()
+        result = energy_sum_db(tols_df.to_numpy(copy=True), backend=backend)
+        seconds = time.perf_counter() - start
+
+        logging.info(
+            f"{backend}: {seconds:.3f} s for {n_rows} rows,"
+            f" {applymap_seconds / seconds:.0f}x faster than applymap, max"
+            f" difference {np.abs(result - reference).max():.2e} dB."
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,8 +1,9 @@
 import pandas as pd
-from acoustic_data_science import config
+from acoustic_data_science import config, helpers, instrumentation
 import numpy as np
 
 
+@instrumentation.instrumented
 def process_ice_coverage_csv():
     df = pd.read_csv(
         config.external_data_path
@@ -41,8 +42,8 @@ def get_monthly_ice_concentration():
     ice_concentration = pd.read_csv(config.processed_data_path + '/cambridge_bay_sea_ice_properties_from_ice_charts.csv')[["timestamp", "total_concentration", "mean_temperature"]]
     ice_concentration = ice_concentration.replace(np.nan, 0)
 
-    ice_concentration["timestamp"] = ice_concentration["timestamp"].apply(pd.to_datetime)
-    ice_concentration["month"] = ice_concentration['timestamp'].apply(lambda x: '{year}{month:02}'.format(year=x.year, month=x.month)).values
+    ice_concentration["timestamp"] = pd.to_datetime(ice_concentration["timestamp"])
+    ice_concentration["month"] = helpers.get_month_keys(ice_concentration["timestamp"])
     #ice_concentration_monthly = ice_concentration.groupby("month").mean()
     #ice_concentration_monthly = ice_concentration_monthly.sort_values(["month"])
 
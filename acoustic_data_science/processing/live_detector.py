@@ -0,0 +1,190 @@
+import glob
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from acoustic_data_science import config, helpers, instrumentation
+from acoustic_data_science.analysis import streaming, transient_durations
+from acoustic_data_science.processing import combine_csvs, process_data
+from acoustic_data_science.processing.background_spl import (
+    calc_background_spls,
+)
+
+# Columns of the rolling output of detected transients.
+transient_columns = [
+    "timestamp",
+    "end_timestamp",
+    "duration",
+    "filename",
+    "peak_broadband_spl",
+]
+
+
+def make_live_state():
+    """
+    Returns the state carried between files: the last file processed, the
+    broadband SPL the live data is normalised to, the last background
+    window of broadband SPL and the rows of any transient still loud at the
+    end of the last file.
+    """
+    return {
+        "last_csv_name": None,
+        "reference_spl": None,
+        "background": None,
+        "open_transient": None,
+    }
+
+
+@instrumentation.instrumented
+def detect_transients(df, files_df, state):
+    """
+    Runs one raw CSV, with its file table files_df (see
+    combine_csvs.make_file_table), through the processing steps (process_df,
+    background SPL and loud tagging) and transient segmentation, carrying the
+    background window and any open transient over from the previous file in
+    state.
+    Returns the transients that ended in this file with their start and end
+    timestamps, duration, the file they started in and their peak broadband
+    SPL.
+    """
+    df = process_data.process_df(df, files_df)
+    if len(df) == 0:
+        return pd.DataFrame(columns=transient_columns)
+    # Open transients carry their rows into the next file, so keep the name
+    # of the file of each row.
+    df["filename"] = files_df["filename"].to_numpy()[df["file_id"].to_numpy()]
+
+    # The overall maximum isn't known live, so the broadband SPL is
+    # normalised to the maximum of the first file. Loud tags don't depend on
+    # it as the background shifts by the same offset.
+    if state["reference_spl"] is None:
+        state["reference_spl"] = df["unnormalised_broadband_spl"].max()
+    df["broadband_spl"] = (
+        df["unnormalised_broadband_spl"] - state["reference_spl"]
+    )
+
+    background_spls, state["background"] = calc_background_spls(
+        df["broadband_spl"],
+        windows_mins=(config.background_window_mins,),
+        state=state["background"],
+    )
+    df["background_spl"] = background_spls.iloc[:, 0].values
+    # Drop the rows before the first background window is full.
+    df = df.loc[
+        df["background_spl"].notna(),
+        ["timestamp", "filename", "broadband_spl", "background_spl"],
+    ]
+    df = process_data.tag_loud_events(
+        df, threshold_db=config.loud_threshold_db
+    )
+
+    if state["open_transient"] is not None:
+        df = pd.concat([state["open_transient"], df], ignore_index=True)
+    df, state["open_transient"] = streaming.split_open_transient(
+        df.reset_index(drop=True)
+    )
+
+    transients_df = transient_durations.segment_transients(df)
+    lengths = (transients_df["stop"] - transients_df["start"]).to_numpy()
+    peak_broadband_spls = np.empty(len(lengths))
+    if len(lengths) > 0:
+        peak_broadband_spls = np.maximum.reduceat(
+            df["broadband_spl"].to_numpy()[df["loud"].to_numpy()],
+            np.cumsum(lengths) - lengths,
+        )
+
+    return pd.DataFrame(
+        {
+            "timestamp": transients_df["timestamp"],
+            "end_timestamp": transients_df["end_timestamp"],
+            "duration": transients_df["duration"],
+            "filename": df["filename"].to_numpy()[
+                transients_df["start"].to_numpy()
+            ],
+            "peak_broadband_spl": peak_broadband_spls,
+        }
+    )
+
+
+def append_transients(transients_df, output_path=None):
+    """
+    Appends transients to the rolling output, one CSV per day of transient
+    start times.
+    """
+    if output_path is None:
+        output_path = config.live_transients_path
+
+    os.makedirs(output_path, exist_ok=True)
+    days = helpers.get_day_keys(transients_df["timestamp"])
+    for day in np.unique(days):
+        day_csv_path = os.path.join(output_path, f"{day}.csv")
+        transients_df[days == day].to_csv(
+            day_csv_path,
+            mode="a",
+            header=not os.path.exists(day_csv_path),
+            index=False,
+        )
+
+
+def process_new_csvs(state, drop_path=None, output_path=None):
+    """
+    Detects the transients in the CSVs in drop_path that are newer than the
+    last one processed, in time order (ICLISTEN CSV names start with their
+    start time), and appends them to the rolling output.
+    CSVs must appear in drop_path whole, e.g. by being moved in once written.
+    """
+    if drop_path is None:
+        drop_path = config.live_drop_path
+
+    csv_names = sorted(
+        os.path.basename(csv_path)
+        for csv_path in glob.glob(os.path.join(drop_path, "*.csv"))
+    )
+    if state["last_csv_name"] is not None:
+        csv_names = [
+            csv_name
+            for csv_name in csv_names
+            if csv_name > state["last_csv_name"]
+        ]
+
+    for csv_name in csv_names:
+        start_time = time.perf_counter()
+        csv_path = os.path.join(drop_path, csv_name)
+        df = pd.read_csv(csv_path).assign(file_id=np.int32(0))
+        transients_df = detect_transients(
+            df, combine_csvs.make_file_table([csv_path], [len(df)]), state
+        )
+        append_transients(transients_df, output_path)
+        state["last_csv_name"] = csv_name
+
+        logging.info(
+            f"{csv_name}: {len(transients_df)} transients in"
+            f" {(time.perf_counter() - start_time) * 1000:.1f} ms."
+        )
+
+
+def watch(drop_path=None, output_path=None, poll_seconds=None, state=None):
+    """
+    Polls drop_path for new CSVs every poll_seconds and detects transients
+    in them as they arrive, until interrupted.
+    """
+    if poll_seconds is None:
+        poll_seconds = config.live_poll_seconds
+    if state is None:
+        state = make_live_state()
+
+    logging.info(f"Watching {drop_path or config.live_drop_path} for CSVs.")
+    while True:
+        process_new_csvs(state, drop_path, output_path)
+        time.sleep(poll_seconds)
+
+
+if __name__ == "__main__":
+    # The per-stage timings would swamp the per-file latencies.
+    config.instrument = False
+    try:
+        watch()
+    except KeyboardInterrupt:
+        logging.info("Stopped watching.")
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import os
+
+from acoustic_data_science import config
+
+
+def load_manifest(manifest_path=None):
+    """
+    Loads the build manifest, which records for each stage and month the
+    inputs, parameters and code version its outputs were built from.
+    """
+    if manifest_path is None:
+        manifest_path = config.manifest_path
+
+    if not os.path.exists(manifest_path):
+        return {"files": {}, "stages": {}}
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path=None):
+    if manifest_path is None:
+        manifest_path = config.manifest_path
+
+    # Write then rename so an interrupted run never leaves half a manifest.
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def get_file_hash(manifest, path):
+    """
+    Returns the SHA-256 of the contents of the file at path. Hashes are cached
+    in the manifest by path, size and modification time so unchanged files
+    are not read again.
+    """
+    stat = os.stat(path)
+    cached = manifest["files"].get(path)
+    if (
+        cached is not None
+        and cached["size"] == stat.st_size
+        and cached["mtime_ns"] == stat.st_mtime_ns
+    ):
+        return cached["sha256"]
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            sha256.update(block)
+
+    manifest["files"][path] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256.hexdigest(),
+    }
+    return sha256.hexdigest()
+
+
+def get_code_version(*source_paths):
+    """
+    Returns a hash of the given source files, so outputs are rebuilt when the
+    code that made them changes.
+    """
+    sha256 = hashlib.sha256()
+    for source_path in source_paths:
+        with open(source_path, "rb") as f:
+            sha256.update(f.read())
+
+    return sha256.hexdigest()
+
+
+def get_digest(record):
+    """
+    Returns a hash identifying a record, used as the input of later stages.
+    """
+    return hashlib.sha256(
+        json.dumps(record, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def make_record(inputs, params, code_version):
+    """
+    inputs is a dict of input name to hash, params a dict of the parameters
+    the stage depends on (must be JSON serialisable).
+    """
+    return {"inputs": inputs, "params": params, "code_version": code_version}
+
+
+def get_stored_record(manifest, stage, key):
+    return manifest["stages"].get(stage, {}).get(key)
+
+
+def is_up_to_date(manifest, stage, key, record, output_paths):
+    """
+    True if the outputs of stage for key exist and were built from the same
+    inputs, parameters and code as record.
+    """
+    stored_record = get_stored_record(manifest, stage, key)
+    if stored_record is None:
+        return False
+
+    for field in ("inputs", "params", "code_version"):
+        if stored_record[field] != record[field]:
+            return False
+
+    if not all(os.path.exists(path) for path in output_paths):
+        return False
+
+    logging.info(f"{stage} of {key} is up to date.")
+    return True
+
+
+def update_record(manifest, stage, key, record):
+    manifest["stages"].setdefault(stage, {})[key] = record
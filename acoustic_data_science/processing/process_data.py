@@ -6,30 +6,25 @@ import pandas as pd
 import numpy as np
 import datetime
 import os
-import glob
-
-from acoustic_data_science import config, helpers
-
-
-def combine_csvs(month):
-    """
-    Takes path to month folder which should contain all CSVs to be combined as
-    top level files e.g. ../data/raw/monthly_data/reorganised_tols/
-    Returns dataframe with CSVs contatenated and filenames column.
-    """
-
-    # List of csv files in month directory.
-    files = glob.iglob(os.path.join(month, "*.csv"))
-    # DataFrame generator for each CSV. Name of file saved in filename column.
-    df_from_each_file = (
-        pd.read_csv(f).assign(filename=os.path.basename(f).split("/")[-1])
-        for f in files
-    )
-    # Concatenate each DataFrame.
-    # Time ordering of rows preserved within each DF but DFs are in wrong order at this point.
-    # Save in interim path as YYYY_MM.feather.
-    return pd.concat(df_from_each_file, ignore_index=True)
-    # .to_feather(os.path.join(config.interim_data_path,month.split('/')[-1]+'.feather'))
+import multiprocessing
+import tempfile
+
+import pyarrow as pa
+
+from acoustic_data_science import config, helpers, instrumentation
+from acoustic_data_science.processing import (
+    background_spl,
+    energy_sum,
+    manifest,
+    spl_pyramid,
+)
+from acoustic_data_science.processing.background_spl import (
+    calc_background_spls,
+)
+from acoustic_data_science.processing.energy_sum import energy_sum_db
+from acoustic_data_science.processing.processed_dataset import (
+    write_processed_dataset,
+)
 
 
 def get_timestamp(csv_name):
@@ -55,63 +50,126 @@ def get_timestamp(csv_name):
     return datetime_object
 
 
-def get_timestamps(df):
-    first_rows = np.unique(df["filename"].values, return_index=1)[1]
-    first_rows.sort()
-    first_rows
-    last_rows = np.concatenate((first_rows[1:], [df.index[-1]])) - 1
-    last_rows
-
-    df["timestamp"] = df["filename"].apply(get_timestamp)
+@instrumentation.instrumented
+def get_timestamps(df, files_df):
+    """
+    Timestamps each row as the start time of its file (from the file table
+    files_df, see combine_csvs.make_file_table) plus half a second for each
+    row since the start of the file.
+    Rows with unrecognised filenames get NaT.
+    """
+    # Files are numbered in the order they were combined so the row where
+    # each file starts is where the running maximum file_id increases.
+    file_ids = df["file_id"].to_numpy()
+    first_rows = np.flatnonzero(
+        np.diff(np.maximum.accumulate(file_ids), prepend=-1)
+    )
 
-    time_windows = []
-    file_lengths = last_rows - first_rows + 1
-    file_lengths[-1] += 1
-    for file_length in file_lengths:
-        time_windows.append(
-            np.arange(file_length) * datetime.timedelta(seconds=0.5)
-        )
+    # Half seconds since the start of the file for each row.
+    file_lengths = np.diff(np.append(first_rows, len(df)))
+    row_offsets = np.arange(len(df)) - np.repeat(first_rows, file_lengths)
 
-    # Flatten list.
-    time_deltas = np.array(
-        [val for sublist in time_windows for val in sublist]
-    )
+    # NaT start times stay NaT.
+    file_start_times = files_df["start_time"].to_numpy(dtype="datetime64[ns]")
+    df["timestamp"] = file_start_times[file_ids] + (
+        row_offsets * 500_000_000
+    ).astype("timedelta64[ns]")
 
-    df["timestamp"] = df["timestamp"] + time_deltas
     return df
 
 
-def remove_nans(df):
+def get_bad_rows(df):
     """
-    Removes any rows containing nan values and two rows either side of each of
-    these rows.
+    Returns masks of the rows with a nan or inf value and of the rows with
+    any other missing value (NaT timestamps from unrecognised filenames).
+    Columns are checked one at a time so no copy of the frame is made.
     """
-    m = df.isna().any(axis=1)
-    return df[
-        ~(
-            m
-            | m.shift(fill_value=False)
-            | m.shift(-1, fill_value=False)
-            | m.shift(-2, fill_value=False)
+    non_finite = np.zeros(len(df), dtype="bool")
+    missing = np.zeros(len(df), dtype="bool")
+    finite = np.empty(len(df), dtype="bool")
+    for column in df.columns:
+        values = df[column].values
+        if values.dtype.kind == "f":
+            np.isfinite(values, out=finite)
+            non_finite |= ~finite
+        else:
+            missing |= pd.isna(values)
+
+    return non_finite, missing
+
+
+def get_removed_rows(bad_rows, previous_bad_row=False, next_bad_rows=()):
+    """
+    Returns a mask of the bad rows, the row after each and the two rows
+    before each, as removed by clean_df. previous_bad_row and
+    next_bad_rows (up to two) are whether the rows either side of bad_rows
+    are bad, if bad_rows is part of a month.
+    """
+    next_bad_rows = np.asarray(next_bad_rows, dtype="bool")
+    padded = np.concatenate(
+        (
+            [previous_bad_row],
+            bad_rows,
+            next_bad_rows,
+            np.zeros(2 - len(next_bad_rows), dtype="bool"),
         )
-    ]
+    )
+    n = len(bad_rows)
+    return padded[1 : n + 1] | padded[:n] | padded[2 : n + 2] | padded[3:]
 
 
-def inf_to_nans(df):
-    return df.replace([np.inf, -np.inf], np.nan)
+def get_clean_counts(non_finite, missing, removed):
+    return {
+        "non_finite": int(non_finite.sum()),
+        "unrecognised_filename": int((missing & ~non_finite).sum()),
+        "guard_band": int((removed & ~(non_finite | missing)).sum()),
+        "retained": int(len(removed) - removed.sum()),
+    }
+
+
+def log_clean_counts(counts):
+    logging.info(
+        f"Removed {counts.get('non_finite', 0)} rows with nan or inf values,"
+        f" {counts.get('unrecognised_filename', 0)} with unrecognised"
+        f" filenames and {counts.get('guard_band', 0)} either side of them."
+        f" {counts.get('retained', 0)} rows retained."
+    )
+
+
+@instrumentation.instrumented
+def clean_df(df):
+    """
+    Removes rows with a nan or inf value or no timestamp, the row after each
+    and the two rows before each. Each column is scanned once and the rows
+    kept are taken in one go, rather than copying the frame to replace infs
+    and building shifted masks.
+    """
+    non_finite, missing = get_bad_rows(df)
+    removed = get_removed_rows(non_finite | missing)
+    log_clean_counts(get_clean_counts(non_finite, missing, removed))
+
+    return df.take(np.flatnonzero(~removed))
 
 
 def broadband_func(x):
     return 10 ** (x / 10)
 
 
+@instrumentation.instrumented
 def calc_broadband_spl(df, noramlise=False):
     """
     Calculates unnormalised broadband SPL by averaging over TOLs.
     """
 
-    unnormalised_broadband_spl = 10 * np.log10(
-        df.loc[:, "25":"25119"].applymap(broadband_func).sum(axis=1)
+    # A row-major copy so each row is summed in the same order however the
+    # frame is laid out in memory (and however many rows it has).
+    unnormalised_broadband_spl = pd.Series(
+        energy_sum_db(
+            np.ascontiguousarray(helpers.get_tols_df(df).to_numpy()),
+            overwrite=True,
+        ),
+        index=df.index,
+        dtype="float64",
     )
 
     if noramlise == False:
@@ -130,17 +188,21 @@ def calc_broadband_spl(df, noramlise=False):
     return df
 
 
-def calc_background_spl(df, background_window_mins=10):
+@instrumentation.instrumented
+def calc_background_spl(df, background_window_mins=10, state=None):
     """
     Calculate 'background' sound level using moving average of normalised
     background SPL.
+    state is the end of the previous month's broadband SPL (see
+    calc_background_spls), without it the first window of rows is dropped.
     """
 
-    # Background window is in half second intervals.
-    background_window = background_window_mins * 60 * 2
-    df["background_spl"] = (
-        df["broadband_spl"].rolling(background_window).mean()
+    background_spls, _ = calc_background_spls(
+        df["broadband_spl"],
+        windows_mins=(background_window_mins,),
+        state=state,
     )
+    df["background_spl"] = background_spls.iloc[:, 0].values
 
     # Start of data (duration of window) will be null so drop it.
     df = df.drop(df[pd.isnull(df["background_spl"])].index).reset_index(
@@ -150,17 +212,19 @@ def calc_background_spl(df, background_window_mins=10):
     return df
 
 
-def tag_loud_events(df):
+@instrumentation.instrumented
+def tag_loud_events(df, threshold_db=10):
     logging.info(
-        "Tagging loud events (where broadband SPL is 10 dB above"
+        f"Tagging loud events (where broadband SPL is {threshold_db} dB above"
         " background SPL)."
     )
 
-    df["loud"] = df["broadband_spl"] > (df["background_spl"] + 10)
+    df["loud"] = df["broadband_spl"] > (df["background_spl"] + threshold_db)
 
     return df
 
 
+@instrumentation.instrumented
 def tag_short_transients(df):
     """
     Tags loud events lasting less than 0.5 s as short transients.
@@ -168,8 +232,9 @@ def tag_short_transients(df):
 
     logging.info("Tagging short transients.")
 
-    df["trans_shft_down"] = np.concatenate((np.array([True]), df["loud"][:-1]))
-    df["trans_shft_up"] = np.concatenate((df["loud"][1:], np.array([True])))
+    # Shifted with pandas so an empty month stays empty.
+    df["trans_shft_down"] = df["loud"].shift(1, fill_value=True)
+    df["trans_shft_up"] = df["loud"].shift(-1, fill_value=True)
     df["short_transient"] = (
         df["loud"]
         & (df["trans_shft_down"] == False)
@@ -180,6 +245,7 @@ def tag_short_transients(df):
     return df
 
 
+@instrumentation.instrumented
 def tol_headers_to_ints(df):
     """
     Renames the TOL headers as integers so they are easier to type.
@@ -203,6 +269,20 @@ def tol_headers_to_ints(df):
     return df
 
 
+@instrumentation.instrumented
+def downcast_floats(df, exclude=()):
+    """
+    Downcasts float64 columns (except those in exclude) to float32 where no
+    values overflow.
+    """
+    for column in df.columns:
+        if df[column].dtype == "float64" and column not in exclude:
+            df[column] = pd.to_numeric(df[column], downcast="float")
+
+    return df
+
+
+@instrumentation.instrumented
 def select_exactly_one_month(df, month_name):
     month_number = int(month_name.split("_")[1])
     df = df[df["timestamp"].dt.month == month_number].reset_index(drop=True)
@@ -210,35 +290,25 @@ def select_exactly_one_month(df, month_name):
     return df
 
 
-def process_df(df):
+@instrumentation.instrumented
+def process_df(df, files_df):
     logging.info("Dropping PAMGuide false time column.")
     df = df.drop(columns=["1213"]).reset_index(drop=True)
 
     logging.info("Timestamping.")
-    df = get_timestamps(df)
+    df = get_timestamps(df, files_df)
 
     logging.info("Cleaning data.")
-    # Remove nan spl.
-    pre_clean_length = len(df)
-    df = remove_nans(inf_to_nans(df))
-    logging.info(
-        f"{len(df)/pre_clean_length*100:.2f}% of rows retained after clean."
-    )
+    df = clean_df(df)
 
-    logging.info("Sorting data by timestamps.")
-    df.sort_values("timestamp", inplace=True, ignore_index=True)
-
-    for column in df.columns:
-        if df[column].dtype == "float64":
-            df[column] = pd.to_numeric(df[column], downcast="float")
+    # Downcast before sorting so the sort copies half as much.
+    df = downcast_floats(df)
 
-    # Remove nan times.
-    pre_clean_length = len(df)
-    df = df.drop(df[pd.isnull(df["timestamp"])].index).reset_index(drop=True)
-    logging.info(
-        f"{len(df)/pre_clean_length*100:.2f}% of cleaned data retained after"
-        " removing unrecognised filenames."
-    )
+    logging.info("Sorting data by timestamps.")
+    with instrumentation.stage("sort_timestamps", rows_in=len(df)):
+        df.sort_values(
+            "timestamp", inplace=True, kind="stable", ignore_index=True
+        )
 
     logging.info("Renaming the TOL headers as integers.")
     df = tol_headers_to_ints(df)
@@ -248,63 +318,635 @@ def process_df(df):
     return df
 
 
-def process_monthly_data():
-    month_paths = helpers.get_month_paths(config.raw_csvs_path)
-    month_names = [
-        helpers.month_name_from_month_path(month_path)
-        for month_path in month_paths
-    ]
+def get_chunk_timestamps(df, files_df, state=None):
+    """
+    get_timestamps for a chunk of a month's rows. state carries the largest
+    file_id seen so far and the row where the current file started across
+    chunks, so the chunks get the same timestamps as the whole month would.
+    Returns the timestamped chunk and the state for the next chunk.
+    """
+    if state is None:
+        state = {"max_file_id": -1, "first_row": 0, "n_rows": 0}
 
-    overall_max_broadband_spl = 0
-    for month_name in month_names:
-        logging.info(f"=== Processing {month_name} ===")
-        raw_feather_path = os.path.join(
-            config.raw_feathers_path, month_name + ".feather"
+    # Rows where a file appears for the first time in the month.
+    file_ids = df["file_id"].to_numpy()
+    max_file_ids = np.maximum.accumulate(
+        np.append(state["max_file_id"], file_ids)
+    )
+    first_rows = np.flatnonzero(np.diff(max_file_ids))
+
+    # Half seconds since the start of the file for each row, the file may
+    # have started in an earlier chunk.
+    rows = np.arange(len(df))
+    file_first_rows = np.append(
+        state["first_row"] - state["n_rows"], first_rows
+    )
+    row_offsets = (
+        rows - file_first_rows[np.searchsorted(first_rows, rows, side="right")]
+    )
+
+    file_start_times = files_df["start_time"].to_numpy(dtype="datetime64[ns]")
+    df["timestamp"] = file_start_times[file_ids] + (
+        row_offsets * 500_000_000
+    ).astype("timedelta64[ns]")
+
+    new_state = {
+        "max_file_id": max_file_ids[-1],
+        "first_row": state["n_rows"] + file_first_rows[-1],
+        "n_rows": state["n_rows"] + len(df),
+    }
+    return df, new_state
+
+
+def iter_raw_chunks(raw_feather_path, chunk_rows):
+    """
+    Yields the rows of a raw month feather as DataFrames of chunk_rows rows
+    (the last may be shorter), without the PAMGuide false time column.
+    """
+    reader = pa.ipc.open_file(pa.memory_map(raw_feather_path))
+    table = reader.schema.empty_table()
+    for i in range(reader.num_record_batches):
+        table = pa.concat_tables(
+            [table, pa.Table.from_batches([reader.get_batch(i)])]
         )
+        while table.num_rows >= chunk_rows:
+            yield table.slice(0, chunk_rows).to_pandas().drop(columns=["1213"])
+            table = table.slice(chunk_rows)
+
+    if table.num_rows or reader.num_record_batches == 0:
+        yield table.to_pandas().drop(columns=["1213"])
+
+
+def iter_clean_chunks(chunks, files_df):
+    """
+    Yields timestamped chunks of a month (see get_chunk_timestamps) with the rows clean_df would remove
+    from the whole month removed. A bad row removes the row after it and the
+    two before it, so each chunk is held back until the first rows of the
+    next chunk are known. Chunks must have at least two rows, except the
+    last.
+    """
+    state = None
+    previous_bad_row = False
+    pending = None
+    counts = {}
+    for df in chunks:
+        df, state = get_chunk_timestamps(df, files_df, state)
+        non_finite, missing = get_bad_rows(df)
+
+        if pending is not None:
+            yield clean_chunk(*pending, (non_finite | missing)[:2], counts)
+            bad_rows = pending[1] | pending[2]
+            if len(bad_rows):
+                previous_bad_row = bad_rows[-1]
+        pending = (df, non_finite, missing, previous_bad_row)
+
+    if pending is not None:
+        yield clean_chunk(*pending, (), counts)
+    log_clean_counts(counts)
+
+
+def clean_chunk(
+    df, non_finite, missing, previous_bad_row, next_bad_rows, counts
+):
+    """
+    clean_df for a chunk of a month, given whether the row before the chunk
+    and the (up to) two rows after it are bad. Adds the rows removed by each
+    rule to counts.
+    """
+    removed = get_removed_rows(
+        non_finite | missing, previous_bad_row, next_bad_rows
+    )
+    for rule, n_rows in get_clean_counts(non_finite, missing, removed).items():
+        counts[rule] = counts.get(rule, 0) + n_rows
+
+    return df.take(np.flatnonzero(~removed))
+
+
+def spill_days(chunks, spill_path, float64_columns=()):
+    """
+    Downcasts, renames and calculates the broadband SPL of cleaned chunks
+    and appends their rows to one Arrow stream per day in spill_path.
+    Returns the days spilled, the schema of the spilled rows and the float
+    columns that could not be downcast without losing precision (these must
+    be kept as float64 in every chunk for the output to match process_df).
+    """
+    writers = {}
+    schema = None
+    empty_schema = None
+    failed_columns = set()
+    for df in chunks:
+        float_columns = df.columns[df.dtypes == "float64"]
+        df = downcast_floats(df, exclude=float64_columns)
+        failed_columns.update(
+            column
+            for column in float_columns
+            if df[column].dtype == "float64" and column not in float64_columns
+        )
+        if failed_columns:
+            break
+        df = tol_headers_to_ints(df)
+        df = calc_broadband_spl(df, noramlise=False)
+
+        if not len(df):
+            # Empty chunks can't be relied on for the types of the columns.
+            if schema is None:
+                empty_schema = pa.Schema.from_pandas(df, preserve_index=False)
+            continue
+        table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        schema = table.schema
+        days = df["timestamp"].values.astype("datetime64[D]")
+        for day in np.unique(days):
+            if day not in writers:
+                writers[day] = pa.ipc.new_stream(
+                    os.path.join(spill_path, f"{day}.arrow"), schema
+                )
+            writers[day].write_table(table.filter(days == day))
+
+    for writer in writers.values():
+        writer.close()
+
+    if schema is None:
+        schema = empty_schema
+
+    return sorted(writers), schema, failed_columns
+
+
+@instrumentation.instrumented
+def process_month_chunked(
+    raw_feather_path, interim_feather_path, month_name, chunk_rows
+):
+    """
+    Does the same as process_df and select_exactly_one_month on the raw
+    feather for month_name and saves the result to interim_feather_path,
+    without holding more than chunk_rows raw rows or a day of processed rows
+    in memory.
+    Cleaned chunks are spilled to one file per day, then each day is sorted
+    and appended to the interim feather.
+    Returns the maximum unnormalised broadband SPL of the month.
+    """
+    month_number = int(month_name.split("_")[1])
+    chunk_rows = max(chunk_rows, 2)
+
+    with tempfile.TemporaryDirectory(dir=config.interim_data_path) as path:
+        float64_columns = set()
+        while True:
+            days, schema, failed_columns = spill_days(
+                iter_clean_chunks(
+                    iter_raw_chunks(raw_feather_path, chunk_rows),
+                    helpers.read_file_table(raw_feather_path),
+                ),
+                path,
+                float64_columns,
+            )
+            if not failed_columns:
+                break
+            # process_df would keep these columns as float64 so start again.
+            logging.info(
+                f"Keeping {sorted(failed_columns)} as float64, reprocessing."
+            )
+            float64_columns |= failed_columns
+
+        max_broadband_spl = np.nan
+        options = pa.ipc.IpcWriteOptions(compression="lz4")
+        with pa.ipc.new_file(
+            interim_feather_path, schema, options=options
+        ) as writer:
+            for day in days:
+                with pa.OSFile(os.path.join(path, f"{day}.arrow")) as f:
+                    df = pa.ipc.open_stream(f).read_pandas()
+                df = df.sort_values(
+                    "timestamp", kind="stable", ignore_index=True
+                )
+                df = df[df["timestamp"].dt.month == month_number]
+
+                max_broadband_spl = np.fmax(
+                    max_broadband_spl, df["unnormalised_broadband_spl"].max()
+                )
+                writer.write_table(
+                    pa.Table.from_pandas(
+                        df, schema=schema, preserve_index=False
+                    )
+                )
+
+    return max_broadband_spl
+
+
+def get_chunk_rows(raw_feather_path, memory_budget_mb):
+    """
+    Returns the number of raw rows per chunk for process_month_chunked to fit
+    in about memory_budget_mb, allowing for the copies made while processing
+    a chunk.
+    """
+    schema = pa.ipc.open_file(raw_feather_path).schema
+    row_bytes = sum(
+        (
+            field.type.bit_width // 8
+            if pa.types.is_primitive(field.type)
+            # Raw rows are fixed width (the TOLs, the false time column and
+            # the int32 file_id), allow 64 bytes for any variable width column.
+            else 64
+        )
+        for field in schema
+    )
+    return memory_budget_mb * 2**20 // (8 * row_bytes)
+
+
+@instrumentation.instrumented
+def process_month_first_pass(month_name):
+    """
+    Processes the raw feather for month_name and saves the unnormalised
+    interim data.
+    Returns the maximum unnormalised broadband SPL of the month.
+    """
+    logging.info(f"=== Processing {month_name} ===")
+    raw_feather_path = os.path.join(
+        config.raw_feathers_path, month_name + ".feather"
+    )
+    interim_feather_path = helpers.feather_path_from_month_name(
+        config.interim_data_path, month_name
+    )
+
+    if config.process_memory_budget_mb is None:
         df = pd.read_feather(raw_feather_path)
-        df = process_df(df)
+        df = process_df(df, helpers.read_file_table(raw_feather_path))
         df = select_exactly_one_month(df, month_name)
-
         max_broadband_spl = df["unnormalised_broadband_spl"].max()
-        logging.info(
-            f"Max unnormalised broadband SPL in {month_name} is"
-            f" {max_broadband_spl:.2f}"
-        )
-        if max_broadband_spl > overall_max_broadband_spl:
-            overall_max_broadband_spl = max_broadband_spl
 
-        interim_feather_path = helpers.feather_path_from_month_name(
-            config.interim_data_path, month_name
-        )
         logging.info(f"Saving interim data to {interim_feather_path}.")
         df.to_feather(interim_feather_path)
-
-    for month_name in month_names:
-        interim_feather_path = helpers.feather_path_from_month_name(
-            config.interim_data_path, month_name
+    else:
+        chunk_rows = get_chunk_rows(
+            raw_feather_path, config.process_memory_budget_mb
+        )
+        logging.info(
+            f"Processing in chunks of {chunk_rows} rows, saving interim data"
+            f" to {interim_feather_path}."
+        )
+        max_broadband_spl = process_month_chunked(
+            raw_feather_path, interim_feather_path, month_name, chunk_rows
         )
-        df = pd.read_feather(interim_feather_path)
 
+    logging.info(
+        f"Max unnormalised broadband SPL in {month_name} is"
+        f" {max_broadband_spl:.2f}"
+    )
+
+    return max_broadband_spl
+
+
+@instrumentation.instrumented
+def get_background_state(month_name, overall_max_broadband_spl):
+    """
+    Returns the normalised broadband SPL of the last background window of
+    month_name, used to warm-start the background SPL of the next month.
+    """
+    interim_feather_path = helpers.feather_path_from_month_name(
+        config.interim_data_path, month_name
+    )
+    unnormalised_broadband_spl = pd.read_feather(
+        interim_feather_path, columns=["unnormalised_broadband_spl"]
+    )["unnormalised_broadband_spl"]
+    windows_mins = (config.background_window_mins,) + tuple(
+        config.extra_background_windows_mins
+    )
+    max_window = max(windows_mins) * 60 * 2
+
+    return (
+        unnormalised_broadband_spl.iloc[-(max_window - 1) :]
+        - overall_max_broadband_spl
+    ).reset_index(drop=True)
+
+
+@instrumentation.instrumented
+def process_month_second_pass(
+    month_name, overall_max_broadband_spl, previous_month_name=None
+):
+    """
+    Normalises the interim data for month_name against the maximum over all
+    months, tags loud events and saves the processed data.
+    If previous_month_name is given the background SPL windows are
+    warm-started from the end of that month instead of dropping the first
+    window of rows.
+    """
+    interim_feather_path = helpers.feather_path_from_month_name(
+        config.interim_data_path, month_name
+    )
+    df = pd.read_feather(interim_feather_path)
+
+    logging.info(
+        "Normalising broadband SPL over all months. Max SPL:"
+        f" {overall_max_broadband_spl:.2f}."
+    )
+    df["broadband_spl"] = (
+        df["unnormalised_broadband_spl"] - overall_max_broadband_spl
+    )
+
+    state = None
+    if previous_month_name is not None:
         logging.info(
-            "Normalising broadband SPL over all months. Max SPL:"
-            f" {overall_max_broadband_spl:.2f}."
+            f"Warm-starting background SPL from {previous_month_name}."
         )
-        df["broadband_spl"] = (
-            df["unnormalised_broadband_spl"] - overall_max_broadband_spl
+        state = get_background_state(
+            previous_month_name, overall_max_broadband_spl
+        )
+
+    if config.extra_background_windows_mins:
+        # Additional background estimates, kept so that the background window
+        # can be retuned without reprocessing.
+        background_spls, _ = calc_background_spls(
+            df["broadband_spl"],
+            windows_mins=config.extra_background_windows_mins,
+            statistics=config.extra_background_statistics,
+            quantile=config.background_quantile,
+            state=state,
         )
+        df = pd.concat([df, background_spls], axis=1)
+
+    df = calc_background_spl(
+        df, background_window_mins=config.background_window_mins, state=state
+    )
+    df = tag_loud_events(df, threshold_db=config.loud_threshold_db)
+    df = tag_short_transients(df)
+
+    processed_feather_path = helpers.feather_path_from_month_name(
+        config.processed_data_path, month_name
+    )
+
+    with instrumentation.stage("write_processed", rows_in=len(df)):
+        helpers.write_processed_month(df, processed_feather_path)
 
-        df = calc_background_spl(df)
-        df = tag_loud_events(df)
-        df = tag_short_transients(df)
+        if config.write_processed_dataset:
+            write_processed_dataset(df)
 
-        processed_feather_path = helpers.feather_path_from_month_name(
-            config.processed_data_path, month_name
+        if config.write_spl_pyramid:
+            spl_pyramid.write_spl_pyramid(df, month_name)
+
+
+@instrumentation.instrumented
+def renormalise_processed_month(
+    month_name, old_overall_max_broadband_spl, overall_max_broadband_spl
+):
+    """
+    Renormalises an already processed month from the maximum broadband SPL
+    over all months it was processed with to a new one. The background SPLs
+    are means of the normalised SPL so they shift by the difference of the
+    maxima and loud tags are unchanged, so there is no need to process the
+    month again. The offset is one number rather than taken row by row from
+    the stored SPLs, so centi-dB rounding of the stored levels doesn't creep
+    into the backgrounds.
+    """
+    processed_feather_path = helpers.feather_path_from_month_name(
+        config.processed_data_path, month_name
+    )
+    df = helpers.read_processed_month(processed_feather_path)
+
+    logging.info(
+        f"Renormalising {month_name} to max SPL"
+        f" {overall_max_broadband_spl:.2f}."
+    )
+    offset = np.float32(
+        old_overall_max_broadband_spl - overall_max_broadband_spl
+    )
+    df["broadband_spl"] = (
+        df["unnormalised_broadband_spl"] - overall_max_broadband_spl
+    )
+    for column in df.columns:
+        if column.startswith("background_"):
+            df[column] = df[column] + offset
+
+    with instrumentation.stage("write_processed", rows_in=len(df)):
+        helpers.write_processed_month(df, processed_feather_path)
+
+        if config.write_processed_dataset:
+            write_processed_dataset(df)
+
+        if config.write_spl_pyramid:
+            spl_pyramid.write_spl_pyramid(df, month_name)
+
+
+def map_months(function, months_args, n_workers=1):
+    """
+    Returns function(*args) for each args in months_args, calling them in a
+    process pool if n_workers > 1.
+    """
+    if n_workers > 1 and len(months_args) > 1:
+        with multiprocessing.Pool(min(n_workers, len(months_args))) as pool:
+            return pool.starmap(function, months_args, chunksize=1)
+
+    return [function(*args) for args in months_args]
+
+
+def get_first_pass_record(build_manifest, month_name):
+    raw_feather_path = os.path.join(
+        config.raw_feathers_path, month_name + ".feather"
+    )
+    return manifest.make_record(
+        inputs={
+            "raw_feather": manifest.get_file_hash(
+                build_manifest, raw_feather_path
+            ),
+            "file_table": manifest.get_file_hash(
+                build_manifest, helpers.get_file_table_path(raw_feather_path)
+            ),
+        },
+        params={},
+        code_version=manifest.get_code_version(__file__, energy_sum.__file__),
+    )
+
+
+def get_second_pass_record(build_manifest, month_name, previous_month_name):
+    inputs = {
+        "interim": manifest.get_digest(
+            manifest.get_stored_record(
+                build_manifest, "first_pass", month_name
+            )
+        )
+    }
+    if previous_month_name is not None:
+        inputs["previous_interim"] = manifest.get_digest(
+            manifest.get_stored_record(
+                build_manifest, "first_pass", previous_month_name
+            )
         )
 
-        df.to_feather(processed_feather_path)
+    return manifest.make_record(
+        inputs=inputs,
+        params={
+            "background_window_mins": config.background_window_mins,
+            "extra_background_windows_mins": list(
+                config.extra_background_windows_mins
+            ),
+            "extra_background_statistics": list(
+                config.extra_background_statistics
+            ),
+            "background_quantile": config.background_quantile,
+            "loud_threshold_db": config.loud_threshold_db,
+            "write_processed_dataset": config.write_processed_dataset,
+            "centi_db_levels": config.centi_db_levels,
+            "write_spl_pyramid": config.write_spl_pyramid,
+        },
+        code_version=manifest.get_code_version(
+            __file__, background_spl.__file__, spl_pyramid.__file__
+        ),
+    )
+
+
+@instrumentation.instrumented
+def process_monthly_data(n_workers=1, warm_start=False, incremental=False):
+    """
+    Processes every month in two passes. The first pass processes each month
+    and finds its maximum broadband SPL, the second normalises each month by
+    the maximum over all months.
+    With n_workers > 1 the months of each pass are processed in a process
+    pool, only the monthly maxima are sent back between the passes.
+    With warm_start the background SPL of each month is warm-started from the
+    end of the previous month so only the first month loses its first
+    background window of rows.
+    If incremental, months whose inputs, parameters and code are unchanged
+    since they were last processed (according to the build manifest) are
+    skipped, and if only the maximum over all months has changed they are
+    just renormalised.
+    """
+    # Months of the combined raw data, which can include a month after the
+    # last CSV folder if its last file runs into it.
+    month_names = helpers.get_month_names(config.raw_feathers_path)
+    if warm_start:
+        previous_month_names = [None] + month_names[:-1]
+    else:
+        previous_month_names = [None] * len(month_names)
+
+    if n_workers > 1:
+        logging.info(f"Processing months with {n_workers} workers.")
+
+    # First pass.
+    first_pass_month_names = month_names
+    if incremental:
+        build_manifest = manifest.load_manifest()
+        first_pass_records = {
+            month_name: get_first_pass_record(build_manifest, month_name)
+            for month_name in month_names
+        }
+        first_pass_month_names = [
+            month_name
+            for month_name in month_names
+            if not manifest.is_up_to_date(
+                build_manifest,
+                "first_pass",
+                month_name,
+                first_pass_records[month_name],
+                [
+                    helpers.feather_path_from_month_name(
+                        config.interim_data_path, month_name
+                    )
+                ],
+            )
+        ]
+
+    max_broadband_spls = map_months(
+        process_month_first_pass,
+        [(month_name,) for month_name in first_pass_month_names],
+        n_workers,
+    )
+
+    if incremental:
+        for month_name, max_broadband_spl in zip(
+            first_pass_month_names, max_broadband_spls
+        ):
+            record = first_pass_records[month_name]
+            record["max_broadband_spl"] = float(max_broadband_spl)
+            manifest.update_record(
+                build_manifest, "first_pass", month_name, record
+            )
+        manifest.save_manifest(build_manifest)
+
+        max_broadband_spls = [
+            manifest.get_stored_record(
+                build_manifest, "first_pass", month_name
+            )["max_broadband_spl"]
+            for month_name in month_names
+        ]
+
+    overall_max_broadband_spl = 0
+    for max_broadband_spl in max_broadband_spls:
+        if max_broadband_spl > overall_max_broadband_spl:
+            overall_max_broadband_spl = max_broadband_spl
+
+    # Second pass.
+    second_pass_args = [
+        (month_name, overall_max_broadband_spl, previous_month_name)
+        for month_name, previous_month_name in zip(
+            month_names, previous_month_names
+        )
+    ]
+    renormalise_args = []
+    if incremental:
+        second_pass_records = {}
+        months_args = second_pass_args
+        second_pass_args = []
+        for month_name, _, previous_month_name in months_args:
+            record = get_second_pass_record(
+                build_manifest, month_name, previous_month_name
+            )
+            record["overall_max_broadband_spl"] = float(
+                overall_max_broadband_spl
+            )
+            second_pass_records[month_name] = record
+            stored_record = manifest.get_stored_record(
+                build_manifest, "second_pass", month_name
+            )
+            output_paths = [
+                helpers.feather_path_from_month_name(
+                    config.processed_data_path, month_name
+                )
+            ]
+            if config.write_spl_pyramid:
+                output_paths += [
+                    spl_pyramid.get_level_path(level, month_name)
+                    for level in spl_pyramid.levels
+                ]
+
+            if not manifest.is_up_to_date(
+                build_manifest,
+                "second_pass",
+                month_name,
+                record,
+                output_paths,
+            ):
+                second_pass_args.append(
+                    (
+                        month_name,
+                        overall_max_broadband_spl,
+                        previous_month_name,
+                    )
+                )
+            elif (
+                stored_record["overall_max_broadband_spl"]
+                != record["overall_max_broadband_spl"]
+            ):
+                renormalise_args.append(
+                    (
+                        month_name,
+                        stored_record["overall_max_broadband_spl"],
+                        overall_max_broadband_spl,
+                    )
+                )
+
+    map_months(process_month_second_pass, second_pass_args, n_workers)
+    map_months(renormalise_processed_month, renormalise_args, n_workers)
+
+    if incremental:
+        for month_name, record in second_pass_records.items():
+            manifest.update_record(
+                build_manifest, "second_pass", month_name, record
+            )
+        manifest.save_manifest(build_manifest)
 
 
 if __name__ == "__main__":
 
     logging.info("Making final dataset from raw feather files.")
-    process_monthly_data()
+    process_monthly_data(
+        n_workers=config.n_workers,
+        warm_start=config.warm_start_background,
+        incremental=config.incremental_builds,
+    )
@@ -0,0 +1,53 @@
+import logging
+import os
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from acoustic_data_science import config, helpers
+
+
+def write_processed_dataset(df, dataset_path=None):
+    """
+    Writes processed data to the Parquet dataset at dataset_path, partitioned
+    into year=YYYY/month=M/day=D folders. Rows are sorted by timestamp so the
+    row group statistics on timestamp, broadband_spl and loud let readers skip
+    row groups (see helpers.query_processed_data).
+    Days already in the dataset are replaced.
+    """
+    if dataset_path is None:
+        dataset_path = config.processed_dataset_path
+
+    df = df.sort_values("timestamp", ignore_index=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(
+        "year", pa.array(df["timestamp"].dt.year.values, pa.int16())
+    )
+    table = table.append_column(
+        "month", pa.array(df["timestamp"].dt.month.values, pa.int8())
+    )
+    table = table.append_column(
+        "day", pa.array(df["timestamp"].dt.day.values, pa.int8())
+    )
+
+    logging.info(f"Writing processed data to dataset at {dataset_path}.")
+    ds.write_dataset(
+        table,
+        dataset_path,
+        format="parquet",
+        partitioning=helpers.processed_dataset_partitioning,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+        min_rows_per_group=config.dataset_row_group_rows,
+        max_rows_per_group=config.dataset_row_group_rows,
+        file_options=ds.ParquetFileFormat().make_write_options(
+            compression="zstd", write_statistics=True
+        ),
+    )
+
+
+if __name__ == "__main__":
+    # Convert processed monthly feather files that have already been made.
+    for feather_path in helpers.get_feather_paths(
+        os.path.join(config.processed_data_path, "monthly_data")
+    ):
+        write_processed_dataset(helpers.read_processed_month(feather_path))
@@ -0,0 +1,176 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from acoustic_data_science import config, helpers, instrumentation
+
+# Bin width of each level of the pyramid in seconds, finest first.
+levels = {
+    "1min": 60,
+    "10min": 10 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+spl_columns = ("broadband_spl", "background_spl")
+
+
+def get_level_path(level, month_name, pyramid_path=None):
+    if pyramid_path is None:
+        pyramid_path = config.spl_pyramid_path
+
+    return os.path.join(pyramid_path, level, month_name + ".feather")
+
+
+def get_coarsest_level(resolution_seconds):
+    """
+    Returns the coarsest level with bins no wider than resolution_seconds.
+    """
+    suitable_levels = [
+        level
+        for level, bin_seconds in levels.items()
+        if bin_seconds <= resolution_seconds
+    ]
+    if not suitable_levels:
+        raise ValueError(
+            f"No SPL pyramid level has a resolution of {resolution_seconds} s."
+        )
+
+    return suitable_levels[-1]
+
+
+def aggregate_bins(timestamps, partials, bin_seconds):
+    """
+    Aggregates time sorted rows (or bins of a finer level) into bins of
+    bin_seconds. partials is a dict of 'count' and, for each SPL column,
+    '{column}_sum', '{column}_min', '{column}_max' and '{column}_energy_sum'
+    (the sum of 10**(SPL/10)) arrays, which are summed, minimised or
+    maximised over each bin.
+    Returns the bin start times and the partials of each bin.
+    """
+    bin_ns = bin_seconds * 10**9
+    bins = timestamps.astype("int64") // bin_ns
+    starts = np.flatnonzero(np.diff(bins, prepend=bins[:1] - 1))
+
+    bin_partials = {}
+    for name, values in partials.items():
+        if name.endswith("_min"):
+            bin_partials[name] = np.minimum.reduceat(values, starts)
+        elif name.endswith("_max"):
+            bin_partials[name] = np.maximum.reduceat(values, starts)
+        else:
+            bin_partials[name] = np.add.reduceat(values, starts)
+
+    return (bins[starts] * bin_ns).astype("datetime64[ns]"), bin_partials
+
+
+def partials_to_df(timestamps, partials):
+    """
+    Returns a level as a DataFrame of the bin start time, the number of rows
+    and the min, mean, max and energy mean (10*log10(mean(10**(SPL/10))))
+    of each SPL column in each bin.
+    """
+    df = pd.DataFrame({"timestamp": timestamps, "count": partials["count"]})
+    for column in spl_columns:
+        df[f"{column}_min"] = partials[f"{column}_min"]
+        df[f"{column}_mean"] = partials[f"{column}_sum"] / partials["count"]
+        df[f"{column}_max"] = partials[f"{column}_max"]
+        df[f"{column}_energy_mean"] = 10 * np.log10(
+            partials[f"{column}_energy_sum"] / partials["count"]
+        )
+
+    return df
+
+
+@instrumentation.instrumented
+def calc_spl_pyramid(df):
+    """
+    Returns a dict of level name to DataFrame of the broadband and
+    background SPL of time sorted processed data aggregated into the bins of
+    that level (see partials_to_df). Each level is aggregated from the one
+    below, so the rows are only read once.
+    """
+    timestamps = df["timestamp"].values
+    partials = {"count": np.ones(len(df), dtype="int64")}
+    for column in spl_columns:
+        values = df[column].to_numpy(dtype="float64")
+        partials[f"{column}_sum"] = values
+        partials[f"{column}_min"] = values
+        partials[f"{column}_max"] = values
+        partials[f"{column}_energy_sum"] = 10 ** (values / 10)
+
+    pyramid = {}
+    for level, bin_seconds in levels.items():
+        if len(timestamps):
+            timestamps, partials = aggregate_bins(
+                timestamps, partials, bin_seconds
+            )
+        pyramid[level] = partials_to_df(timestamps, partials)
+
+    return pyramid
+
+
+def write_spl_pyramid(df, month_name, pyramid_path=None):
+    """
+    Saves the SPL pyramid of a processed month, one small feather per level.
+    Days never span months so the levels of each month are independent.
+    """
+    for level, level_df in calc_spl_pyramid(df).items():
+        level_path = get_level_path(level, month_name, pyramid_path)
+        os.makedirs(os.path.dirname(level_path), exist_ok=True)
+        level_df.to_feather(level_path)
+
+
+def read_spl_pyramid(level, columns=None, pyramid_path=None):
+    """
+    Returns one level of the SPL pyramid over all months in time order.
+    """
+    if pyramid_path is None:
+        pyramid_path = config.spl_pyramid_path
+
+    level_paths = helpers.get_feather_paths(os.path.join(pyramid_path, level))
+    if not level_paths:
+        raise FileNotFoundError(
+            f"No SPL pyramid at {pyramid_path}, run make pyramid first."
+        )
+
+    return pd.concat(
+        [
+            pd.read_feather(level_path, columns=columns)
+            for level_path in level_paths
+        ],
+        ignore_index=True,
+    )
+
+
+def is_up_to_date(month_name, feather_path, pyramid_path=None):
+    """
+    Returns whether every level of the pyramid of a month is newer than its
+    processed feather.
+    """
+    return all(
+        os.path.exists(level_path)
+        and os.path.getmtime(level_path) >= os.path.getmtime(feather_path)
+        for level_path in (
+            get_level_path(level, month_name, pyramid_path) for level in levels
+        )
+    )
+
+
+if __name__ == "__main__":
+    # Build the pyramid of processed months that have already been made,
+    # skipping months whose pyramid is up to date.
+    for feather_path in helpers.get_feather_paths(
+        os.path.join(config.processed_data_path, "monthly_data")
+    ):
+        month_name = os.path.basename(feather_path).split(".")[0]
+        if is_up_to_date(month_name, feather_path):
+            continue
+
+        logging.info(f"Building SPL pyramid of {month_name}.")
+        write_spl_pyramid(
+            helpers.read_processed_month(
+                feather_path, columns=["timestamp", *spl_columns]
+            ),
+            month_name,
+        )
@@ -0,0 +1,69 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from acoustic_data_science import config
+from acoustic_data_science.benchmarks import synthetic_data
+
+
+@pytest.fixture(autouse=True)
+def no_instrumentation(monkeypatch):
+    """Keeps the tests out of the run report."""
+    monkeypatch.setattr(config, "instrument", False)
+
+
+def make_raw_month(
+    n_files=6, rows_per_file=1200, seed=0, shuffle=True, **tols_kwargs
+):
+    """
+    Returns synthetic raw rows of n_files CSVs as combined by combine_csvs
+    (the false time column, TOLs with their CSV headers and file_id) and
+    their file table. The files are in a random order, like glob's.
+    """
+    rng = np.random.default_rng(seed)
+    tols = synthetic_data.make_synthetic_tols(
+        n_files * rows_per_file, rng, **tols_kwargs
+    )
+    start_times = [
+        datetime.datetime(2018, 9, 30, 20)
+        + datetime.timedelta(
+            seconds=rows_per_file / 2 * i,
+            milliseconds=int(rng.integers(0, 10)),
+        )
+        for i in range(n_files)
+    ]
+    order = rng.permutation(n_files) if shuffle else np.arange(n_files)
+
+    dfs = []
+    for file_id, i in enumerate(order):
+        df = pd.DataFrame(
+            np.column_stack(
+                (
+                    np.arange(rows_per_file) * 0.5,
+                    tols[i * rows_per_file : (i + 1) * rows_per_file],
+                )
+            ),
+            columns=synthetic_data.csv_columns,
+        )
+        dfs.append(df.assign(file_id=np.int32(file_id)))
+
+    files_df = pd.DataFrame(
+        {
+            "file_id": np.arange(n_files, dtype="int32"),
+            "filename": [
+                synthetic_data.make_csv_name(start_times[i]) for i in order
+            ],
+            "start_time": pd.to_datetime(
+                [start_times[i] for i in order]
+            ).values.astype("datetime64[ns]"),
+            "n_rows": np.full(n_files, rows_per_file, dtype="int64"),
+        }
+    )
+    return pd.concat(dfs, ignore_index=True), files_df
+
+
+@pytest.fixture
+def raw_month():
+    return make_raw_month()
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from acoustic_data_science import config, helpers
+
+
+def test_round_trip_error_is_at_most_half_a_centi_db():
+    rng = np.random.default_rng(0)
+    levels = rng.uniform(-327.66, 327.66, 10**5)
+
+    decoded = helpers.decode_centi_db(helpers.encode_centi_db(levels))
+
+    assert decoded.dtype == np.float32
+    # Plus the float32 rounding of the decoded levels.
+    assert np.max(np.abs(decoded - levels)) <= 0.005 + 2e-5
+
+
+def test_nan_and_inf_survive():
+    levels = np.array([np.nan, np.inf, -np.inf, 0, -327.66, 327.66])
+
+    encoded = helpers.encode_centi_db(levels)
+    decoded = helpers.decode_centi_db(encoded)
+
+    np.testing.assert_array_equal(
+        encoded[:3],
+        [helpers.centi_db_nan, helpers.centi_db_inf, helpers.centi_db_neg_inf],
+    )
+    np.testing.assert_array_equal(decoded, levels.astype("float32"))
+
+
+@pytest.mark.parametrize("level", [327.67, -327.67, 1e6])
+def test_out_of_range_levels_are_rejected(level):
+    with pytest.raises(ValueError):
+        helpers.encode_centi_db([0, level])
+
+
+def test_get_tols_df_decodes_lazily(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "centi_db_levels", True)
+    rng = np.random.default_rng(0)
+    n_rows = 1000
+    df = pd.DataFrame(
+        {
+            "timestamp": pd.date_range(
+                "2018-09-01", periods=n_rows, freq="500ms"
+            ),
+            "25": rng.normal(90, 10, n_rows).astype("float32"),
+            "1000": rng.normal(80, 10, n_rows).astype("float32"),
+            "25119": rng.normal(70, 10, n_rows).astype("float32"),
+            "broadband_spl": rng.normal(0, 5, n_rows).astype("float32"),
+            "loud": rng.random(n_rows) < 0.1,
+        }
+    )
+    df.loc[3, "1000"] = np.nan
+    feather_path = str(tmp_path / "2018_09.feather")
+    helpers.write_processed_month(df, feather_path)
+
+    encoded_df = helpers.read_processed_month(feather_path, decode=False)
+
+    assert sorted(encoded_df.attrs["centi_db_columns"]) == sorted(
+        ["25", "1000", "25119", "broadband_spl"]
+    )
+    for column in ["25", "1000", "25119", "broadband_spl"]:
+        assert encoded_df[column].dtype == np.int16
+
+    tols_df = helpers.get_tols_df(encoded_df)
+
+    assert list(tols_df.columns) == ["25", "1000", "25119"]
+    assert (tols_df.dtypes == np.float32).all()
+    np.testing.assert_allclose(
+        tols_df, df[["25", "1000", "25119"]], rtol=0, atol=0.005 + 1e-4
+    )
+    assert np.isnan(tols_df.loc[3, "1000"])
+    # Only the TOLs are decoded.
+    assert encoded_df["broadband_spl"].dtype == np.int16
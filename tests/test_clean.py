@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from acoustic_data_science.processing import process_data
+
+from tests.conftest import make_raw_month
+
+
+def shift_remove_nans(df):
+    """
+    clean_df before it scanned each column once, remove_nans(inf_to_nans(df)).
+    """
+    df = df.replace([np.inf, -np.inf], np.nan)
+    m = df.isna().any(axis=1)
+    return df[
+        ~(
+            m
+            | m.shift(fill_value=False)
+            | m.shift(-1, fill_value=False)
+            | m.shift(-2, fill_value=False)
+        )
+    ]
+
+
+@pytest.fixture
+def dirty_month():
+    df, files_df = make_raw_month(
+        rows_per_file=200, nan_rate=1e-3, inf_rate=1e-3, seed=2
+    )
+    # An unrecognised filename, so its rows have no timestamp.
+    files_df.loc[3, "start_time"] = pd.NaT
+    df = df.drop(columns=["1213"])
+    return process_data.get_timestamps(df, files_df), files_df
+
+
+def test_clean_df_matches_shifted_masks(dirty_month):
+    df, _ = dirty_month
+    expected = shift_remove_nans(df)
+
+    cleaned = process_data.clean_df(df)
+
+    assert df["timestamp"].isna().any()
+    pd.testing.assert_frame_equal(cleaned, df.loc[expected.index])
+
+
+@pytest.mark.parametrize("chunk_rows", [2, 3, 250, 10**5])
+def test_iter_clean_chunks_matches_shifted_masks(dirty_month, chunk_rows):
+    df, files_df = dirty_month
+    expected = shift_remove_nans(df)
+
+    cleaned = pd.concat(
+        process_data.iter_clean_chunks(
+            (
+                df.iloc[start : start + chunk_rows].drop(columns="timestamp")
+                for start in range(0, len(df), chunk_rows)
+            ),
+            files_df,
+        )
+    )
+
+    pd.testing.assert_frame_equal(cleaned, df.loc[expected.index])
@@ -0,0 +1,195 @@
+import datetime
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from acoustic_data_science import config, helpers
+from acoustic_data_science.benchmarks import synthetic_data
+from acoustic_data_science.processing import combine_csvs, process_data
+
+
+@pytest.fixture(scope="module")
+def csvs_path(tmp_path_factory):
+    """
+    An hour of CSVs at the start of September and of October, a CSV that
+    straddles the end of September, one that straddles the end of October
+    into a month with no folder and one whose filename isn't recognised.
+    """
+    csvs_path = str(tmp_path_factory.mktemp("csvs"))
+    month_paths = [
+        synthetic_data.make_synthetic_month(
+            csvs_path, 2018, month, n_days=1 / 24, seed=month
+        )
+        for month in (9, 10)
+    ]
+    csv_path = os.path.join(
+        month_paths[0], sorted(os.listdir(month_paths[0]))[0]
+    )
+    for month_path, start_time in zip(
+        month_paths,
+        [
+            datetime.datetime(2018, 9, 30, 23, 58, 2),
+            datetime.datetime(2018, 10, 31, 23, 59),
+        ],
+    ):
+        shutil.copy(
+            csv_path,
+            os.path.join(month_path, synthetic_data.make_csv_name(start_time)),
+        )
+    shutil.copy(csv_path, os.path.join(month_paths[0], "unrecognised.csv"))
+    return csvs_path
+
+
+def get_month_name(timestamps, folder_month_name):
+    month_names = timestamps.dt.strftime("%Y_%m")
+    return month_names.where(timestamps.notna(), folder_month_name)
+
+
+def sort_rows(df):
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+@pytest.mark.parametrize("batch_rows", [1000, 10**6])
+def test_shard_csvs_to_months_matches_combine_csvs(
+    tmp_path, csvs_path, batch_rows
+):
+    month_paths = sorted(
+        os.path.join(csvs_path, month_name)
+        for month_name in os.listdir(csvs_path)
+    )
+    feathers_path = str(tmp_path / "raw_feathers")
+
+    n_rows, _ = combine_csvs.shard_csvs_to_months(
+        month_paths, feathers_path, n_workers=1, batch_rows=batch_rows
+    )
+
+    # Every row of every CSV, each in the month of its timestamp.
+    expected_dfs = []
+    for month_path in month_paths:
+        df, files_df = combine_csvs.combine_csvs(month_path)
+        df = process_data.get_timestamps(df, files_df)
+        expected_dfs.append(
+            df.drop(columns="file_id").assign(
+                month=get_month_name(
+                    df["timestamp"],
+                    helpers.month_name_from_month_path(month_path),
+                )
+            )
+        )
+    expected_df = pd.concat(expected_dfs, ignore_index=True)
+
+    assert n_rows == expected_df["month"].value_counts().to_dict()
+    assert sorted(n_rows) == ["2018_09", "2018_10", "2018_11"]
+    for month_name, month_df in expected_df.groupby("month"):
+        feather_path = os.path.join(feathers_path, month_name + ".feather")
+        files_df = helpers.read_file_table(feather_path)
+        df = pd.read_feather(feather_path)
+        assert files_df["n_rows"].sum() == len(df) == n_rows[month_name]
+
+        df = process_data.get_timestamps(df, files_df)
+        assert (
+            get_month_name(df["timestamp"], month_name) == month_name
+        ).all()
+        pd.testing.assert_frame_equal(
+            sort_rows(df.drop(columns="file_id")),
+            sort_rows(month_df.drop(columns="month")),
+        )
+
+        # A straddling file starts at its first row in the month.
+        starts = pd.to_datetime(
+            files_df["filename"].map(process_data.get_timestamp)
+        ) + pd.to_timedelta(files_df["first_row"] * 0.5, unit="s")
+        pd.testing.assert_series_equal(
+            files_df["start_time"], starts, check_names=False
+        )
+        straddling = files_df[files_df["first_row"] > 0]
+        assert len(straddling) == (month_name != "2018_09")
+        assert (
+            get_month_name(
+                straddling["start_time"] - pd.Timedelta(seconds=0.5), ""
+            )
+            < month_name
+        ).all()
+
+        # The per-file batches are written in batches of batch_rows rows.
+        reader = pa.ipc.open_file(feather_path)
+        batch_sizes = [
+            reader.get_batch(i).num_rows
+            for i in range(reader.num_record_batches)
+        ]
+        assert min(batch_sizes[:-1], default=batch_rows) >= batch_rows
+
+    assert sorted(os.listdir(feathers_path)) == [
+        "2018_09.feather",
+        "2018_10.feather",
+        "2018_11.feather",
+        "files",
+    ]
+
+
+def test_incremental_combine_rewrites_only_the_changed_months(
+    tmp_path, monkeypatch, csvs_path
+):
+    raw_csvs_path = str(tmp_path / "csvs")
+    shutil.copytree(csvs_path, raw_csvs_path)
+    monkeypatch.setattr(config, "raw_csvs_path", raw_csvs_path)
+    monkeypatch.setattr(
+        config, "raw_feathers_path", str(tmp_path / "raw_feathers")
+    )
+    monkeypatch.setattr(config, "manifest_path", str(tmp_path / "m.json"))
+    combine_csvs.combine_monthly_csvs(n_workers=1, incremental=True)
+    feather_paths = {
+        month_name: os.path.join(
+            config.raw_feathers_path, month_name + ".feather"
+        )
+        for month_name in ["2018_09", "2018_10", "2018_11"]
+    }
+    for feather_path in feather_paths.values():
+        for path in (feather_path, helpers.get_file_table_path(feather_path)):
+            os.utime(path, (2**31, 2**31))
+
+    # A CSV added to October. October and November, which its rows could
+    # reach, are written again, October with the rows of the CSV straddling
+    # the end of September, and September isn't.
+    october_path = os.path.join(raw_csvs_path, "2018_10")
+    shutil.copy(
+        os.path.join(october_path, sorted(os.listdir(october_path))[0]),
+        os.path.join(
+            october_path,
+            synthetic_data.make_csv_name(datetime.datetime(2018, 10, 15)),
+        ),
+    )
+    combine_csvs.combine_monthly_csvs(n_workers=1, incremental=True)
+
+    for month_name, feather_path in feather_paths.items():
+        rewritten = os.path.getmtime(feather_path) != 2**31
+        assert rewritten == (month_name != "2018_09")
+        assert rewritten == (
+            os.path.getmtime(helpers.get_file_table_path(feather_path))
+            != 2**31
+        )
+
+    # The months are the same as if every month was combined again.
+    feathers_path = str(tmp_path / "all_raw_feathers")
+    combine_csvs.shard_csvs_to_months(
+        helpers.get_month_paths(raw_csvs_path), feathers_path, n_workers=1
+    )
+    for month_name, feather_path in feather_paths.items():
+        expected_path = os.path.join(feathers_path, month_name + ".feather")
+        pd.testing.assert_frame_equal(
+            pd.read_feather(feather_path), pd.read_feather(expected_path)
+        )
+        pd.testing.assert_frame_equal(
+            helpers.read_file_table(feather_path),
+            helpers.read_file_table(expected_path),
+        )
+
+    # Nothing is written again when nothing changed.
+    for feather_path in feather_paths.values():
+        os.utime(feather_path, (2**31, 2**31))
+    combine_csvs.combine_monthly_csvs(n_workers=1, incremental=True)
+    for feather_path in feather_paths.values():
+        assert os.path.getmtime(feather_path) == 2**31
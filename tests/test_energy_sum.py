@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from acoustic_data_science.processing import process_data
+from acoustic_data_science.processing.energy_sum import energy_sum_db
+
+
+def applymap_energy_sum_db(tols_df):
+    """calc_broadband_spl's energy sum before it was vectorised."""
+    return (
+        10 * np.log10(tols_df.applymap(lambda x: 10 ** (x / 10)).sum(axis=1))
+    ).to_numpy()
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 2**16])
+@pytest.mark.parametrize("overwrite", [False, True])
+def test_energy_sum_db_matches_applymap(chunk_rows, overwrite):
+    rng = np.random.default_rng(0)
+    tols_df = pd.DataFrame(rng.normal(80, 20, size=(500, 31)))
+
+    result = energy_sum_db(
+        tols_df.to_numpy(copy=True), chunk_rows=chunk_rows, overwrite=overwrite
+    )
+
+    np.testing.assert_allclose(
+        result, applymap_energy_sum_db(tols_df), rtol=0, atol=1e-9
+    )
+
+
+def test_energy_sum_db_float32_doesnt_overflow():
+    # 10**(x/10) overflows float32 above about 385 dB.
+    levels = np.array([[400, 390, 100]], dtype="float32")
+
+    result = energy_sum_db(levels)
+
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(
+        result, 10 * np.log10(1e40 + 1e39 + 1e10), rtol=1e-6
+    )
+
+
+def test_energy_sum_db_unknown_backend():
+    with pytest.raises(ValueError):
+        energy_sum_db(np.zeros((2, 2)), backend="cuda")
+
+
+def test_calc_broadband_spl_matches_applymap(raw_month):
+    df, _ = raw_month
+    df = process_data.tol_headers_to_ints(
+        df.drop(columns=["1213", "file_id"]).dropna()
+    )
+    df = df[np.isfinite(df).all(axis=1)].astype("float32")
+    reference = applymap_energy_sum_db(df.loc[:, "25":"25119"])
+
+    df = process_data.calc_broadband_spl(df)
+
+    np.testing.assert_allclose(
+        df["unnormalised_broadband_spl"], reference, rtol=0, atol=1e-4
+    )
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from acoustic_data_science import config, helpers
+from acoustic_data_science.analysis import transient_durations
+
+
+def write_processed_months(processed_data_path, month_names, seed=0):
+    rng = np.random.default_rng(seed)
+    for month_name in month_names:
+        year, month = month_name.split("_")
+        df = pd.DataFrame(
+            {
+                "timestamp": pd.date_range(
+                    f"{year}-{month}-01", periods=2000, freq="500ms"
+                ),
+                "loud": rng.random(2000) < 0.3,
+            }
+        )
+        helpers.write_processed_month(
+            df,
+            helpers.feather_path_from_month_name(
+                processed_data_path, month_name
+            ),
+        )
+
+
+def test_monthly_transient_durations(tmp_path, monkeypatch):
+    processed_data_path = str(tmp_path / "processed")
+    durations_path = str(tmp_path / "durations")
+    monkeypatch.setattr(config, "processed_data_path", processed_data_path)
+    monkeypatch.setattr(
+        config, "monthly_transient_durations_path", durations_path
+    )
+    os.makedirs(os.path.join(processed_data_path, "monthly_data"))
+    write_processed_months(processed_data_path, ["2018_09", "2018_10"])
+
+    month_names, durations = (
+        transient_durations.get_monthly_transit_durations()
+    )
+
+    assert month_names == ["2018_09", "2018_10"]
+    for month_name, month_durations in zip(month_names, durations):
+        df = helpers.read_processed_month(
+            helpers.feather_path_from_month_name(
+                processed_data_path, month_name
+            )
+        )
+        np.testing.assert_array_equal(
+            month_durations,
+            transient_durations.get_transient_durations(df).astype("float32"),
+        )
+        assert not month_durations.flags.writeable
+
+    # Saved months aren't recalculated, removed months are forgotten.
+    september_path = helpers.get_transient_durations_path("2018_09")
+    os.utime(september_path, (2**31, 2**31))
+    os.remove(
+        helpers.feather_path_from_month_name(processed_data_path, "2018_10")
+    )
+    write_processed_months(processed_data_path, ["2018_11"], seed=1)
+
+    month_names, _ = transient_durations.get_monthly_transit_durations()
+
+    assert month_names == ["2018_09", "2018_11"]
+    assert os.path.getmtime(september_path) == 2**31
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from acoustic_data_science import config, helpers
+from acoustic_data_science.processing import process_data
+
+from tests.conftest import make_raw_month
+
+
+def write_raw_month(path, df, files_df):
+    raw_feather_path = str(path / "raw_feathers" / "2018_09.feather")
+    helpers.write_file_table(files_df, raw_feather_path)
+    df.to_feather(raw_feather_path)
+    return raw_feather_path
+
+
+@pytest.fixture
+def spilling_raw_month():
+    # Six hours from 20:00 on the last day of the month, so some rows spill
+    # over into the next month.
+    return make_raw_month(
+        n_files=3, rows_per_file=14400, seed=1, nan_rate=1e-3, inf_rate=1e-3
+    )
+
+
+@pytest.mark.parametrize("big_value_row", [None, 10, 40000])
+@pytest.mark.parametrize("chunk_rows", [7000, 10**6])
+def test_process_month_chunked_matches_process_df(
+    tmp_path, monkeypatch, spilling_raw_month, chunk_rows, big_value_row
+):
+    df, files_df = spilling_raw_month
+    if big_value_row is not None:
+        # Too big for float32, so the column is kept as float64, whichever
+        # chunk it is found in.
+        df.loc[big_value_row, "1000"] = 1e39
+    raw_feather_path = write_raw_month(tmp_path, df, files_df)
+    monkeypatch.setattr(config, "interim_data_path", str(tmp_path))
+
+    for month_name in ["2018_09", "2018_10"]:
+        expected = process_data.select_exactly_one_month(
+            process_data.process_df(
+                pd.read_feather(raw_feather_path), files_df
+            ),
+            month_name,
+        )
+        interim_feather_path = str(tmp_path / f"{month_name}.feather")
+
+        max_broadband_spl = process_data.process_month_chunked(
+            raw_feather_path, interim_feather_path, month_name, chunk_rows
+        )
+
+        df = pd.read_feather(interim_feather_path)
+        pd.testing.assert_frame_equal(df, expected, check_exact=True)
+        assert max_broadband_spl == (
+            expected["unnormalised_broadband_spl"].max()
+        )
+        if big_value_row is not None:
+            assert df["1000"].dtype == np.float64
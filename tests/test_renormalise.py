@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from acoustic_data_science import config, helpers
+from acoustic_data_science.processing import process_data
+
+
+@pytest.mark.parametrize("centi_db_levels", [False, True])
+def test_renormalise_shifts_by_the_change_of_max(
+    tmp_path, monkeypatch, centi_db_levels
+):
+    monkeypatch.setattr(config, "processed_data_path", str(tmp_path))
+    monkeypatch.setattr(config, "centi_db_levels", centi_db_levels)
+    os.makedirs(tmp_path / "monthly_data")
+    rng = np.random.default_rng(0)
+    unnormalised = rng.normal(100, 5, 5000).astype("float32")
+    background = rng.normal(-20, 2, 5000).astype("float32")
+    df = pd.DataFrame(
+        {
+            "timestamp": pd.date_range(
+                "2018-09-01", periods=5000, freq="500ms"
+            ),
+            "25": rng.normal(90, 5, 5000).astype("float32"),
+            "25119": rng.normal(60, 5, 5000).astype("float32"),
+            "unnormalised_broadband_spl": unnormalised,
+            "broadband_spl": unnormalised - np.float32(120.123),
+            "background_spl": background,
+            "loud": rng.random(5000) < 0.1,
+        }
+    )
+    feather_path = helpers.feather_path_from_month_name(
+        str(tmp_path), "2018_09"
+    )
+    helpers.write_processed_month(df, feather_path)
+    stored_df = helpers.read_processed_month(feather_path)
+
+    process_data.renormalise_processed_month("2018_09", 120.123, 125.4567)
+
+    df = helpers.read_processed_month(feather_path)
+    # Every background moves by the same amount, as in a full rebuild.
+    shifts = df["background_spl"] - stored_df["background_spl"]
+    tolerance = 0.005 + 1e-4 if centi_db_levels else 1e-4
+    assert np.ptp(shifts) < 1e-4
+    np.testing.assert_allclose(
+        shifts, 120.123 - 125.4567, rtol=0, atol=tolerance
+    )
+    np.testing.assert_allclose(
+        df["broadband_spl"],
+        stored_df["unnormalised_broadband_spl"] - 125.4567,
+        rtol=0,
+        atol=tolerance,
+    )
+    pd.testing.assert_series_equal(df["loud"], stored_df["loud"])
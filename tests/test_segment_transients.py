@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from acoustic_data_science.analysis import transient_durations
+
+
+def loop_get_transient_durations(df):
+    """get_transient_durations before segment_transients, on loud rows."""
+    df["index_group"] = df.index - np.arange(df.shape[0])
+
+    durations = []
+    for index_group in df["index_group"].unique():
+        transient_times = df[df["index_group"] == index_group][
+            "timestamp"
+        ].values
+        durations.append(
+            (transient_times[-1] - transient_times[0]).astype("float") / 1e9
+            + 0.5
+        )
+
+    return np.array(durations)
+
+
+def make_loud_df(n_rows, loud_fraction, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "timestamp": pd.Timestamp("2018-09-01")
+            + pd.to_timedelta(np.arange(n_rows) * 0.5, unit="s"),
+            "loud": rng.random(n_rows) < loud_fraction,
+        }
+    )
+    for band in ("25", "1000", "25119"):
+        df[band] = rng.normal(80, 10, n_rows).astype("float32")
+    return df
+
+
+@pytest.mark.parametrize("loud_fraction", [0, 0.3, 0.9, 1])
+def test_segment_transients_matches_loop(loud_fraction):
+    df = make_loud_df(2000, loud_fraction)
+    loud_df = df[df["loud"]].copy()
+
+    transients_df = transient_durations.segment_transients(df)
+
+    np.testing.assert_array_equal(
+        transients_df["duration"], loop_get_transient_durations(loud_df)
+    )
+    first_rows = loud_df.index[
+        np.diff(loud_df.index, prepend=-2) != 1
+    ].to_numpy()
+    np.testing.assert_array_equal(transients_df["start"], first_rows)
+    np.testing.assert_array_equal(
+        transients_df["timestamp"], df["timestamp"].to_numpy()[first_rows]
+    )
+
+
+def test_tol_aggregates_match_groupby():
+    df = make_loud_df(2000, 0.6)
+    loud_df = df[df["loud"]]
+    groups = loud_df.index - np.arange(len(loud_df))
+    tols_df = loud_df[["25", "1000", "25119"]].astype("float64")
+    grouped = tols_df.groupby(groups)
+
+    transients_df = transient_durations.segment_transients(
+        df, tol_aggregates=True
+    )
+
+    for band in tols_df.columns:
+        np.testing.assert_allclose(
+            transients_df[f"{band}_mean"], grouped[band].mean(), rtol=1e-12
+        )
+        np.testing.assert_array_equal(
+            transients_df[f"{band}_max"], grouped[band].max()
+        )
+        np.testing.assert_allclose(
+            transients_df[f"{band}_energy"],
+            10 * np.log10((10 ** (tols_df[band] / 10)).groupby(groups).sum()),
+            rtol=1e-12,
+        )
+
+
+def test_energy_means_match_groupby():
+    df = make_loud_df(2000, 0.6)
+    loud_df = df[df["loud"]]
+    groups = loud_df.index - np.arange(len(loud_df))
+    energies_df = 10 ** (
+        loud_df[["25", "1000", "25119"]].astype("float64") / 10
+    )
+
+    tol_columns, energy_means = transient_durations.get_transient_energy_means(
+        transient_durations.segment_transients(df, tol_aggregates=True)
+    )
+
+    assert list(tol_columns) == ["25", "1000", "25119"]
+    np.testing.assert_allclose(
+        energy_means, energies_df.groupby(groups).mean(), rtol=1e-12
+    )
@@ -0,0 +1,75 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from acoustic_data_science.processing import process_data
+
+
+def loop_get_timestamps(df):
+    """get_timestamps before it was vectorised, from a filename column."""
+    first_rows = np.unique(df["filename"].values, return_index=1)[1]
+    first_rows.sort()
+    last_rows = np.concatenate((first_rows[1:], [df.index[-1]])) - 1
+
+    df["timestamp"] = df["filename"].apply(process_data.get_timestamp)
+
+    time_windows = []
+    file_lengths = last_rows - first_rows + 1
+    file_lengths[-1] += 1
+    for file_length in file_lengths:
+        time_windows.append(
+            np.arange(file_length) * datetime.timedelta(seconds=0.5)
+        )
+    time_deltas = np.array(
+        [val for sublist in time_windows for val in sublist]
+    )
+
+    df["timestamp"] = df["timestamp"] + time_deltas
+    return df
+
+
+# The loop adds an object array of timedeltas.
+@pytest.mark.filterwarnings("ignore::pandas.errors.PerformanceWarning")
+def test_get_timestamps_matches_loop(raw_month):
+    df, files_df = raw_month
+    filenames = files_df["filename"].to_numpy()[df["file_id"].to_numpy()]
+    reference = loop_get_timestamps(df.assign(filename=filenames))
+
+    df = process_data.get_timestamps(df, files_df)
+
+    np.testing.assert_array_equal(
+        df["timestamp"].to_numpy(),
+        pd.to_datetime(reference["timestamp"]).to_numpy(),
+    )
+
+
+@pytest.mark.parametrize("chunk_rows", [7, 1199, 1200, 5000])
+def test_get_chunk_timestamps_matches_get_timestamps(raw_month, chunk_rows):
+    df, files_df = raw_month
+    reference = process_data.get_timestamps(df.copy(), files_df)
+
+    state = None
+    timestamps = []
+    for start in range(0, len(df), chunk_rows):
+        chunk, state = process_data.get_chunk_timestamps(
+            df.iloc[start : start + chunk_rows].reset_index(drop=True),
+            files_df,
+            state,
+        )
+        timestamps.append(chunk["timestamp"].to_numpy())
+
+    np.testing.assert_array_equal(
+        np.concatenate(timestamps), reference["timestamp"].to_numpy()
+    )
+
+
+def test_unrecognised_filenames_get_nat(raw_month):
+    df, files_df = raw_month
+    files_df.loc[2, "start_time"] = pd.NaT
+
+    df = process_data.get_timestamps(df, files_df)
+
+    nat = df["timestamp"].isna().to_numpy()
+    np.testing.assert_array_equal(nat, df["file_id"].to_numpy() == 2)